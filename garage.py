@@ -147,10 +147,35 @@ import re
 import sqlite3
 import shutil
 import uuid
+import atexit
+import bisect
+import collections
+import contextlib
+import functools
+import gzip
+import hashlib
+import heapq
+import http.server
+import io
+import itertools
+import json
+import math
+import queue
+import random
+import tarfile
+import tempfile
+import threading
+import time
+import tracemalloc
+import traceback
+import unicodedata
+import urllib.parse
 import tkinter as tk
 import tkinter.font as tkfont
-from tkinter import ttk, messagebox, filedialog
-from datetime import datetime, date
+from tkinter import ttk, messagebox, filedialog, simpledialog
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, date, timedelta
 import sys
 
 # Pillow est recommandé pour afficher les PNG de manière fiable sur macOS.
@@ -203,14 +228,54 @@ VEHICLE_PHOTOS_DIR = os.path.join(USER_DIR, "vehicle_photos")  # photos utilisat
 
 
 # ----------------- Helpers -----------------
-
-def _connect_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_FILE)
+# Accès concurrent (plusieurs fenêtres, interface + script, API) : base en WAL (les lectures ne
+# bloquent pas l'écriture), attente sur verrou puis nouvelles tentatives espacées.
+DB_BUSY_TIMEOUT_S = 5.0    # attente de SQLite sur une base verrouillée, par instruction
+DB_BUSY_RETRIES = 5        # nouvelles tentatives d'une écriture encore refusée (verrou)
+DB_BUSY_BACKOFF_S = 0.1    # premier délai, doublé à chaque tentative (+ aléa)
+DB_WATCH_MS = 2000         # interface : détection des écritures d'un autre processus
+
+
+def _connect_db(full_history: bool = False) -> sqlite3.Connection:
+    """Connexion à la base courante ; full_history=True attache aussi l'archive (vues pleins_all / entretiens_all)."""
+    factory = _ProfiledConnection if _sql_profiler.enabled else sqlite3.Connection
+    conn = sqlite3.connect(DB_FILE, timeout=DB_BUSY_TIMEOUT_S, factory=factory)
     conn.row_factory = sqlite3.Row
+    _perf.incr("connexions")
+    if factory is sqlite3.Connection:
+        conn.set_trace_callback(_perf.count_statement)  # la connexion profilée compte dans sa propre trace
     conn.execute("PRAGMA foreign_keys = ON")
+    conn.create_function("norm_texte", 1, _norm_text, deterministic=True)  # clé des lieux (lieux_stats)
+    conn.create_function("processus", 0, lambda: _PROCESS_TAG)  # auteur des lignes du journal
+    if full_history:
+        _attach_archive(conn)
     return conn
 
 
+def _is_busy_error(exc: BaseException) -> bool:
+    """Base verrouillée par un autre processus (SQLITE_BUSY / SQLITE_LOCKED)."""
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    code = getattr(exc, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(exc) or "busy" in str(exc)
+
+
+def call_with_busy_retry(fn, *args, **kwargs):
+    """Appelle une écriture ; si la base reste verrouillée au-delà de DB_BUSY_TIMEOUT_S, réessaie
+    avec un délai croissant. fn doit ne rien avoir validé quand elle échoue (un seul commit, à la fin)."""
+    delay = DB_BUSY_BACKOFF_S
+    for attempt in range(DB_BUSY_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if attempt == DB_BUSY_RETRIES or not _is_busy_error(e):
+                raise
+        time.sleep(delay * (1 + random.random()))
+        delay *= 2
+
+
 def _columns(cur: sqlite3.Cursor, table: str) -> set[str]:
     cur.execute(f"PRAGMA table_info({table})")
     return {r["name"] for r in cur.fetchall()}
@@ -226,7 +291,7 @@ def _ensure_schema():
     Crée les tables minimum si elles n'existent pas (ne détruit rien),
     puis applique des migrations légères idempotentes.
     """
-    conn = _connect_db()
+    conn = _connect_db(full_history=True)  # agrégats reconstruits sur tout l'historique
     cur = conn.cursor()
 
     # Tables minimales
@@ -347,9 +412,473 @@ def _ensure_schema():
             FOREIGN KEY(vehicule_id) REFERENCES vehicules(id) ON DELETE CASCADE
         )""")
 
+    # Classification Réparation / Entretien calculée à l'écriture (+ mots-clés éditables)
+    if not _table_exists(cur, "mots_cles_reparation"):
+        cur.execute("CREATE TABLE mots_cles_reparation(mot TEXT PRIMARY KEY)")
+        cur.executemany("INSERT INTO mots_cles_reparation(mot) VALUES (?)",
+                        [(k,) for k in DEFAULT_REPAIR_KEYWORDS])
+    if "is_repair" not in _columns(cur, "entretiens"):
+        cur.execute("ALTER TABLE entretiens ADD COLUMN is_repair INTEGER NOT NULL DEFAULT 0")
+        _reclassify_entretiens(cur)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_entretiens_repair ON entretiens(vehicule_id, is_repair)")
+
+    # Jour ordinal entier (= date.toordinal()) à côté de date_iso : tris, plages et écarts en entiers
+    for table in _ARCHIVED_TABLES:
+        if "jour" not in _columns(cur, table):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN jour INTEGER")
+            cur.execute(f"UPDATE {table} SET jour = {_JOUR_SQL.format(d='date_iso')}")
+        for sql in _jour_triggers(table):
+            cur.execute(sql)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_jour ON {table}(vehicule_id, jour)")
+        if _archive_attached(conn) and cur.execute(f"PRAGMA archive.table_info({table})").fetchone():
+            _sync_archive_table(cur, table)  # archive existante : mêmes colonnes et index de période
+    # Dernier entretien d'un type (échéances) : recherche + tri servis par l'index (id = rowid implicite)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_entretiens_type ON entretiens(vehicule_id, type_id, jour, km)")
+
+    # Réglages de l'application (clé / valeur texte)
+    cur.execute("CREATE TABLE IF NOT EXISTS parametres(cle TEXT PRIMARY KEY, valeur TEXT)")
+
+    # État du contrôle d'anomalies des pleins (une ligne par véhicule, rejouée à la demande)
+    cur.execute("""CREATE TABLE IF NOT EXISTS stats_pleins(
+            vehicule_id INTEGER PRIMARY KEY,
+            last_jour INTEGER,
+            last_km INTEGER,
+            n_conso INTEGER NOT NULL DEFAULT 0,
+            mean_conso REAL NOT NULL DEFAULT 0,
+            m2_conso REAL NOT NULL DEFAULT 0,
+            n_rythme INTEGER NOT NULL DEFAULT 0,
+            mean_rythme REAL NOT NULL DEFAULT 0,
+            m2_rythme REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(vehicule_id) REFERENCES vehicules(id) ON DELETE CASCADE
+        )""")
+
+    # Agrégats de coûts (véhicule, mois, source, kind, réparation) tenus à jour par triggers
+    if _ensure_cost_aggregates(cur):
+        _rebuild_cost_aggregates(cur)
+
+    # Statistiques d'usage des lieux de plein (autocomplétion partagée), tenues par triggers.
+    # Clé = norm_texte(lieu), la même que LieuIndex (l'ancienne clé NOCASE distinguait les accents).
+    if _table_exists(cur, "lieux_stats") and "cle" not in _columns(cur, "lieux_stats"):
+        for suffix in ("ai", "ad", "au_old", "au_new"):
+            cur.execute(f"DROP TRIGGER IF EXISTS trg_lieux_{suffix}")
+        cur.execute("DROP TABLE lieux_stats")
+    if not _table_exists(cur, "lieux_stats"):
+        cur.execute("""CREATE TABLE lieux_stats(
+                cle TEXT PRIMARY KEY,
+                lieu TEXT NOT NULL,
+                n INTEGER NOT NULL DEFAULT 0,
+                last_date TEXT
+            )""")
+        _rebuild_lieux_stats(cur)
+    for sql in _lieu_stats_triggers():
+        cur.execute(sql)
+
+    # Index plein texte (FTS5) entretiens + préconisations, si SQLite le supporte
+    if _ensure_search_index(cur):
+        _rebuild_search_index(cur)
+
+    # Journal des modifications (deltas entre postes)
+    _ensure_journal(cur)
+
+    # Archivage interrompu entre ses deux transactions : la ligne encore présente ici fait foi
+    if _archive_attached(conn):
+        for table in _ARCHIVED_TABLES:
+            if cur.execute(f"PRAGMA archive.table_info({table})").fetchone():
+                cur.execute(f"DELETE FROM archive.{table} WHERE id IN (SELECT id FROM main.{table})")
+
+    # Entretiens archivés avant que la recherche ne couvre l'archive : réindexation unique
+    if _table_exists(cur, "recherche") and _archive_attached(conn) and not cur.execute(
+            "SELECT 1 FROM parametres WHERE cle = 'recherche_archive'").fetchone():
+        _rebuild_search_index(cur)
+
+    conn.commit()
+    # WAL (persistant dans le fichier) sauf si désactivé : base sur un partage réseau
+    r = cur.execute("SELECT valeur FROM parametres WHERE cle = 'journal_wal'").fetchone()
+    mode = "DELETE" if r is not None and r["valeur"] == "0" else "WAL"
+    try:
+        cur.execute(f"PRAGMA journal_mode = {mode}")
+    except sqlite3.OperationalError:
+        pass  # autre instance en cours d'écriture : le mode sera appliqué au prochain démarrage
+    conn.close()
+
+
+# julianday('0001-01-01') = 1721425.5 : on retrouve exactement date.toordinal() de Python
+_JOUR_SQL = "CAST(julianday({d}) - 1721424.5 AS INTEGER)"
+_MPL_EPOCH_ORD = date(1970, 1, 1).toordinal()  # jour -> date Matplotlib (jours depuis 1970)
 
+
+def _jour_triggers(table: str) -> list[str]:
+    """Triggers qui recalculent la colonne jour quand date_iso est écrite."""
+    set_jour = f"UPDATE {table} SET jour = {_JOUR_SQL.format(d='NEW.date_iso')} WHERE id = NEW.id;"
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_jour_{table}_ai AFTER INSERT ON {table}
+            BEGIN {set_jour} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_jour_{table}_au AFTER UPDATE OF date_iso ON {table}
+            BEGIN {set_jour} END""",
+    ]
+
+
+def _lieu_stats_triggers() -> list[str]:
+    """Triggers qui comptent les usages de chaque lieu (pleins) dans lieux_stats.
+
+    Un retrait recalcule la date la plus récente de la clé depuis les pleins restants (une
+    modification de date ou une suppression peut la faire reculer) ; les pleins archivés ne
+    sont visibles que des reconstructions complètes (_rebuild_lieux_stats).
+    """
+    def add(row: str) -> str:
+        return f"""INSERT INTO lieux_stats(cle, lieu, n, last_date)
+                   VALUES (norm_texte({row}.lieu), TRIM({row}.lieu), 1, {row}.date_iso)
+                   ON CONFLICT(cle) DO UPDATE
+                   SET n = n + 1, last_date = MAX(COALESCE(last_date, ''), COALESCE(excluded.last_date, ''));"""
+
+    def remove(row: str) -> str:
+        return f"""UPDATE lieux_stats SET n = n - 1,
+                       last_date = (SELECT MAX(p.date_iso) FROM pleins p
+                                    WHERE p.lieu IS NOT NULL AND norm_texte(p.lieu) = lieux_stats.cle)
+                   WHERE cle = norm_texte({row}.lieu);
+                   DELETE FROM lieux_stats WHERE cle = norm_texte({row}.lieu) AND n <= 0;"""
+
+    def valid(row: str) -> str:
+        return f"{row}.lieu IS NOT NULL AND TRIM({row}.lieu) <> ''"
+
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_lieux_ai AFTER INSERT ON pleins
+            WHEN {valid('NEW')} BEGIN {add('NEW')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_lieux_ad AFTER DELETE ON pleins
+            WHEN {valid('OLD')} BEGIN {remove('OLD')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_lieux_au_old AFTER UPDATE OF lieu, date_iso ON pleins
+            WHEN {valid('OLD')} BEGIN {remove('OLD')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_lieux_au_new AFTER UPDATE OF lieu, date_iso ON pleins
+            WHEN {valid('NEW')} BEGIN {add('NEW')} END""",
+    ]
+
+
+# Recherche plein texte : une seule table FTS5 pour classer entretiens et préconisations ensemble.
+# rowid = id*2 pour un entretien, id*2+1 pour une préconisation (suppression directe par rowid).
+_SEARCH_TRIGGERS = {
+    "entretiens": ("intervention, details, performed_by, vehicule_id",
+                   """INSERT INTO recherche(rowid, intervention, details, performed_by, texte, vehicule_id, source)
+                      VALUES ({p}.id * 2, {p}.intervention, {p}.details, {p}.performed_by, NULL,
+                              {p}.vehicule_id, 'entretien');""",
+                   "DELETE FROM recherche WHERE rowid = {p}.id * 2;"),
+    "preconisations": ("texte, vehicule_id",
+                       """INSERT INTO recherche(rowid, intervention, details, performed_by, texte, vehicule_id, source)
+                          VALUES ({p}.id * 2 + 1, NULL, NULL, NULL, {p}.texte, {p}.vehicule_id, 'preco');""",
+                       "DELETE FROM recherche WHERE rowid = {p}.id * 2 + 1;"),
+}
+
+
+def _ensure_search_index(cur: sqlite3.Cursor) -> bool:
+    """Crée la table FTS5 `recherche` et ses triggers. Retourne True si elle vient d'être créée.
+
+    Sans FTS5 (SQLite compilé sans), on ne crée rien : search_records() bascule sur LIKE.
+    """
+    created = False
+    if not _table_exists(cur, "recherche"):
+        try:
+            cur.execute("""CREATE VIRTUAL TABLE recherche USING fts5(
+                    intervention, details, performed_by, texte,
+                    vehicule_id UNINDEXED, source UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )""")
+        except sqlite3.OperationalError:
+            return False
+        created = True
+
+    for table, (watched, add, remove) in _SEARCH_TRIGGERS.items():
+        cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_recherche_{table}_ai AFTER INSERT ON {table}
+                        BEGIN {add.format(p='NEW')} END""")
+        cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_recherche_{table}_ad AFTER DELETE ON {table}
+                        BEGIN {remove.format(p='OLD')} END""")
+        cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_recherche_{table}_au AFTER UPDATE OF {watched} ON {table}
+                        BEGIN {remove.format(p='OLD')} {add.format(p='NEW')} END""")
+    return created
+
+
+def _search_index_archived(cur: sqlite3.Cursor, where: str = "1", args=()) -> None:
+    """Indexe les entretiens archivés choisis par `where` (sans trigger dans l'archive, à la main)."""
+    if not _archive_attached(cur.connection) or not cur.execute("PRAGMA archive.table_info(entretiens)").fetchone():
+        return
+    cur.execute(f"""INSERT INTO recherche(rowid, intervention, details, performed_by, texte, vehicule_id, source)
+                    SELECT id * 2, intervention, details, performed_by, NULL, vehicule_id, 'entretien'
+                    FROM archive.entretiens WHERE {where}""", args)
+
+
+def _search_unindex_archived(cur: sqlite3.Cursor, where: str, args=()) -> None:
+    """Retire de `recherche` les entretiens archivés choisis par `where` (avant leur suppression)."""
+    if (_archive_attached(cur.connection) and _table_exists(cur, "recherche")
+            and cur.execute("PRAGMA archive.table_info(entretiens)").fetchone()):
+        cur.execute(f"DELETE FROM recherche WHERE rowid IN (SELECT id * 2 FROM archive.entretiens WHERE {where})",
+                    args)
+
+
+def _rebuild_search_index(cur: sqlite3.Cursor) -> None:
+    """Réindexe tout l'historique dans `recherche`, entretiens archivés compris si l'archive est attachée."""
+    cur.execute("DELETE FROM recherche")
+    cur.execute("""INSERT INTO recherche(rowid, intervention, details, performed_by, texte, vehicule_id, source)
+                   SELECT id * 2, intervention, details, performed_by, NULL, vehicule_id, 'entretien'
+                   FROM entretiens""")
+    _search_index_archived(cur)
+    if _archive_attached(cur.connection):
+        cur.execute("INSERT OR REPLACE INTO parametres(cle, valeur) VALUES ('recherche_archive', '1')")
+    cur.execute("""INSERT INTO recherche(rowid, intervention, details, performed_by, texte, vehicule_id, source)
+                   SELECT id * 2 + 1, NULL, NULL, NULL, texte, vehicule_id, 'preco'
+                   FROM preconisations""")
+
+
+# Coût d'un plein : total saisi, sinon litres × prix/L
+_PLEIN_COST_SQL = "COALESCE({p}.total, {p}.litres * {p}.prix_litre)"
+
+# Triggers d'agrégats (supprimés puis recréés si la structure de couts_mensuels change)
+_COST_TRIGGER_NAMES = [f"trg_couts_{t}_{s}" for t in ("entretiens", "pleins") for s in ("ai", "ad", "au_old", "au_new")]
+
+
+def _cost_aggregate_triggers(table: str, source: str, cost: str, kind: str, is_repair: str) -> list[str]:
+    """Triggers qui répercutent INSERT/UPDATE/DELETE d'une table de coûts sur couts_mensuels."""
+    def add(row: str) -> str:
+        return f"""INSERT INTO couts_mensuels(vehicule_id, mois, source, kind, is_repair, total, n)
+                   VALUES ({row}.vehicule_id, SUBSTR({row}.date_iso, 1, 7), '{source}', {kind.format(p=row)},
+                           {is_repair.format(p=row)}, {cost.format(p=row)}, 1)
+                   ON CONFLICT(vehicule_id, mois, source, kind, is_repair)
+                   DO UPDATE SET total = total + excluded.total, n = n + 1;"""
+
+    def remove(row: str) -> str:
+        key = (f"vehicule_id = {row}.vehicule_id AND mois = SUBSTR({row}.date_iso, 1, 7) "
+               f"AND source = '{source}' AND kind = {kind.format(p=row)} AND is_repair = {is_repair.format(p=row)}")
+        return f"""UPDATE couts_mensuels SET total = total - {cost.format(p=row)}, n = n - 1 WHERE {key};
+                   DELETE FROM couts_mensuels WHERE {key} AND n <= 0;"""
+
+    def valid(row: str) -> str:
+        return f"{row}.date_iso IS NOT NULL AND {cost.format(p=row)} IS NOT NULL"
+
+    if table == "entretiens":
+        watched = "vehicule_id, date_iso, cout, kind, is_repair"
+    else:
+        watched = "vehicule_id, date_iso, total, litres, prix_litre"
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_couts_{table}_ai AFTER INSERT ON {table}
+            WHEN {valid('NEW')} BEGIN {add('NEW')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_couts_{table}_ad AFTER DELETE ON {table}
+            WHEN {valid('OLD')} BEGIN {remove('OLD')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_couts_{table}_au_old AFTER UPDATE OF {watched} ON {table}
+            WHEN {valid('OLD')} BEGIN {remove('OLD')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_couts_{table}_au_new AFTER UPDATE OF {watched} ON {table}
+            WHEN {valid('NEW')} BEGIN {add('NEW')} END""",
+    ]
+
+
+def _ensure_cost_aggregates(cur: sqlite3.Cursor) -> bool:
+    """Crée la table d'agrégats mensuels et ses triggers (idempotent).
+
+    Retourne True si la table vient d'être (re)créée et doit être remplie.
+    """
+    created = False
+    if _table_exists(cur, "couts_mensuels") and "is_repair" not in _columns(cur, "couts_mensuels"):
+        # Ancienne structure (sans is_repair) : données dérivées, on recrée tout
+        for name in _COST_TRIGGER_NAMES:
+            cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cur.execute("DROP TABLE couts_mensuels")
+
+    if not _table_exists(cur, "couts_mensuels"):
+        cur.execute("""CREATE TABLE couts_mensuels(
+                vehicule_id INTEGER NOT NULL,
+                mois TEXT NOT NULL,                 -- YYYY-MM
+                source TEXT NOT NULL,               -- 'entretien' ou 'plein'
+                kind TEXT NOT NULL DEFAULT '',      -- entretiens.kind ('' pour les pleins)
+                is_repair INTEGER NOT NULL DEFAULT 0,
+                total REAL NOT NULL DEFAULT 0,
+                n INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY(vehicule_id, mois, source, kind, is_repair)
+            ) WITHOUT ROWID""")
+        created = True
+    cur.execute("DROP VIEW IF EXISTS couts_annuels")  # vue annuelle sans lecteur, retirée
+
+    triggers = (_cost_aggregate_triggers("entretiens", "entretien", "{p}.cout",
+                                         "COALESCE({p}.kind, '')", "COALESCE({p}.is_repair, 0)")
+                + _cost_aggregate_triggers("pleins", "plein", _PLEIN_COST_SQL, "''", "0"))
+    for sql in triggers:
+        cur.execute(sql)
+    return created
+
+
+def _rebuild_cost_aggregates(cur: sqlite3.Cursor) -> None:
+    """Recalcule entièrement couts_mensuels depuis l'historique (archive comprise)."""
+    _create_history_views(cur.connection)
+    cur.execute("DELETE FROM couts_mensuels")
+    cur.execute("""INSERT INTO couts_mensuels(vehicule_id, mois, source, kind, is_repair, total, n)
+                   SELECT vehicule_id, SUBSTR(date_iso, 1, 7), 'entretien', COALESCE(kind, ''),
+                          COALESCE(is_repair, 0), SUM(cout), COUNT(*)
+                   FROM entretiens_all
+                   WHERE date_iso IS NOT NULL AND cout IS NOT NULL
+                   GROUP BY 1, 2, 3, 4, 5""")
+    cur.execute(f"""INSERT INTO couts_mensuels(vehicule_id, mois, source, kind, is_repair, total, n)
+                   SELECT vehicule_id, SUBSTR(date_iso, 1, 7), 'plein', '', 0,
+                          SUM({_PLEIN_COST_SQL.format(p='pleins_all')}), COUNT(*)
+                   FROM pleins_all
+                   WHERE date_iso IS NOT NULL AND {_PLEIN_COST_SQL.format(p='pleins_all')} IS NOT NULL
+                   GROUP BY 1, 2, 3, 4, 5""")
+
+
+def _rebuild_lieux_stats(cur: sqlite3.Cursor) -> None:
+    """Recalcule lieux_stats depuis tous les pleins (archive comprise)."""
+    _create_history_views(cur.connection)
+    cur.execute("DELETE FROM lieux_stats")
+    cur.execute("""INSERT INTO lieux_stats(cle, lieu, n, last_date)
+                   SELECT norm_texte(lieu), MIN(TRIM(lieu)), COUNT(*), MAX(date_iso) FROM pleins_all
+                   WHERE lieu IS NOT NULL AND TRIM(lieu) <> ''
+                   GROUP BY 1""")
+
+
+def rebuild_cost_aggregates() -> int:
+    """Reconstruit les agrégats de coûts (commande --rebuild-aggregates). Retourne le nb de lignes."""
+    conn = _connect_db(full_history=True)
+    cur = conn.cursor()
+    _ensure_cost_aggregates(cur)
+    _rebuild_cost_aggregates(cur)
+    cur.execute("SELECT COUNT(*) AS n FROM couts_mensuels")
+    n = int(cur.fetchone()["n"])
     conn.commit()
     conn.close()
+    return n
+
+
+# ----------------- Archive de l'historique -----------------
+# Les pleins / entretiens anciens peuvent être déplacés dans un fichier SQLite séparé : la base
+# courante (écrans du quotidien) reste petite, les graphes lisent tout via les vues *_all.
+ARCHIVE_DB_FILE = os.path.join(USER_DIR, "garage_archive.db")
+_ARCHIVED_TABLES = ("pleins", "entretiens")
+
+# Lignes jamais archivées : dernier plein de chaque véhicule, dernier entretien de chaque type
+# et dernière mesure batterie (rappels, km courant) ; plus le MAX(id), les anciennes bases sans
+# AUTOINCREMENT pouvant sinon réattribuer un id déjà présent dans l'archive.
+_ARCHIVE_KEEP_SQL = {
+    "pleins": """
+        SELECT id FROM (SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY vehicule_id ORDER BY jour DESC, km DESC, id DESC) AS rn FROM main.pleins)
+        WHERE rn = 1
+        UNION SELECT MAX(id) FROM main.pleins""",
+    "entretiens": """
+        SELECT id FROM (SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY vehicule_id, type_id ORDER BY jour DESC, km DESC, id DESC) AS rn FROM main.entretiens)
+        WHERE rn = 1
+        UNION SELECT id FROM (SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY vehicule_id ORDER BY jour DESC, km DESC, id DESC) AS rn
+            FROM main.entretiens WHERE battery_voltage IS NOT NULL)
+        WHERE rn = 1
+        UNION SELECT MAX(id) FROM main.entretiens""",
+}
+
+
+def _archive_attached(conn: sqlite3.Connection) -> bool:
+    return any(r[1] == "archive" for r in conn.execute("PRAGMA database_list"))
+
+
+def _attach_archive(conn: sqlite3.Connection) -> bool:
+    """Attache l'archive si elle existe (hors transaction) puis crée les vues d'historique complet."""
+    if not _archive_attached(conn) and os.path.exists(ARCHIVE_DB_FILE):
+        conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_FILE,))
+    _create_history_views(conn)
+    return _archive_attached(conn)
+
+
+def _create_history_views(conn: sqlite3.Connection) -> None:
+    """Vues TEMP pleins_all / entretiens_all : base courante UNION ALL archive (si attachée).
+
+    Sans archive, elles ne couvrent que la base courante : une requête « tout l'historique »
+    s'écrit donc toujours sur *_all. Une colonne absente de l'archive (migration postérieure)
+    est lue à NULL.
+    """
+    attached = _archive_attached(conn)
+    for table in _ARCHIVED_TABLES:
+        cols = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table})")]
+        if not cols:
+            continue
+        sql = f"SELECT {', '.join(cols)} FROM main.{table}"
+        arch_cols = {r[1] for r in conn.execute(f"PRAGMA archive.table_info({table})")} if attached else set()
+        if arch_cols:
+            missing = {"jour": f"{_JOUR_SQL.format(d='date_iso')} AS jour"}
+            sel = ", ".join(c if c in arch_cols else missing.get(c, f"NULL AS {c}") for c in cols)
+            sql += f" UNION ALL SELECT {sel} FROM archive.{table}"
+        conn.execute(f"DROP VIEW IF EXISTS temp.{table}_all")
+        conn.execute(f"CREATE TEMP VIEW {table}_all AS {sql}")
+
+
+def _sync_archive_table(cur: sqlite3.Cursor, table: str) -> list[str]:
+    """Crée / complète la table d'archive sur le modèle de la table courante ; retourne ses colonnes."""
+    info = cur.execute(f"PRAGMA main.table_info({table})").fetchall()
+    cols = [r["name"] for r in info]
+    existing = {r["name"] for r in cur.execute(f"PRAGMA archive.table_info({table})")}
+    if not existing:
+        defs = ", ".join(f"{r['name']} {r['type']}".strip() + (" PRIMARY KEY" if r["name"] == "id" else "")
+                         for r in info)
+        cur.execute(f"CREATE TABLE archive.{table}({defs})")
+        cur.execute(f"CREATE INDEX archive.idx_{table}_vehicule ON {table}(vehicule_id, date_iso)")
+    else:
+        for r in info:
+            if r["name"] not in existing:
+                cur.execute(f"ALTER TABLE archive.{table} ADD COLUMN {r['name']} {r['type']}")
+                if r["name"] == "jour":
+                    cur.execute(f"UPDATE archive.{table} SET jour = {_JOUR_SQL.format(d='date_iso')}")
+    if "jour" in cols:
+        # filtres de période sur l'historique complet (vues *_all)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS archive.idx_{table}_jour ON {table}(vehicule_id, jour)")
+    return cols
+
+
+def archive_history(cutoff_iso: str) -> dict[str, int]:
+    """Déplace pleins et entretiens antérieurs à cutoff_iso (AAAA-MM-JJ) dans l'archive.
+
+    En WAL, une transaction sur deux fichiers n'est pas atomique : on copie d'abord dans
+    l'archive (1re transaction) puis on retire de la base courante les lignes restées
+    identiques (2e) ; une copie dont l'original a changé entre-temps est abandonnée, et un
+    arrêt entre les deux est réparé par _ensure_schema. Les triggers retirent les lignes
+    déplacées des tables dérivées : agrégats de coûts et lieux sont ensuite recalculés sur
+    l'historique complet. Les entretiens déplacés restent dans la recherche plein texte.
+    """
+    moved = {}
+    jour = _parse_iso_date(cutoff_iso).toordinal()
+    conn = _connect_db()
+    cur = conn.cursor()
+    cur.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_FILE,))  # crée le fichier au besoin
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cols = {}
+        for table in _ARCHIVED_TABLES:
+            cols[table] = _sync_archive_table(cur, table)
+            listed = ", ".join(cols[table])
+            cur.execute(f"DROP TABLE IF EXISTS temp.a_deplacer_{table}")
+            cur.execute(f"""CREATE TEMP TABLE a_deplacer_{table} AS
+                            SELECT id FROM main.{table}
+                            WHERE jour < ? AND id NOT IN ({_ARCHIVE_KEEP_SQL[table]})""", (jour,))
+            cur.execute(f"""INSERT OR REPLACE INTO archive.{table}({listed})
+                            SELECT {listed} FROM main.{table} WHERE id IN (SELECT id FROM temp.a_deplacer_{table})""")
+        conn.commit()
+
+        cur.execute("BEGIN IMMEDIATE")
+        seq0 = cur.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0]
+        for table in _ARCHIVED_TABLES:
+            same = " AND ".join(f"m.{c} IS a.{c}" for c in cols[table])
+            cur.execute(f"""DELETE FROM main.{table} WHERE id IN (
+                                SELECT m.id FROM main.{table} m JOIN archive.{table} a ON a.id = m.id
+                                WHERE m.id IN (SELECT id FROM temp.a_deplacer_{table}) AND {same})""")
+            moved[table] = cur.rowcount
+            cur.execute(f"DELETE FROM archive.{table} WHERE id IN (SELECT id FROM main.{table})")
+            if table == "entretiens" and _table_exists(cur, "recherche"):
+                # le trigger de suppression vient de les retirer de l'index : on les y remet
+                _search_index_archived(cur, "id IN (SELECT id FROM temp.a_deplacer_entretiens)")
+            cur.execute(f"DROP TABLE temp.a_deplacer_{table}")
+        # Un archivage n'est pas une suppression : rien à transmettre aux autres postes
+        cur.execute("DELETE FROM journal WHERE seq > ?", (seq0,))
+        _rebuild_cost_aggregates(cur)
+        _rebuild_lieux_stats(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    _data_changed()
+    return moved
 
 
 def _ensure_assets_dir():
@@ -441,13 +970,15 @@ def _parse_iso_date(value):
         return value
     if isinstance(value, datetime):
         return value.date()
+    if isinstance(value, int):
+        return date.fromordinal(value) if value > 0 else None  # colonne jour
     if isinstance(value, str):
         s = value.strip()
         if not s:
             return None
         s = s.split("T")[0].split(" ")[0]
         try:
-            return datetime.strptime(s, "%Y-%m-%d").date()
+            return date.fromisoformat(s)
         except Exception:
             return None
     return None
@@ -515,14 +1046,23 @@ def _jjmmaa_from_iso(iso_s: str) -> str:
     return d.strftime("%d/%m/%y") if d else ""
 
 
-def _apply_autocomplete(combo: ttk.Combobox, all_values, typed: str):
-    """Filtre les valeurs d'une Combobox en fonction du texte saisi (préfixe)."""
-    t = (typed or "").strip().lower()
-    if not t:
-        combo["values"] = all_values
-        return
-    filtered = [v for v in all_values if (v or "").lower().startswith(t)]
-    combo["values"] = filtered if filtered else all_values
+def _bind_lieu_autocomplete(combo: ttk.Combobox, var: tk.StringVar, delay_ms: int = 150) -> None:
+    """Autocomplétion Lieu : suggestions de l'index partagé, recalculées après une courte pause de frappe."""
+    pending = {"after": None}
+
+    def refresh():
+        pending["after"] = None
+        combo["values"] = lieu_index().suggest(var.get())
+
+    def on_key(evt):
+        if evt.keysym in ("Up", "Down", "Return", "KP_Enter", "Escape", "Tab"):
+            return
+        if pending["after"] is not None:
+            combo.after_cancel(pending["after"])
+        pending["after"] = combo.after(delay_ms, refresh)
+
+    combo.bind("<KeyRelease>", on_key)
+    combo["values"] = lieu_index().suggest("")
 
 
 def _format_frequency(period_km, period_months) -> str:
@@ -562,27 +1102,544 @@ def _add_months(d: date, months: int) -> date:
     day = min(d.day, last_day)
     return date(y, m, day)
 
-# ----------------- DB API : Véhicules -----------------
 
-def list_vehicles():
-    conn = _connect_db()
+# ----------------- Classification Réparation / Entretien -----------------
+
+# Mots-clés par défaut (sans accents, en minuscules) : copiés dans mots_cles_reparation à la création
+DEFAULT_REPAIR_KEYWORDS = (
+    "repar", "depann", "panne", "casse", "diagnost", "garagiste", "garage",
+    "embrayage", "turbo", "inject", "pompe", "alternat", "demarreur",
+    "joint", "culasse", "boite", "distribution", "radiateur", "amortisseur",
+    "triangle", "rotule", "roulement", "cardan", "fuite", "freinage"
+)
+
+# Cache des mots-clés en base (None = à relire)
+_repair_keywords_cache: tuple[str, ...] | None = None
+
+
+def _norm_text(s) -> str:
+    """Minuscules, sans accents (NFKD), espaces de bord retirés."""
+    if s is None:
+        return ""
+    s = unicodedata.normalize("NFKD", str(s))
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    return s.lower().strip()
+
+
+@functools.lru_cache(maxsize=8)
+def _repair_matcher(keywords: tuple[str, ...]):
+    """Regex compilée (une seule passe) qui trouve n'importe quel mot-clé."""
+    keys = sorted({k for k in keywords if k}, key=len, reverse=True)
+    if not keys:
+        return None
+    return re.compile("|".join(re.escape(k) for k in keys))
+
+
+def classify_repair(kind, intervention, details, keywords: tuple[str, ...] | None = None) -> int:
+    """1 si l'entretien est une réparation (mot-clé trouvé dans kind/intervention/détails), sinon 0."""
+    if keywords is None:
+        keywords = list_repair_keywords()
+    matcher = _repair_matcher(tuple(keywords))
+    if matcher is None:
+        return 0
+    blob = f"{_norm_text(kind)} {_norm_text(intervention)} {_norm_text(details)}"
+    return 1 if matcher.search(blob) else 0
+
+# ----------------- Enregistrements typés -----------------
+class _Record:
+    """Ligne décodée une seule fois à la lecture : attributs typés dans des __slots__.
+
+    Reste compatible avec l'usage de sqlite3.Row (r["champ"], r[0], r.keys()) ; une colonne
+    non sélectionnée par la requête vaut None.
+    """
+    __slots__ = ()
+    _fields: tuple[str, ...] = ()
+    _decoders: dict = {}
+
+    def __init__(self, *values):
+        for name, value in zip(self._fields, values):
+            setattr(self, name, value)
+
+    def _finish(self) -> None:
+        """Champs dérivés, calculés après décodage (voir _DatedRecord)."""
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return getattr(self, self._fields[key])
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise IndexError(f"No item with that key: {key!r}") from None
+
+    def keys(self) -> list[str]:
+        return list(self._fields)
+
+    def __iter__(self):
+        return (getattr(self, f) for f in self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{f}={getattr(self, f)!r}' for f in self._fields)})"
+
+
+class _DatedRecord(_Record):
+    """Enregistrement daté : `date` (datetime.date) issu de jour, sinon de date_iso."""
+    __slots__ = ()
+
+    def _finish(self) -> None:
+        self.date = date.fromordinal(self.jour) if self.jour else _parse_iso_date(self.date_iso)
+
+
+class Vehicle(_Record):
+    _fields = ("id", "nom", "marque", "modele", "motorisation", "energie", "annee", "immatriculation", "photo_file")
+    __slots__ = _fields
+    _decoders = {"id": _safe_int, "annee": _safe_int}
+
+
+class Plein(_DatedRecord):
+    _fields = ("id", "vehicule_id", "date_iso", "jour", "km", "litres", "prix_litre", "total", "lieu", "date")
+    __slots__ = _fields
+    _decoders = {"id": _safe_int, "vehicule_id": _safe_int, "jour": _safe_int, "km": _safe_int,
+                 "litres": _safe_float, "prix_litre": _safe_float, "total": _safe_float}
+
+
+class Entretien(_DatedRecord):
+    _fields = ("id", "vehicule_id", "type_id", "type_name", "intervention", "date_iso", "jour", "km", "cout",
+               "details", "kind", "performed_by", "battery_voltage", "is_repair", "date")
+    __slots__ = _fields
+    _decoders = {"id": _safe_int, "vehicule_id": _safe_int, "type_id": _safe_int, "jour": _safe_int,
+                 "km": _safe_int, "cout": _safe_float, "battery_voltage": _safe_float, "is_repair": _safe_int}
+
+
+class VehicleType(_Record):
+    _fields = ("type_id", "type_name", "period_km", "period_months", "enabled")
+    __slots__ = _fields
+    _decoders = {"type_id": _safe_int, "period_km": _safe_int, "period_months": _safe_int, "enabled": _safe_int}
+
+
+def _record_factory(cls):
+    """row_factory de curseur qui produit des `cls`. Le plan de décodage (position de colonne ->
+    champ, convertisseur) est calculé une fois par requête, pas à chaque ligne."""
+    state = {"desc": None, "plan": None}
+    width = len(cls._fields)
+
+    def factory(cursor, row):
+        desc = cursor.description
+        if desc is not state["desc"]:
+            plan = []
+            for col in desc:
+                name = col[0]
+                if name not in cls._fields:
+                    raise ValueError(f"Colonne {name!r} inconnue pour {cls.__name__}")
+                plan.append((cls._fields.index(name), cls._decoders.get(name)))
+            state["desc"], state["plan"] = desc, plan
+        values = [None] * width
+        for (pos, decode), v in zip(state["plan"], row):
+            values[pos] = decode(v) if decode is not None else v
+        rec = cls(*values)
+        rec._finish()
+        return rec
+
+    return factory
+
+
+def _records_cursor(conn: sqlite3.Connection, cls) -> sqlite3.Cursor:
     cur = conn.cursor()
-    cur.execute("""SELECT id, nom, marque, modele, motorisation, energie, annee, immatriculation, photo_file
-                   FROM vehicules
-                   ORDER BY COALESCE(nom,'') COLLATE NOCASE, id""")
-    rows = cur.fetchall()
+    cur.row_factory = _record_factory(cls)
+    return cur
+
+
+@contextlib.contextmanager
+def _reader(conn: sqlite3.Connection | None = None):
+    """Connexion de lecture : celle de l'appelant (laissée ouverte, ex. worker de l'API),
+    sinon une connexion propre fermée en sortie."""
+    if conn is not None:
+        yield conn
+        return
+    conn = _connect_db()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+# ----------------- Profilage SQL (optionnel) -----------------
+# Activé par --profile-sql ou GARAGE_PROFILE_SQL=1 : chaque connexion de _connect_db mesure ses
+# requêtes (texte, appelant, durée execute + lecture, lignes, instructions de triggers).
+SQL_PROFILE_ENV = "GARAGE_PROFILE_SQL"
+SQL_PROFILE_TOP = 15
+SQL_PROFILE_EXPLAIN = 5  # requêtes les plus coûteuses passées à EXPLAIN QUERY PLAN
+_SQL_FULL_SCAN = re.compile(r"^SCAN ([^\s(]+)$")  # « SCAN t » sans index = table parcourue en entier
+_SQL_TEMP_SORT = re.compile(r"^USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY$")
+
+
+class SqlProfiler:
+    """Statistiques cumulées par requête (texte normalisé)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.stats: dict[str, dict] = {}
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats = {}
+
+    def add(self, sql: str, params, seconds: float, rows: int, calls: int = 0,
+            triggers: int = 0, caller: str | None = None) -> None:
+        key = " ".join(sql.split())
+        with self._lock:
+            st = self.stats.get(key)
+            if st is None:
+                st = self.stats[key] = {"sql": key, "texte": sql, "n": 0, "total": 0.0, "rows": 0, "triggers": 0,
+                                        "callers": collections.Counter(), "params": None}
+            st["n"] += calls
+            st["total"] += seconds
+            st["rows"] += max(0, rows)
+            st["triggers"] += triggers
+            if caller:
+                st["callers"][caller] += 1
+            if params is not None:
+                st["params"] = params
+
+    def top(self, n: int = SQL_PROFILE_TOP) -> list[dict]:
+        with self._lock:
+            items = [dict(st, callers=collections.Counter(st["callers"])) for st in self.stats.values()]
+        return sorted(items, key=lambda st: st["total"], reverse=True)[:n]
+
+    @staticmethod
+    def explain(sql: str, params=None) -> list[str]:
+        """Plan d'exécution (EXPLAIN QUERY PLAN) ; les parcours complets de table sont signalés."""
+        if not sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+            return []
+        conn = sqlite3.connect(DB_FILE, timeout=DB_BUSY_TIMEOUT_S)  # hors profil
+        conn.row_factory = sqlite3.Row
+        try:
+            _attach_archive(conn)
+            plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+        except sqlite3.Error as e:
+            return [f"(plan indisponible : {e})"]
+        finally:
+            conn.close()
+        out = []
+        for r in plan:
+            detail = r["detail"]
+            if _SQL_FULL_SCAN.match(detail):
+                flag = "   <-- parcours complet"
+            elif _SQL_TEMP_SORT.match(detail):
+                flag = "   <-- tri hors index"
+            else:
+                flag = ""
+            out.append(f"{detail}{flag}")
+        return out
+
+    def report(self, n: int = SQL_PROFILE_TOP, explain: int = SQL_PROFILE_EXPLAIN) -> str:
+        top = self.top(n)
+        with self._lock:
+            calls = sum(st["n"] for st in self.stats.values())
+            total = sum(st["total"] for st in self.stats.values())
+        lines = [f"Profil SQL : {calls} exécution(s), {total * 1000:.1f} ms au total", "",
+                 f"{'n':>6} {'total ms':>9} {'moy ms':>8} {'lignes':>7} {'trig.':>6}  appelant / requête"]
+        for st in top:
+            caller = st["callers"].most_common(1)[0][0] if st["callers"] else "?"
+            avg = st["total"] / st["n"] * 1000 if st["n"] else 0.0
+            lines.append(f"{st['n']:>6} {st['total'] * 1000:>9.1f} {avg:>8.2f} {st['rows']:>7} {st['triggers']:>6}  {caller}")
+            lines.append(f"{'':>42}{st['sql'][:160]}")
+        if explain:
+            lines += ["", "Plans des requêtes les plus coûteuses :"]
+            for i, st in enumerate(top[:explain], start=1):
+                plan = self.explain(st["texte"], st["params"])
+                if not plan:
+                    continue
+                lines.append(f"[{i}] {st['total'] * 1000:.1f} ms — {st['sql'][:120]}")
+                lines += [f"      {p}" for p in plan]
+        return "\n".join(lines)
+
+
+_sql_profiler = SqlProfiler()
+
+
+def sql_profiler() -> SqlProfiler:
+    return _sql_profiler
+
+
+def _sql_caller() -> str:
+    """Première fonction appelante hors profileur : « fonction:ligne »."""
+    f = sys._getframe(1)
+    while f is not None and f.f_code in _SQL_PROFILER_CODES:
+        f = f.f_back
+    return f"{f.f_code.co_name}:{f.f_lineno}" if f is not None else "?"
+
+
+class _ProfiledCursor(sqlite3.Cursor):
+    """Curseur qui chronomètre execute et la lecture des lignes (cumulées jusqu'à la requête suivante)."""
+
+    _sql = None
+
+    def _flush(self) -> None:
+        if self._sql is not None and (self._pending_s or self._pending_rows):
+            _sql_profiler.add(self._sql, None, self._pending_s, self._pending_rows)
+        self._pending_s, self._pending_rows = 0.0, 0
+
+    def _run(self, method, sql, params, many=False):
+        self._flush()
+        self._sql = sql
+        caller = _sql_caller()
+        self.connection._traces = 0
+        t0 = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            dt = time.perf_counter() - t0
+            rows = self.rowcount if self.rowcount > 0 else 0
+            _sql_profiler.add(sql, None if many else params, dt, rows, calls=1,
+                              triggers=0 if many else max(0, self.connection._traces - 1), caller=caller)
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(super().executemany, sql, seq_of_params, many=True)
+
+    def _timed(self, method, *args):
+        t0 = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._pending_s += time.perf_counter() - t0
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._flush()
+        else:
+            self._pending_rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        self._pending_rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._pending_rows += len(rows)
+        self._flush()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            self._flush()
+            raise
+        self._pending_rows += 1
+        return row
+
+    def close(self):
+        self._flush()
+        super().close()
+
+    def __del__(self):  # curseur abandonné après un fetchone partiel
+        self._flush()
+
+    _pending_s = 0.0
+    _pending_rows = 0
+
+
+class _ProfiledConnection(sqlite3.Connection):
+    """Connexion profilée : curseurs chronométrés, trace des instructions exécutées par les triggers."""
+
+    _traces = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(self._on_trace)
+
+    def _on_trace(self, statement: str) -> None:
+        # Chaque instruction de trigger est retracée (texte de l'instruction appelante) : au-delà de
+        # la première trace d'un execute, ce sont des étapes de triggers.
+        _perf.count_statement(statement)
+        if not statement.startswith("BEGIN"):  # BEGIN implicite émis par le module sqlite3
+            self._traces += 1
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or _ProfiledCursor)
+
+    # Connection.execute crée son curseur en interne sans passer par cursor() : on le redirige.
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        caller = _sql_caller()
+        t0 = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            _sql_profiler.add("COMMIT", None, time.perf_counter() - t0, 0, calls=1, caller=caller)
+
+
+_SQL_PROFILER_CODES = {
+    fn.__code__
+    for cls in (_ProfiledCursor, _ProfiledConnection)
+    for fn in vars(cls).values() if hasattr(fn, "__code__")
+} | {_sql_caller.__code__}
+
+
+# ----------------- Compteurs de performance (diagnostic) -----------------
+# Toujours actifs et peu coûteux : connexions ouvertes, instructions SQL (callback de trace),
+# succès / échecs des caches et durée des rafraîchissements de l'interface. Affichés par le
+# panneau Diagnostic de l'onglet Général.
+PERF_TIMINGS_KEEP = 50  # dernières mesures gardées par rafraîchissement
+DIAG_REFRESH_MS = 1000  # panneau Diagnostic : mise à jour des compteurs
+DIAG_TRACEMALLOC_TOP = 15
+
+
+class PerfCounters:
+    """Compteurs partagés par tous les threads (verrou court)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()  # instructions SQL du thread courant (requêtes par rafraîchissement)
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts = collections.Counter()
+            self.caches: dict[str, list[int]] = {}  # nom -> [succès, échecs]
+            self.timings: dict[str, collections.deque] = {}  # nom -> (secondes, instructions SQL)
+            self.since = time.time()
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += n
+
+    def count_statement(self, _statement: str) -> None:
+        """Callback de trace SQLite : une instruction exécutée (étapes de triggers comprises)."""
+        with self._lock:
+            self.counts["sql"] += 1
+        self._local.sql = getattr(self._local, "sql", 0) + 1
+
+    def thread_statements(self) -> int:
+        return getattr(self._local, "sql", 0)
+
+    def cache(self, name: str, hit: bool) -> None:
+        with self._lock:
+            self.caches.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+    def record(self, name: str, seconds: float, statements: int) -> None:
+        with self._lock:
+            self.timings.setdefault(name, collections.deque(maxlen=PERF_TIMINGS_KEEP)).append((seconds, statements))
+
+    def snapshot(self) -> dict:
+        """Copie cohérente : {"compteurs", "caches": {nom: (succès, échecs)}, "durees": {nom: stats}}."""
+        with self._lock:
+            counts = dict(self.counts)
+            caches = {k: tuple(v) for k, v in self.caches.items()}
+            timings = {k: list(v) for k, v in self.timings.items()}
+            since = self.since
+        for name, fn in _PERF_LRU.items():
+            info = fn.cache_info()
+            caches[name] = (info.hits, info.misses)
+        durees = {}
+        for name, items in timings.items():
+            secs = [s for s, _q in items]
+            durees[name] = {
+                "n": len(items),
+                "dernier_ms": secs[-1] * 1000,
+                "moy_ms": sum(secs) / len(secs) * 1000,
+                "max_ms": max(secs) * 1000,
+                "requetes": items[-1][1],
+                "requetes_moy": sum(q for _s, q in items) / len(items),
+            }
+        return {"depuis": since, "compteurs": counts, "caches": caches, "durees": durees}
+
+    def report(self) -> list[str]:
+        snap = self.snapshot()
+        c = snap["compteurs"]
+        lines = [f"Depuis {datetime.fromtimestamp(snap['depuis']).strftime('%H:%M:%S')} :",
+                 f"  connexions SQLite ouvertes : {c.get('connexions', 0)}",
+                 f"  instructions SQL (triggers compris) : {c.get('sql', 0)}",
+                 "", "Caches (succès / échecs) :"]
+        for name, (hits, misses) in sorted(snap["caches"].items()):
+            total = hits + misses
+            rate = f"{hits / total:6.1%}" if total else "     –"
+            lines.append(f"  {name:<24} {rate}   {hits} / {misses}")
+        lines += ["", f"Rafraîchissements ({PERF_TIMINGS_KEEP} derniers) :",
+                  f"  {'':<24} {'n':>4} {'dernier':>9} {'moyen':>9} {'max':>9} {'requêtes':>9}"]
+        for name, d in sorted(snap["durees"].items(), key=lambda kv: -kv[1]["moy_ms"]):
+            lines.append(f"  {name:<24} {d['n']:>4} {d['dernier_ms']:>7.1f}ms {d['moy_ms']:>7.1f}ms "
+                         f"{d['max_ms']:>7.1f}ms {d['requetes']:>5} ({d['requetes_moy']:.0f})")
+        return lines
+
+
+_perf = PerfCounters()
+_PERF_LRU = {"regex mots-clés": _repair_matcher}  # caches functools : cache_info()
+
+
+def perf_counters() -> PerfCounters:
+    return _perf
+
+
+def perf_timed(name: str):
+    """Décorateur : durée et nombre de requêtes SQL (du thread appelant) de chaque appel."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            q0 = _perf.thread_statements()
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _perf.record(name, time.perf_counter() - t0, _perf.thread_statements() - q0)
+        return wrapper
+    return deco
+
+
+# ----------------- DB API : Paramètres -----------------
+
+def get_setting(key: str, default=None):
+    """Valeur (texte) d'un réglage de la table parametres, ou default."""
+    conn = _connect_db()
+    r = conn.execute("SELECT valeur FROM parametres WHERE cle=?", (key,)).fetchone()
     conn.close()
-    return rows
+    return default if r is None or r["valeur"] is None else r["valeur"]
 
 
-def get_vehicle(vehicle_id: int):
+def set_setting(key: str, value) -> None:
+    """Enregistre un réglage (None le supprime)."""
     conn = _connect_db()
     cur = conn.cursor()
-    cur.execute("""SELECT id, nom, marque, modele, motorisation, energie, annee, immatriculation, photo_file
-                   FROM vehicules WHERE id = ?""", (int(vehicle_id),))
-    r = cur.fetchone()
+    if value is None:
+        cur.execute("DELETE FROM parametres WHERE cle=?", (key,))
+    else:
+        cur.execute("INSERT OR REPLACE INTO parametres(cle, valeur) VALUES (?, ?)", (key, str(value)))
+    conn.commit()
     conn.close()
-    return r
+
+
+# ----------------- DB API : Véhicules -----------------
+
+def list_vehicles(conn: sqlite3.Connection | None = None) -> list[Vehicle]:
+    with _reader(conn) as conn:
+        cur = _records_cursor(conn, Vehicle)
+        cur.execute("""SELECT id, nom, marque, modele, motorisation, energie, annee, immatriculation, photo_file
+                       FROM vehicules
+                       ORDER BY COALESCE(nom,'') COLLATE NOCASE, id""")
+        return cur.fetchall()
+
+
+def get_vehicle(vehicle_id: int, conn: sqlite3.Connection | None = None) -> Vehicle | None:
+    with _reader(conn) as conn:
+        cur = _records_cursor(conn, Vehicle)
+        cur.execute("""SELECT id, nom, marque, modele, motorisation, energie, annee, immatriculation, photo_file
+                       FROM vehicules WHERE id = ?""", (int(vehicle_id),))
+        return cur.fetchone()
 
 
 def insert_vehicle(nom, marque, modele, motorisation, energie, annee, immatriculation, photo_file=None):
@@ -601,6 +1658,7 @@ def insert_vehicle(nom, marque, modele, motorisation, energie, annee, immatricul
     vid = int(cur.lastrowid)
     conn.commit()
     conn.close()
+    _data_changed(vid)
     return vid
 
 
@@ -621,14 +1679,24 @@ def update_vehicle(vehicle_id: int, nom, marque, modele, motorisation, energie,
                  int(vehicle_id)))
     conn.commit()
     conn.close()
+    _data_changed(vehicle_id)  # nom affiché dans les échéances
 
 
 def delete_vehicle(vehicle_id: int):
-    conn = _connect_db()
+    global _lieu_index
+    conn = _connect_db(full_history=True)
     cur = conn.cursor()
+    if _archive_attached(conn):
+        # pas de clé étrangère entre fichiers : purge explicite de l'historique archivé
+        _search_unindex_archived(cur, "vehicule_id = ?", (int(vehicle_id),))
+        for table in _ARCHIVED_TABLES:
+            if cur.execute(f"PRAGMA archive.table_info({table})").fetchone():
+                cur.execute(f"DELETE FROM archive.{table} WHERE vehicule_id=?", (int(vehicle_id),))
     cur.execute("DELETE FROM vehicules WHERE id=?", (int(vehicle_id),))
     conn.commit()
     conn.close()
+    _lieu_index = None  # pleins supprimés en cascade : index relu au prochain usage
+    _data_changed(vehicle_id)
 
 
 
@@ -688,103 +1756,310 @@ def delete_preconisation(preco_id: int):
 
 # ----------------- DB API : Pleins -----------------
 
-def list_pleins(vehicle_id: int):
+def list_pleins(vehicle_id: int) -> list[Plein]:
     conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute("""SELECT id, date_iso, km, litres, prix_litre, total, lieu
+    cur = _records_cursor(conn, Plein)
+    cur.execute("""SELECT id, date_iso, jour, km, litres, prix_litre, total, lieu
                    FROM pleins WHERE vehicule_id = ?
-                   ORDER BY date_iso DESC, km DESC, id DESC""", (int(vehicle_id),))
+                   ORDER BY jour DESC, km DESC, id DESC""", (int(vehicle_id),))
     rows = cur.fetchall()
     conn.close()
     return rows
 
 
-def list_pleins_lieux(vehicle_id: int):
-    conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute("""SELECT DISTINCT lieu FROM pleins
-                   WHERE vehicule_id = ? AND lieu IS NOT NULL AND TRIM(lieu) <> ''
-                   ORDER BY lieu COLLATE NOCASE""", (int(vehicle_id),))
-    rows = [r["lieu"] for r in cur.fetchall()]
-    conn.close()
-    return rows
+class LieuIndex:
+    """Index des lieux de plein, partagé par tous les véhicules.
+
+    Clés normalisées (minuscules, sans accents) triées : une recherche de préfixe est
+    deux bisect ; les candidats sont classés par nombre d'usages puis par date la plus récente.
+    """
+
+    def __init__(self, rows=()):
+        self._keys: list[str] = []          # clés normalisées, triées
+        self._stats: dict[str, list] = {}   # clé -> [libellé, usages, dernière date ISO]
+        self._lock = threading.Lock()       # notes depuis le thread d'écriture, lectures depuis Tk
+        for r in rows:
+            self.note(r["lieu"], r["last_date"], int(r["n"] or 0))
+
+    def note(self, lieu, date_iso=None, delta: int = 1) -> None:
+        """Ajoute (delta > 0) ou retire (delta < 0) des usages d'un lieu."""
+        label = (lieu or "").strip()
+        key = _norm_text(label)
+        if not key or not delta:
+            return
+        with self._lock:
+            self._note(key, label, date_iso, delta)
+
+    def _note(self, key: str, label: str, date_iso, delta: int) -> None:
+        st = self._stats.get(key)
+        if st is None:
+            if delta < 0:
+                return
+            st = self._stats[key] = [label, 0, ""]
+            bisect.insort(self._keys, key)
+        st[1] += delta
+        if date_iso and delta > 0 and date_iso > st[2]:
+            st[2] = date_iso
+        if st[1] <= 0:
+            del self._stats[key]
+            self._keys.pop(bisect.bisect_left(self._keys, key))
+
+    def set_stats(self, key: str, row) -> None:
+        """Remplace les stats d'une clé par la ligne lieux_stats correspondante (None : lieu disparu)."""
+        with self._lock:
+            if key in self._stats:
+                del self._stats[key]
+                self._keys.pop(bisect.bisect_left(self._keys, key))
+            if row is not None and int(row["n"] or 0) > 0:
+                self._stats[key] = [row["lieu"], int(row["n"]), row["last_date"] or ""]
+                bisect.insort(self._keys, key)
+
+    def suggest(self, typed: str = "", limit: int = 30) -> list[str]:
+        """Lieux commençant par `typed` (tous si vide / aucun résultat), les plus utilisés d'abord."""
+        prefix = _norm_text(typed)
+        with self._lock:
+            keys = self._keys
+            if prefix:
+                lo = bisect.bisect_left(keys, prefix)
+                hi = bisect.bisect_right(keys, prefix + "\uffff")
+                keys = keys[lo:hi] or self._keys
+            best = heapq.nsmallest(limit, keys, key=lambda k: (-self._stats[k][1], _desc(self._stats[k][2]), k))
+            return [self._stats[k][0] for k in best]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+def _desc(s: str) -> tuple:
+    """Clé de tri décroissante pour une chaîne (date ISO la plus récente d'abord)."""
+    return tuple(-ord(ch) for ch in s)
+
+
+_lieu_index: LieuIndex | None = None
+
+
+def lieu_index() -> LieuIndex:
+    """Index des lieux (chargé une fois depuis lieux_stats, puis tenu à jour en mémoire)."""
+    global _lieu_index
+    if _lieu_index is None:
+        conn = _connect_db()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT lieu, n, last_date FROM lieux_stats")
+            _lieu_index = LieuIndex(cur.fetchall())
+        except sqlite3.OperationalError:
+            _lieu_index = LieuIndex()
+        conn.close()
+    return _lieu_index
 
 
-def get_plein(plein_id: int):
+def _lieu_index_note(lieu, date_iso=None, delta: int = 1) -> None:
+    """Mise à jour incrémentale de l'index s'il est déjà chargé (sinon il sera lu à jour)."""
+    if _lieu_index is not None:
+        _lieu_index.note(lieu, date_iso, delta)
+
+
+def _lieu_index_refresh(cur: sqlite3.Cursor, *lieux) -> None:
+    """Relit dans lieux_stats les lieux touchés par une modification / suppression de plein :
+    la date la plus récente, recalculée par les triggers, ne se déduit pas d'un simple delta."""
+    if _lieu_index is None:
+        return
+    for key in {_norm_text(lieu) for lieu in lieux} - {""}:
+        cur.execute("SELECT lieu, n, last_date FROM lieux_stats WHERE cle = ?", (key,))
+        _lieu_index.set_stats(key, cur.fetchone())
+
+
+def get_plein(plein_id: int) -> Plein | None:
     conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute("""SELECT id, vehicule_id, date_iso, km, litres, prix_litre, total, lieu
+    cur = _records_cursor(conn, Plein)
+    cur.execute("""SELECT id, vehicule_id, date_iso, jour, km, litres, prix_litre, total, lieu
                    FROM pleins WHERE id=?""", (int(plein_id),))
     r = cur.fetchone()
     conn.close()
     return r
 
 
-def insert_plein(vehicle_id: int, date_iso: str, km: int, litres: float, prix_litre: float, total=None, lieu=None):
+def insert_plein(vehicle_id: int, date_iso: str, km: int, litres: float, prix_litre: float, total=None, lieu=None) -> list[str]:
+    """Ajoute un plein ; retourne les avertissements du contrôle d'anomalies (liste vide si RAS)."""
+    lieu = (lieu or "").strip() or None
+    d = _parse_iso_date(date_iso)
+    jour = d.toordinal() if d else None
     conn = _connect_db()
+    state = _plein_stats(conn, vehicle_id)
     cur = conn.cursor()
     cur.execute("""INSERT INTO pleins(vehicule_id, date_iso, km, litres, prix_litre, total, lieu)
                    VALUES (?, ?, ?, ?, ?, ?, ?)""",
                 (int(vehicle_id), date_iso, int(km), float(litres), float(prix_litre),
-                 _safe_float(total), (lieu or "").strip() or None))
+                 _safe_float(total), lieu))
+    if jour is not None and (state["last_jour"] is None or jour >= state["last_jour"]):
+        warnings = score_plein(state, jour, int(km), float(litres))
+        _save_plein_stats(cur, vehicle_id, _plein_stats_step(state, jour, int(km), float(litres)))
+    else:
+        warnings = []  # plein antidaté : état rejoué au prochain ajout
+        cur.execute("DELETE FROM stats_pleins WHERE vehicule_id=?", (int(vehicle_id),))
     conn.commit()
     conn.close()
+    _lieu_index_note(lieu, date_iso, +1)
+    _data_changed(vehicle_id)
+    return warnings
 
 
 def update_plein(plein_id: int, vehicle_id: int, date_iso: str, km: int, litres: float, prix_litre: float, total=None, lieu=None):
+    lieu = (lieu or "").strip() or None
     conn = _connect_db()
     cur = conn.cursor()
+    cur.execute("SELECT lieu, vehicule_id FROM pleins WHERE id=?", (int(plein_id),))
+    old = cur.fetchone()
     cur.execute("""UPDATE pleins
                    SET vehicule_id=?, date_iso=?, km=?, litres=?, prix_litre=?, total=?, lieu=?
                    WHERE id=?""",
                 (int(vehicle_id), date_iso, int(km), float(litres), float(prix_litre),
-                 _safe_float(total), (lieu or "").strip() or None, int(plein_id)))
+                 _safe_float(total), lieu, int(plein_id)))
+    if old is not None:
+        cur.execute("DELETE FROM stats_pleins WHERE vehicule_id IN (?, ?)", (old["vehicule_id"], int(vehicle_id)))
     conn.commit()
+    if old is not None:
+        _lieu_index_refresh(cur, old["lieu"], lieu)
     conn.close()
+    if old is not None:
+        _data_changed(old["vehicule_id"], vehicle_id)
 
 
 def delete_plein(plein_id: int):
     conn = _connect_db()
     cur = conn.cursor()
+    cur.execute("SELECT lieu, vehicule_id FROM pleins WHERE id=?", (int(plein_id),))
+    old = cur.fetchone()
     cur.execute("DELETE FROM pleins WHERE id=?", (int(plein_id),))
+    if old is not None:
+        cur.execute("DELETE FROM stats_pleins WHERE vehicule_id=?", (old["vehicule_id"],))
     conn.commit()
+    if old is not None:
+        _lieu_index_refresh(cur, old["lieu"])
     conn.close()
+    if old is not None:
+        _data_changed(old["vehicule_id"])
+
+
+# ----------------- Contrôle des pleins (détection d'anomalies) -----------------
+# Une ligne par véhicule dans stats_pleins : dernier relevé + moyenne / variance glissantes (Welford)
+# de la conso par plein (L/100) et du rythme (km/jour). Un nouveau plein est noté en O(1) à
+# l'insertion ; modification / suppression d'un plein : ligne effacée, rejouée au prochain plein.
+ANOMALY_Z = 3.0            # écart (en écarts-types) au-delà duquel un plein est signalé
+ANOMALY_MIN_SAMPLES = 5    # pas de score tant que l'historique est trop court
+ANOMALY_MIN_REL_SD = 0.05  # écart-type plancher (part de la moyenne) : historique constant ou presque
+
+_PLEIN_STATS_FIELDS = ("last_jour", "last_km", "n_conso", "mean_conso", "m2_conso",
+                       "n_rythme", "mean_rythme", "m2_rythme")
+
+
+def _welford(n: int, mean: float, m2: float, x: float) -> tuple[int, float, float]:
+    n += 1
+    delta = x - mean
+    mean += delta / n
+    return n, mean, m2 + delta * (x - mean)
+
+
+def _plein_samples(state: dict, jour, km, litres) -> tuple[float | None, float | None]:
+    """(L/100, km/jour) du plein par rapport au dernier relevé, None si non calculable."""
+    last_km, last_jour = state["last_km"], state["last_jour"]
+    if last_km is None or km is None or km <= last_km:
+        return None, None
+    dist = km - last_km
+    conso = litres / dist * 100.0 if litres else None
+    rythme = dist / (jour - last_jour) if jour is not None and last_jour is not None and jour > last_jour else None
+    return conso, rythme
+
+
+def _plein_stats_step(state: dict, jour, km, litres) -> dict:
+    """Nouvel état après un plein (le plus récent du véhicule)."""
+    conso, rythme = _plein_samples(state, jour, km, litres)
+    new = dict(state)
+    if conso is not None:
+        new["n_conso"], new["mean_conso"], new["m2_conso"] = _welford(
+            state["n_conso"], state["mean_conso"], state["m2_conso"], conso)
+    if rythme is not None:
+        new["n_rythme"], new["mean_rythme"], new["m2_rythme"] = _welford(
+            state["n_rythme"], state["mean_rythme"], state["m2_rythme"], rythme)
+    if km is not None:
+        new["last_km"] = km
+    if jour is not None:
+        new["last_jour"] = jour
+    return new
+
+
+def _outlier(x, n: int, mean: float, m2: float) -> tuple[float, float] | None:
+    """(moyenne, écart-type) si x sort de ANOMALY_Z écarts-types, sinon None.
+
+    L'écart-type vaut au moins ANOMALY_MIN_REL_SD × |moyenne| : un historique parfaitement régulier
+    (variance nulle) signale encore un écart net au lieu de ne plus rien noter.
+    """
+    if x is None or n < ANOMALY_MIN_SAMPLES:
+        return None
+    sd = max(math.sqrt(max(m2, 0.0) / (n - 1)), ANOMALY_MIN_REL_SD * abs(mean))
+    return (mean, sd) if sd > 0 and abs(x - mean) > ANOMALY_Z * sd else None
+
+
+def score_plein(state: dict, jour, km, litres) -> list[str]:
+    """Avertissements pour un plein à ajouter après le dernier relevé décrit par state."""
+    warnings = []
+    if state["last_km"] is not None and km is not None and km < state["last_km"]:
+        warnings.append(f"Kilométrage en recul : {km} km après un plein à {state['last_km']} km.")
+        return warnings
+    conso, rythme = _plein_samples(state, jour, km, litres)
+    out = _outlier(conso, state["n_conso"], state["mean_conso"], state["m2_conso"])
+    if out:
+        warnings.append(f"Conso inhabituelle : {_fmt_num(conso, 1)} L/100 "
+                        f"(habituellement {_fmt_num(out[0], 1)} ± {_fmt_num(out[1], 1)}).")
+    out = _outlier(rythme, state["n_rythme"], state["mean_rythme"], state["m2_rythme"])
+    if out:
+        warnings.append(f"Distance inhabituelle depuis le dernier plein : {_fmt_num(rythme, 0)} km/jour "
+                        f"(habituellement {_fmt_num(out[0], 0)} ± {_fmt_num(out[1], 0)}).")
+    return warnings
+
+
+def _plein_stats(conn: sqlite3.Connection, vehicle_id: int) -> dict:
+    """État courant du véhicule ; rejoué depuis tout l'historique (archive comprise) s'il manque."""
+    row = conn.execute(f"SELECT {', '.join(_PLEIN_STATS_FIELDS)} FROM stats_pleins WHERE vehicule_id=?",
+                       (int(vehicle_id),)).fetchone()
+    if row is not None:
+        return dict(zip(_PLEIN_STATS_FIELDS, row))
+    state = dict.fromkeys(_PLEIN_STATS_FIELDS, 0)
+    state.update(last_jour=None, last_km=None)
+    _attach_archive(conn)
+    for jour, km, litres in conn.execute(
+            "SELECT jour, km, litres FROM pleins_all WHERE vehicule_id=? ORDER BY jour, km, id", (int(vehicle_id),)):
+        state = _plein_stats_step(state, jour, km, litres)
+    return state
+
+
+def _save_plein_stats(cur: sqlite3.Cursor, vehicle_id: int, state: dict) -> None:
+    cur.execute(f"INSERT OR REPLACE INTO stats_pleins(vehicule_id, {', '.join(_PLEIN_STATS_FIELDS)}) "
+                f"VALUES (?{', ?' * len(_PLEIN_STATS_FIELDS)})",
+                (int(vehicle_id), *(state[f] for f in _PLEIN_STATS_FIELDS)))
 
 
 # ----------------- DB API : Types / Entretiens -----------------
 
 def last_km_any(vehicle_id: int):
-    conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(km) AS m FROM pleins WHERE vehicule_id=?", (int(vehicle_id),))
-    m1 = _safe_int(cur.fetchone()["m"])
-    cur.execute("SELECT MAX(km) AS m FROM entretiens WHERE vehicule_id=?", (int(vehicle_id),))
-    m2 = _safe_int(cur.fetchone()["m"])
-    conn.close()
-    if m1 is None:
-        return m2
-    if m2 is None:
-        return m1
-    return max(m1, m2)
+    return vehicle_snapshot(vehicle_id).last_km()
 
 
-def list_vehicle_types(vehicle_id: int):
+def list_vehicle_types(vehicle_id: int, conn: sqlite3.Connection | None = None) -> list[VehicleType]:
     """Types d'entretien associés au véhicule + flag enabled (rappel affiché)."""
-    conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute("""SELECT t.id AS type_id,
-                          t.nom AS type_name,
-                          t.period_km,
-                          t.period_months,
-                          COALESCE(vtt.enabled, 1) AS enabled
-                   FROM vehicule_entretien_types vtt
-                   JOIN entretien_types t ON t.id = vtt.type_id
-                   WHERE vtt.vehicule_id = ?
-                   ORDER BY CASE WHEN LOWER(t.nom) = 'tension batterie' THEN 0 ELSE 1 END, t.nom COLLATE NOCASE
-                                      """, (vehicle_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with _reader(conn) as conn:
+        cur = _records_cursor(conn, VehicleType)
+        cur.execute("""SELECT t.id AS type_id,
+                              t.nom AS type_name,
+                              t.period_km,
+                              t.period_months,
+                              COALESCE(vtt.enabled, 1) AS enabled
+                       FROM vehicule_entretien_types vtt
+                       JOIN entretien_types t ON t.id = vtt.type_id
+                       WHERE vtt.vehicule_id = ?
+                       ORDER BY CASE WHEN LOWER(t.nom) = 'tension batterie' THEN 0 ELSE 1 END, t.nom COLLATE NOCASE
+                                          """, (vehicle_id,))
+        return cur.fetchall()
 
 
 def create_type_for_vehicle(vehicle_id: int, name: str, period_km=None, period_months=None):
@@ -803,6 +2078,7 @@ def create_type_for_vehicle(vehicle_id: int, name: str, period_km=None, period_m
                    VALUES (?, ?, 1)""", (int(vehicle_id), type_id))
     conn.commit()
     conn.close()
+    _data_changed(vehicle_id)
     return type_id
 
 
@@ -819,21 +2095,24 @@ def update_type(type_id: int, name: str, period_km=None, period_months=None):
                 (name, pk, pm, int(type_id)))
     conn.commit()
     conn.close()
+    _reminder_index_reset()  # le type peut être suivi par plusieurs véhicules
+    _data_changed()
 
 
 def delete_type_from_vehicle(vehicle_id: int, type_id: int):
-    conn = _connect_db()
+    conn = _connect_db(full_history=True)  # un type cité par des entretiens archivés est conservé
     cur = conn.cursor()
     cur.execute("DELETE FROM vehicule_entretien_types WHERE vehicule_id=? AND type_id=?",
                 (int(vehicle_id), int(type_id)))
     cur.execute("SELECT COUNT(*) AS n FROM vehicule_entretien_types WHERE type_id=?", (int(type_id),))
     n_assign = int(cur.fetchone()["n"])
-    cur.execute("SELECT COUNT(*) AS n FROM entretiens WHERE type_id=?", (int(type_id),))
+    cur.execute("SELECT COUNT(*) AS n FROM entretiens_all WHERE type_id=?", (int(type_id),))
     n_ref = int(cur.fetchone()["n"])
     if n_assign == 0 and n_ref == 0:
         cur.execute("DELETE FROM entretien_types WHERE id=?", (int(type_id),))
     conn.commit()
     conn.close()
+    _data_changed(vehicle_id)
 
 
 def set_vehicle_type_enabled(vehicle_id: int, type_id: int, enabled: int):
@@ -851,25 +2130,7 @@ def set_vehicle_type_enabled(vehicle_id: int, type_id: int, enabled: int):
         )
     conn.commit()
     conn.close()
-
-
-def get_last_entretien_for_type(vehicle_id: int, type_id: int):
-    """Retourne (date_iso, km) du dernier entretien pour ce type sur ce véhicule."""
-    conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute(
-        """SELECT date_iso, km
-           FROM entretiens
-           WHERE vehicule_id=? AND type_id=?
-           ORDER BY date_iso DESC, km DESC, id DESC
-           LIMIT 1""",
-        (int(vehicle_id), int(type_id)),
-    )
-    r = cur.fetchone()
-    conn.close()
-    if not r:
-        return (None, None)
-    return (r["date_iso"], r["km"])
+    _data_changed(vehicle_id)
 
 
 def compute_reminder_status(vehicle_id: int, type_id: int, period_km, period_months):
@@ -878,9 +2139,15 @@ def compute_reminder_status(vehicle_id: int, type_id: int, period_km, period_mon
     Règle: si km et/ou mois définis, 'dû' quand AU MOINS un seuil est dépassé.
     Si aucun entretien enregistré -> dû immédiatement.
     """
-    current_km = last_km_any(vehicle_id) or 0
-    last_date_iso, last_km = get_last_entretien_for_type(vehicle_id, type_id)
+    snap = vehicle_snapshot(vehicle_id)
+    last_date, last_km = snap.last_entretien(type_id)
+    return _reminder_status(snap.last_km() or 0, last_date, last_km, period_km, period_months)
 
+
+def _reminder_status(current_km, last_date_iso, last_km, period_km, period_months, today: date | None = None):
+    """Règle de rappel pure (sans accès base) : mêmes entrées que compute_reminder_status, déjà lues."""
+    today = today or date.today()
+    current_km = current_km or 0
     pk = _safe_int(period_km)
     pm = _safe_int(period_months)
 
@@ -903,7 +2170,7 @@ def compute_reminder_status(vehicle_id: int, type_id: int, period_km, period_mon
     if pm is not None:
         d_last = _parse_iso_date(last_date_iso)
         if d_last:
-            months_left = pm - _month_diff(d_last, date.today())
+            months_left = pm - _month_diff(d_last, today)
             due_date = _add_months(d_last, pm)
 
 
@@ -920,7 +2187,7 @@ def compute_reminder_status(vehicle_id: int, type_id: int, period_km, period_mon
 
         if months_left is not None and months_left <= 0:
             if due_date is not None:
-                days_over = (date.today() - due_date).days
+                days_over = (today - due_date).days
                 if 0 <= days_over < 31:
                     if days_over == 0:
                         parts.append("aujourd’hui")
@@ -941,7 +2208,7 @@ def compute_reminder_status(vehicle_id: int, type_id: int, period_km, period_mon
 
         if months_left is not None:
             if due_date is not None:
-                days_left = (due_date - date.today()).days
+                days_left = (due_date - today).days
                 if days_left == 0:
                     parts.append("aujourd’hui")
                 elif 0 < days_left < 31:
@@ -965,25 +2232,27 @@ def compute_reminder_status(vehicle_id: int, type_id: int, period_km, period_mon
 
         return (True, "green", f"À faire dans {suffix}".strip())
 
-def list_entretiens_full(vehicle_id: int):
+
+def list_entretiens_full(vehicle_id: int) -> list[Entretien]:
     conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute("""SELECT e.id, e.date_iso, e.km,
+    cur = _records_cursor(conn, Entretien)
+    cur.execute("""SELECT e.id, e.date_iso, e.jour, e.km,
                           COALESCE(t.nom, e.intervention) AS type_name,
                           e.kind, e.cout, e.performed_by, e.battery_voltage, e.details, e.type_id
                    FROM entretiens e
                    LEFT JOIN entretien_types t ON t.id = e.type_id
                    WHERE e.vehicule_id = ?
-                   ORDER BY e.date_iso DESC, e.km DESC, e.id DESC""", (int(vehicle_id),))
+                   ORDER BY e.jour DESC, e.km DESC, e.id DESC""", (int(vehicle_id),))
     rows = cur.fetchall()
     conn.close()
     return rows
 
 
-def get_entretien(entretien_id: int):
+def get_entretien(entretien_id: int) -> Entretien | None:
     conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute("""SELECT id, vehicule_id, type_id, intervention, date_iso, km, cout, details, kind, performed_by, battery_voltage
+    cur = _records_cursor(conn, Entretien)
+    cur.execute("""SELECT id, vehicule_id, type_id, intervention, date_iso, jour, km, cout, details, kind, performed_by,
+                          battery_voltage
                    FROM entretiens WHERE id=?""", (int(entretien_id),))
     r = cur.fetchone()
     conn.close()
@@ -997,13 +2266,16 @@ def insert_entretien(vehicle_id: int, date_iso: str, km: int, kind: str, type_id
     cur.execute("SELECT nom FROM entretien_types WHERE id=?", (int(type_id),))
     rr = cur.fetchone()
     snapshot = rr["nom"] if rr else None
-    cur.execute("""INSERT INTO entretiens(vehicule_id, type_id, intervention, date_iso, km, cout, details, kind, performed_by, battery_voltage)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    details = (details or "").strip() or None
+    kind = (kind or "").strip() or None
+    cur.execute("""INSERT INTO entretiens(vehicule_id, type_id, intervention, date_iso, km, cout, details, kind, performed_by, battery_voltage, is_repair)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
                 (int(vehicle_id), int(type_id), snapshot, date_iso, int(km), _safe_float(cout),
-                 (details or "").strip() or None, (kind or "").strip() or None,
-                 (performed_by or "").strip() or None, _safe_float(battery_voltage)))
+                 details, kind, (performed_by or "").strip() or None, _safe_float(battery_voltage),
+                 classify_repair(kind, snapshot, details)))
     conn.commit()
     conn.close()
+    _data_changed(vehicle_id)
 
 
 def update_entretien(entretien_id: int, vehicle_id: int, date_iso: str, km: int, kind: str, type_id: int,
@@ -1013,160 +2285,2668 @@ def update_entretien(entretien_id: int, vehicle_id: int, date_iso: str, km: int,
     cur.execute("SELECT nom FROM entretien_types WHERE id=?", (int(type_id),))
     rr = cur.fetchone()
     snapshot = rr["nom"] if rr else None
+    details = (details or "").strip() or None
+    kind = (kind or "").strip() or None
+    cur.execute("SELECT vehicule_id FROM entretiens WHERE id=?", (int(entretien_id),))
+    old = cur.fetchone()
     cur.execute("""UPDATE entretiens
-                   SET vehicule_id=?, type_id=?, intervention=?, date_iso=?, km=?, cout=?, details=?, kind=?, performed_by=?, battery_voltage=?
+                   SET vehicule_id=?, type_id=?, intervention=?, date_iso=?, km=?, cout=?, details=?, kind=?, performed_by=?, battery_voltage=?, is_repair=?
                    WHERE id=?""",
                 (int(vehicle_id), int(type_id), snapshot, date_iso, int(km), _safe_float(cout),
-                 (details or "").strip() or None, (kind or "").strip() or None,
-                 (performed_by or "").strip() or None, _safe_float(battery_voltage),
-                 int(entretien_id)))
+                 details, kind, (performed_by or "").strip() or None, _safe_float(battery_voltage),
+                 classify_repair(kind, snapshot, details), int(entretien_id)))
     conn.commit()
     conn.close()
+    _data_changed(vehicle_id, old["vehicule_id"] if old else None)
 
 
 def delete_entretien(entretien_id: int):
     conn = _connect_db()
     cur = conn.cursor()
+    cur.execute("SELECT vehicule_id FROM entretiens WHERE id=?", (int(entretien_id),))
+    old = cur.fetchone()
     cur.execute("DELETE FROM entretiens WHERE id=?", (int(entretien_id),))
     conn.commit()
     conn.close()
+    if old is not None:
+        _data_changed(old["vehicule_id"])
 
 
-def conso_moy_l100(vehicle_id: int):
-    """Conso moyenne (L/100) basée sur pleins: SUM(litres)/(max_km-min_km)*100. Nécessite >=2 pleins."""
-    conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT MIN(km) AS kmin, MAX(km) AS kmax, SUM(litres) AS lsum, COUNT(*) AS n FROM pleins WHERE vehicule_id=?",
-        (int(vehicle_id),),
-    )
-    r = cur.fetchone()
-    conn.close()
-    if not r:
-        return None
-    try:
-        n = int(r["n"] or 0)
-    except Exception:
-        n = 0
-    if n < 2:
-        return None
-    kmin = _safe_int(r["kmin"])
-    kmax = _safe_int(r["kmax"])
-    lsum = _safe_float(r["lsum"])
-    if kmin is None or kmax is None or lsum is None:
-        return None
-    dist = kmax - kmin
-    if dist <= 0:
-        return None
-    return (lsum / dist) * 100.0
-
+# ----------------- DB API : Mots-clés réparation -----------------
 
-def get_last_battery_voltage(vehicle_id: int):
-    """Retourne le dernier voltage batterie (float) renseigné dans les entretiens, ou None."""
-    conn = _connect_db()
+def list_repair_keywords() -> tuple[str, ...]:
+    """Mots-clés (normalisés) qui classent un entretien en réparation. Mis en cache."""
+    global _repair_keywords_cache
+    _perf.cache("mots-clés réparation", _repair_keywords_cache is not None)
+    if _repair_keywords_cache is None:
+        conn = _connect_db()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT mot FROM mots_cles_reparation ORDER BY mot")
+            _repair_keywords_cache = tuple(r["mot"] for r in cur.fetchall())
+        except sqlite3.OperationalError:
+            # Schéma pas encore migré : comportement historique
+            _repair_keywords_cache = DEFAULT_REPAIR_KEYWORDS
+        conn.close()
+    return _repair_keywords_cache
+
+
+def _reclassify_entretiens(cur: sqlite3.Cursor) -> int:
+    """Recalcule is_repair pour tout l'historique, archive comprise si elle est attachée.
+    Retourne le nb de lignes modifiées."""
+    cur.execute("SELECT mot FROM mots_cles_reparation")
+    keywords = tuple(r["mot"] for r in cur.fetchall())
+    tables = ["entretiens"]
+    if _archive_attached(cur.connection) and "is_repair" in {
+            r[1] for r in cur.execute("PRAGMA archive.table_info(entretiens)")}:
+        tables.append("archive.entretiens")
+    total = 0
+    for table in tables:
+        cur.execute(f"SELECT id, kind, intervention, details, is_repair FROM {table}")
+        changes = []
+        for r in cur.fetchall():
+            flag = classify_repair(r["kind"], r["intervention"], r["details"], keywords)
+            if flag != r["is_repair"]:
+                changes.append((flag, int(r["id"])))
+        cur.executemany(f"UPDATE {table} SET is_repair=? WHERE id=?", changes)
+        total += len(changes)
+        if changes and table != "entretiens" and _table_exists(cur, "couts_mensuels"):
+            _rebuild_cost_aggregates(cur)  # pas de trigger d'agrégat sur l'archive
+    return total
+
+
+def set_repair_keywords(words) -> int:
+    """Remplace la liste des mots-clés puis reclasse tous les entretiens.
+
+    Retourne le nombre d'entretiens dont la classification a changé.
+    """
+    global _repair_keywords_cache
+    keywords = sorted({_norm_text(w) for w in (words or []) if _norm_text(w)})
+    conn = _connect_db(full_history=True)  # entretiens archivés reclassés aussi
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT battery_voltage
-        FROM entretiens
-        WHERE vehicule_id = ? AND battery_voltage IS NOT NULL
-        ORDER BY date_iso DESC, km DESC, id DESC
-        LIMIT 1
-        """,
-        (int(vehicle_id),),
-    )
-    r = cur.fetchone()
+    cur.execute("DELETE FROM mots_cles_reparation")
+    cur.executemany("INSERT INTO mots_cles_reparation(mot) VALUES (?)", [(k,) for k in keywords])
+    n = _reclassify_entretiens(cur)
+    conn.commit()
     conn.close()
-    if not r:
-        return None
-    try:
-        return float(r["battery_voltage"])
-    except Exception:
-        return None
+    _repair_keywords_cache = tuple(keywords)
+    _data_changed()  # is_repair recalculé sur tous les véhicules
+    return n
 
 
-def _recent_cost_for_type(vehicle_id: int, type_id: int):
-    """Coût le plus récent (non NULL) pour un type d'entretien sur un véhicule."""
-    conn = _connect_db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT cout
-        FROM entretiens
-        WHERE vehicule_id = ? AND type_id = ? AND cout IS NOT NULL
-        ORDER BY date_iso DESC, km DESC, id DESC
-        LIMIT 1
-        """,
-        (int(vehicle_id), int(type_id)),
-    )
-    r = cur.fetchone()
-    conn.close()
-    if not r:
-        return None
-    try:
-        return float(r["cout"])
-    except Exception:
-        return None
+# ----------------- Analyse : instantané colonnes par véhicule -----------------
 
+_SNAPSHOT_SQL = f"""
+    SELECT 0 AS src, jour, km, litres, prix_litre, {_PLEIN_COST_SQL.format(p='p')} AS cout,
+           NULL AS type_id, NULL AS battery_voltage, 0 AS is_repair, id
+    FROM pleins_all p WHERE vehicule_id=?{{rng}}
+    UNION ALL
+    SELECT 1, jour, km, NULL, NULL, cout, type_id, battery_voltage, is_repair, id
+    FROM entretiens_all WHERE vehicule_id=?{{rng}}
+    ORDER BY src, jour, km, id
+"""
+# Restriction de période : bornes sur jour, servies par les index idx_<table>_jour(vehicule_id, jour)
+_SNAPSHOT_RANGE_SQL = " AND jour BETWEEN ? AND ?"
+
+
+class VehicleSnapshot:
+    """Historique d'un véhicule rangé en colonnes (array.array), chargé en une requête.
+
+    Colonnes p_* (pleins) et e_* (entretiens), triées par (jour, km, id). Valeur absente :
+    NaN pour les colonnes réelles, 0 pour e_type. column() expose une colonne en tableau
+    NumPy sans copie pour les graphiques. Avec une période (since/until en jours ordinaux),
+    seules les lignes datées de cette période sont lues.
+    """
+    __slots__ = ("vehicle_id", "since", "until", "p_jour", "p_km", "p_litres", "p_prix", "p_cout",
+                 "e_jour", "e_km", "e_type", "e_cout", "e_vbat", "e_repair")
+    _INT_COLUMNS = frozenset({"e_type", "e_repair"})
+
+    def __init__(self, vehicle_id: int, since: int | None = None, until: int | None = None):
+        self.vehicle_id = int(vehicle_id)
+        self.since = since
+        self.until = until
+        for name in self.__slots__[3:]:
+            setattr(self, name, array("q") if name in self._INT_COLUMNS else array("d"))
+
+    @classmethod
+    def load(cls, vehicle_id: int, since: int | None = None, until: int | None = None) -> "VehicleSnapshot":
+        snap = cls(vehicle_id, since, until)
+        nan = math.nan
+        params = [snap.vehicle_id]
+        rng = ""
+        if since is not None or until is not None:
+            rng = _SNAPSHOT_RANGE_SQL
+            params += [since if since is not None else 0, until if until is not None else date.max.toordinal()]
+        conn = _connect_db(full_history=True)
+        cur = conn.cursor()
+        cur.row_factory = None  # tuples : pas de décodage par nom ligne à ligne
+        cur.execute(_SNAPSHOT_SQL.format(rng=rng), params * 2)
+        p_cols = (snap.p_jour, snap.p_km, snap.p_litres, snap.p_prix, snap.p_cout)
+        e_cols = (snap.e_jour, snap.e_km, snap.e_cout, snap.e_vbat)
+        for src, jour, km, litres, prix, cout, type_id, vbat, is_repair, _id in cur:
+            if src == 0:
+                values = (jour, km, litres, prix, cout)
+                cols = p_cols
+            else:
+                values = (jour, km, cout, vbat)
+                cols = e_cols
+                snap.e_type.append(int(type_id or 0))
+                snap.e_repair.append(int(is_repair or 0))
+            for col, v in zip(cols, values):
+                col.append(nan if v is None else float(v))
+        conn.close()
+        return snap
+
+    def column(self, name: str):
+        """Colonne en tableau NumPy (vue sur le tampon, pas de copie)."""
+        import numpy as np
+        return np.frombuffer(getattr(self, name), dtype=np.int64 if name in self._INT_COLUMNS else np.float64)
+
+    def last_km(self):
+        """Kilométrage maximal relevé (pleins et entretiens), ou None."""
+        m = max((k for k in itertools.chain(self.p_km, self.e_km) if k == k), default=None)
+        return None if m is None else int(m)
+
+    def conso_moy_l100(self):
+        """SUM(litres)/(max_km-min_km)*100 sur les pleins ; nécessite >=2 pleins."""
+        if len(self.p_km) < 2:
+            return None
+        kms = [k for k in self.p_km if k == k]
+        litres = [v for v in self.p_litres if v == v]
+        if not kms or not litres:
+            return None
+        dist = int(max(kms)) - int(min(kms))
+        if dist <= 0:
+            return None
+        return (math.fsum(litres) / dist) * 100.0
+
+    def _last_entretien_index(self, type_id: int | None = None, column=None) -> int | None:
+        """Indice du dernier entretien (du type donné / avec `column` renseignée), ou None."""
+        for i in range(len(self.e_jour) - 1, -1, -1):
+            if type_id is not None and self.e_type[i] != type_id:
+                continue
+            if column is not None and column[i] != column[i]:
+                continue
+            return i
+        return None
+
+    def last_battery_voltage(self):
+        i = self._last_entretien_index(column=self.e_vbat)
+        return None if i is None else self.e_vbat[i]
+
+    def last_entretien(self, type_id: int):
+        """(date, km) du dernier entretien de ce type, ou (None, None)."""
+        i = self._last_entretien_index(int(type_id))
+        if i is None:
+            return (None, None)
+        jour, km = self.e_jour[i], self.e_km[i]
+        return (date.fromordinal(int(jour)) if jour == jour else None, int(km) if km == km else None)
+
+    def recent_cost(self, type_id: int):
+        """Coût le plus récent (renseigné) pour ce type d'entretien."""
+        i = self._last_entretien_index(int(type_id), self.e_cout)
+        return None if i is None else self.e_cout[i]
+
+    def monthly_costs(self, source: str = "entretien") -> dict[str, float]:
+        """{AAAA-MM: total} des coûts datés, pour les pleins ("plein") ou les entretiens."""
+        jours, couts = (self.p_jour, self.p_cout) if source == "plein" else (self.e_jour, self.e_cout)
+        out: dict[str, float] = {}
+        for j, c in zip(jours, couts):
+            if j == j and c == c:
+                ym = date.fromordinal(int(j)).strftime("%Y-%m")
+                out[ym] = out.get(ym, 0.0) + c
+        return out
+
+
+SNAPSHOT_CACHE_SIZE = 16
+# clé : (vehicle_id, since, until)
+_snapshots: collections.OrderedDict[tuple, VehicleSnapshot] = collections.OrderedDict()
+_snapshots_lock = threading.Lock()
+_data_version = 0
+
+
+def _jour_bound(value) -> int | None:
+    d = _parse_iso_date(value)
+    return d.toordinal() if d else None
+
+
+def data_version() -> int:
+    """Compteur incrémenté à chaque écriture faite par ce processus."""
+    return _data_version
+
+
+def vehicle_snapshot(vehicle_id: int, since=None, until=None) -> VehicleSnapshot:
+    """Instantané en cache (LRU) ; rechargé après toute écriture touchant le véhicule.
+
+    since / until (date, AAAA-MM-JJ ou jour ordinal) restreignent la lecture à une période.
+    """
+    since, until = _jour_bound(since), _jour_bound(until)
+    key = (int(vehicle_id), since, until)
+    with _snapshots_lock:
+        snap = _snapshots.get(key)
+        if snap is not None:
+            _snapshots.move_to_end(key)
+    _perf.cache("instantanés véhicule", snap is not None)
+    if snap is not None:
+        return snap
+    version = _data_version
+    snap = VehicleSnapshot.load(*key)
+    with _snapshots_lock:
+        if version == _data_version:  # pas d'écriture pendant la lecture : l'instantané est à jour
+            _snapshots[key] = snap
+            while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+                _snapshots.popitem(last=False)
+    return snap
+
+
+def _data_changed(*vehicle_ids) -> None:
+    """À appeler après chaque écriture : invalide instantanés et échéances des véhicules
+    concernés (sans argument : tous les instantanés)."""
+    global _data_version
+    vids = {int(v) for v in vehicle_ids if v is not None}
+    with _snapshots_lock:
+        _data_version += 1
+        if vehicle_ids:
+            for key in [k for k in _snapshots if k[0] in vids]:
+                del _snapshots[key]
+        else:
+            _snapshots.clear()
+    _reminder_index_touch(*vids)
+
+
+def conso_moy_l100(vehicle_id: int):
+    """Conso moyenne (L/100) basée sur pleins: SUM(litres)/(max_km-min_km)*100. Nécessite >=2 pleins."""
+    return vehicle_snapshot(vehicle_id).conso_moy_l100()
+
+
+def get_last_battery_voltage(vehicle_id: int):
+    """Retourne le dernier voltage batterie (float) renseigné dans les entretiens, ou None."""
+    return vehicle_snapshot(vehicle_id).last_battery_voltage()
+
+
+def _battery_status(vbat):
+    """(message, couleur) de l'état batterie pour une tension (None -> pas de mesure)."""
+    if vbat is None:
+        return "—", ""
+    if vbat <= 12.0:
+        return "Tension en dessous de 12V : Attention décharge critique, prévoir remplacement", "red"
+    if 12.1 <= vbat <= 12.3:
+        return "Tension de batterie faible : À recharger", "red"
+    if 12.4 <= vbat <= 12.5:
+        return "Batterie limite mais ça passe", "orange"
+    return "Batterie en bonne santé", "green"
+
+
+def _recent_cost_for_type(vehicle_id: int, type_id: int):
+    """Coût le plus récent (non NULL) pour un type d'entretien sur un véhicule."""
+    return vehicle_snapshot(vehicle_id).recent_cost(type_id)
+
+
+def estimate_maintenance_cost_next_months(vehicle_id: int, horizon_months: int = 6,
+                                          conn: sqlite3.Connection | None = None):
+    """Estimation des coûts à prévoir sur les prochains mois.
+
+    Pour chaque type cochée (enabled=1) :
+    - Si period_months > 0 :
+        on regarde la dernière date d'entretien de ce type.
+        On calcule dans combien de mois il est dû.
+        On compte les occurrences qui tombent dans la fenêtre [0, horizon_months].
+    - On utilise le coût le plus récent connu pour ce type.
+    """
+    total = 0.0
+    any_included = False
+    snap = vehicle_snapshot(vehicle_id)
+
+    for t in list_vehicle_types(vehicle_id, conn):
+        enabled = 1
+        try:
+            enabled = int(t["enabled"]) if t["enabled"] is not None else 1
+        except Exception:
+            enabled = 1
+        if enabled != 1:
+            continue
+
+        pm = t["period_months"]
+        try:
+            pm = int(pm) if pm is not None else 0
+        except Exception:
+            pm = 0
+        if pm <= 0:
+            continue
+
+        last_d, _last_km = snap.last_entretien(int(t["type_id"]))
+        if not last_d:
+            due_in_months = 0
+        else:
+            months_since = _month_diff(last_d, date.today())
+            due_in_months = pm - months_since
+
+        if due_in_months > horizon_months:
+            expected = 0
+        else:
+            first = max(0, due_in_months)
+            expected = 1 + max(0, (horizon_months - first) // pm)
+
+        if expected <= 0:
+            continue
+
+        cost = snap.recent_cost(int(t["type_id"]))
+        if cost is None or cost <= 0:
+            continue
+
+        total += cost * expected
+        any_included = True
+
+    return total if any_included else None
+
+
+# ----------------- DB API : Coûts agrégés -----------------
+
+def spent_last_months(vehicle_id: int, months: int = 12) -> dict:
+    """Dépenses réelles sur les N derniers mois (mois courant inclus), par source.
+
+    Retourne {"plein": float, "entretien": float} (0.0 si rien).
+    """
+    today = date.today()
+    since = _add_months(today, -(int(months) - 1)).strftime("%Y-%m")
+    until = today.strftime("%Y-%m")
+    snap = vehicle_snapshot(vehicle_id)
+    return {
+        source: math.fsum(t for ym, t in snap.monthly_costs(source).items() if since <= ym <= until)
+        for source in ("plein", "entretien")
+    }
+
+
+# ----------------- DB API : Vue flotte -----------------
+# Urgence d'un véhicule dans la grille flotte (tri / filtre)
+URGENCY_OK, URGENCY_WATCH, URGENCY_OVERDUE = 0, 1, 2
+URGENCY_LABELS = {URGENCY_OVERDUE: "En retard", URGENCY_WATCH: "À surveiller", URGENCY_OK: "OK"}
+
+
+def fleet_overview(months: int = 6) -> list[dict]:
+    """Une ligne par véhicule pour la grille flotte, sans requête par véhicule.
+
+    Une requête agrégée sur tout l'historique, archive comprise (conso, dernier km, dernière
+    tension batterie, dépenses des `months` derniers mois via couts_mensuels) + une requête groupée pour le dernier entretien de chaque
+    type suivi ; les rappels sont ensuite évalués en mémoire par _reminder_status.
+    """
+    today = date.today()
+    since = _add_months(date(today.year, today.month, 1), -(max(1, int(months)) - 1)).strftime("%Y-%m")
+    conn = _connect_db(full_history=True)  # mêmes chiffres que les cartes (instantanés sur *_all)
+    cur = conn.cursor()
+    cur.execute(
+        """
+        WITH p AS (
+            SELECT vehicule_id, MIN(km) AS kmin, MAX(km) AS kmax, SUM(litres) AS lsum, COUNT(*) AS n
+            FROM pleins_all GROUP BY vehicule_id
+        ), e AS (
+            SELECT vehicule_id, MAX(km) AS kmax FROM entretiens_all GROUP BY vehicule_id
+        ), b AS (
+            SELECT vehicule_id, battery_voltage,
+                   ROW_NUMBER() OVER (PARTITION BY vehicule_id ORDER BY jour DESC, km DESC, id DESC) AS rn
+            FROM entretiens_all WHERE battery_voltage IS NOT NULL
+        ), c AS (
+            SELECT vehicule_id, SUM(total) AS total FROM couts_mensuels WHERE mois >= ? GROUP BY vehicule_id
+        )
+        SELECT v.id, v.nom, v.immatriculation,
+               p.kmin, p.kmax AS pkmax, p.lsum, p.n, e.kmax AS ekmax,
+               b.battery_voltage AS vbat, COALESCE(c.total, 0) AS cost
+        FROM vehicules v
+        LEFT JOIN p ON p.vehicule_id = v.id
+        LEFT JOIN e ON e.vehicule_id = v.id
+        LEFT JOIN b ON b.vehicule_id = v.id AND b.rn = 1
+        LEFT JOIN c ON c.vehicule_id = v.id
+        ORDER BY v.id
+        """,
+        (since,),
+    )
+    rows = {}
+    for r in cur.fetchall():
+        kms = [k for k in (_safe_int(r["pkmax"]), _safe_int(r["ekmax"])) if k is not None]
+        conso = None
+        n, kmin, kmax, lsum = int(r["n"] or 0), _safe_int(r["kmin"]), _safe_int(r["pkmax"]), _safe_float(r["lsum"])
+        if n >= 2 and kmin is not None and kmax is not None and lsum is not None and kmax > kmin:
+            conso = lsum / (kmax - kmin) * 100.0
+        vbat = _safe_float(r["vbat"])
+        rows[int(r["id"])] = {
+            "id": int(r["id"]),
+            "nom": r["nom"] or f"Véhicule #{r['id']}",
+            "immatriculation": r["immatriculation"] or "",
+            "conso": conso,
+            "km": max(kms) if kms else None,
+            "vbat": vbat,
+            "bat_color": _battery_status(vbat)[1],
+            "cost": float(r["cost"] or 0.0),
+            "overdue": 0,
+            "soon": 0,
+        }
+
+    cur.execute(
+        """
+        WITH last AS (
+            SELECT vehicule_id, type_id, date_iso, km,
+                   ROW_NUMBER() OVER (PARTITION BY vehicule_id, type_id ORDER BY jour DESC, km DESC, id DESC) AS rn
+            FROM entretiens_all
+        )
+        SELECT vtt.vehicule_id, t.period_km, t.period_months, last.date_iso, last.km
+        FROM vehicule_entretien_types vtt
+        JOIN entretien_types t ON t.id = vtt.type_id
+        LEFT JOIN last ON last.vehicule_id = vtt.vehicule_id AND last.type_id = vtt.type_id AND last.rn = 1
+        WHERE COALESCE(vtt.enabled, 1) = 1
+        """
+    )
+    for r in cur.fetchall():
+        row = rows.get(int(r["vehicule_id"]))
+        if row is None:
+            continue
+        is_ok, color, _txt = _reminder_status(row["km"], r["date_iso"], r["km"], r["period_km"], r["period_months"], today)
+        if not is_ok:
+            row["overdue"] += 1
+        elif color == "orange":
+            row["soon"] += 1
+    conn.close()
+
+    for row in rows.values():
+        if row["overdue"] or row["bat_color"] == "red":
+            row["urgency"] = URGENCY_OVERDUE
+        elif row["soon"] or row["bat_color"] == "orange":
+            row["urgency"] = URGENCY_WATCH
+        else:
+            row["urgency"] = URGENCY_OK
+    return list(rows.values())
+
+
+# ----------------- Analyse : coût de possession -----------------
+
+# Une passe sur l'historique complet : événements datés des deux tables regroupés par (véhicule, mois),
+# puis fenêtres par véhicule. km parcourus = progression du compteur (max glissant des km relevés)
+# d'un mois sur l'autre ; premier mois : écart min/max du mois.
+_TCO_SQL = f"""
+    WITH ev AS (
+        SELECT vehicule_id, jour, km, {_PLEIN_COST_SQL.format(p='p')} AS carburant, 0.0 AS entretien
+        FROM pleins_all p WHERE jour IS NOT NULL
+        UNION ALL
+        SELECT vehicule_id, jour, km, 0.0, cout
+        FROM entretiens_all WHERE jour IS NOT NULL
+    ), mois AS (
+        SELECT vehicule_id, strftime('%Y-%m', jour + 1721424.5) AS mois,
+               TOTAL(carburant) AS carburant, TOTAL(entretien) AS entretien,
+               MIN(km) AS km_min, MAX(km) AS km_max
+        FROM ev GROUP BY vehicule_id, mois
+    ), odo AS (
+        SELECT *, MAX(km_max) OVER (PARTITION BY vehicule_id ORDER BY mois ROWS UNBOUNDED PRECEDING) AS compteur
+        FROM mois
+    )
+    SELECT vehicule_id, mois, carburant, entretien,
+           COALESCE(compteur - LAG(compteur) OVER w, km_max - km_min, 0) AS km,
+           SUM(carburant + entretien) OVER w AS cumul
+    FROM odo
+    WINDOW w AS (PARTITION BY vehicule_id ORDER BY mois)
+    ORDER BY vehicule_id, mois
+"""
+
+_tco_cache: tuple[int, list[dict]] | None = None
+
+
+def _tco_totals(carburant: float, entretien: float, km: float, n_mois: int) -> dict:
+    total = carburant + entretien
+    return {
+        "carburant": carburant,
+        "entretien": entretien,
+        "total": total,
+        "km": km,
+        "cout_km": total / km if km > 0 else None,
+        "cout_mois": total / n_mois if n_mois else None,
+    }
+
+
+def tco_overview() -> list[dict]:
+    """Coût de possession (carburant + entretien) de chaque véhicule, trié par nom.
+
+    Par véhicule : totaux (carburant, entretien, total, km, cout_km, cout_mois) + détail "mois"
+    (mois, carburant, entretien, km, cumul) et "annees" (annee + totaux). Calcul en une requête
+    (_TCO_SQL) mis en cache pour la version courante des données.
+    """
+    global _tco_cache
+    version = data_version()
+    cached = _tco_cache
+    hit = cached is not None and cached[0] == version
+    _perf.cache("coût de possession", hit)
+    if hit:
+        return cached[1]
+
+    conn = _connect_db(full_history=True)
+    cur = conn.cursor()
+    vehicles = cur.execute("SELECT id, nom, immatriculation FROM vehicules ORDER BY nom COLLATE NOCASE, id").fetchall()
+    months: dict[int, list[dict]] = collections.defaultdict(list)
+    for r in cur.execute(_TCO_SQL):
+        months[r["vehicule_id"]].append({
+            "mois": r["mois"], "carburant": r["carburant"], "entretien": r["entretien"],
+            "km": r["km"], "cumul": r["cumul"],
+        })
+    conn.close()
+
+    out = []
+    for v in vehicles:
+        rows = months.get(v["id"], [])
+        years: dict[int, list[float]] = {}
+        for m in rows:
+            acc = years.setdefault(int(m["mois"][:4]), [0.0, 0.0, 0.0, 0])
+            acc[0] += m["carburant"]
+            acc[1] += m["entretien"]
+            acc[2] += m["km"]
+            acc[3] += 1
+        n_mois = 0
+        if rows:
+            first, last = (date.fromisoformat(rows[i]["mois"] + "-01") for i in (0, -1))
+            n_mois = _month_diff(first, last) + 1
+        item = {"id": v["id"], "nom": v["nom"] or f"Véhicule #{v['id']}", "immatriculation": v["immatriculation"] or ""}
+        item.update(_tco_totals(math.fsum(m["carburant"] for m in rows), math.fsum(m["entretien"] for m in rows),
+                                sum(m["km"] for m in rows), n_mois))
+        item["mois"] = rows
+        item["annees"] = [dict(annee=y, **_tco_totals(c, e, k, n)) for y, (c, e, k, n) in sorted(years.items())]
+        out.append(item)
+
+    _tco_cache = (version, out)
+    return out
+
+
+def vehicle_tco(vehicle_id: int) -> dict | None:
+    """Entrée de tco_overview() pour un véhicule."""
+    return next((t for t in tco_overview() if t["id"] == int(vehicle_id)), None)
+
+
+# ----------------- Échéances : file de priorité flotte -----------------
+REMINDER_HORIZON_DAYS = 50 * 365  # au-delà, une échéance projetée au km n'a pas de sens (véhicule qui roule peu)
+# {flt} : "1" (toute la flotte) ou "vehicule_id = :vid" (recalcul d'un seul véhicule)
+_REMINDER_ROWS_SQL = """
+    WITH km_now AS (
+        SELECT vehicule_id, MAX(km) AS km FROM (
+            SELECT vehicule_id, km FROM pleins_all WHERE {flt}
+            UNION ALL SELECT vehicule_id, km FROM entretiens_all WHERE {flt}
+        ) GROUP BY vehicule_id
+    ), lastp AS (
+        SELECT vehicule_id, MAX(jour) AS j FROM pleins_all WHERE {flt} GROUP BY vehicule_id
+    ), rate AS (
+        -- rythme kilométrique sur les 12 derniers mois de pleins du véhicule
+        SELECT p.vehicule_id, MIN(p.km) AS kmin, MAX(p.km) AS kmax, MAX(p.jour) - MIN(p.jour) AS days
+        FROM pleins_all p JOIN lastp ON lastp.vehicule_id = p.vehicule_id
+        WHERE p.jour >= lastp.j - 365
+        GROUP BY p.vehicule_id
+    ), last AS (
+        SELECT vehicule_id, type_id, date_iso, jour, km,
+               ROW_NUMBER() OVER (PARTITION BY vehicule_id, type_id ORDER BY jour DESC, km DESC, id DESC) AS rn
+        FROM entretiens_all WHERE {flt}
+    )
+    SELECT v.id AS vehicule_id, v.nom, t.id AS type_id, t.nom AS type_name, t.period_km, t.period_months,
+           km_now.km AS current_km, rate.kmin, rate.kmax, rate.days,
+           last.jour AS last_jour, last.km AS last_km
+    FROM vehicules v
+    JOIN vehicule_entretien_types vtt ON vtt.vehicule_id = v.id AND COALESCE(vtt.enabled, 1) = 1
+    JOIN entretien_types t ON t.id = vtt.type_id
+    LEFT JOIN km_now ON km_now.vehicule_id = v.id
+    LEFT JOIN rate ON rate.vehicule_id = v.id
+    LEFT JOIN last ON last.vehicule_id = v.id AND last.type_id = t.id AND last.rn = 1
+    WHERE {flt_v}
+"""
+
+
+def _reminder_item(r, today: date) -> dict | None:
+    """Projette l'échéance d'un rappel : date due (mois, ou km au rythme récent) et km restants."""
+    pk = _safe_int(r["period_km"])
+    pm = _safe_int(r["period_months"])
+    if not pk and not pm:
+        return None
+    current_km = _safe_int(r["current_km"]) or 0
+    last_d = date.fromordinal(r["last_jour"]) if r["last_jour"] else None
+    last_km = _safe_int(r["last_km"])
+
+    km_per_day = None
+    days = _safe_float(r["days"])
+    if days and days >= 30 and r["kmax"] is not None and r["kmin"] is not None:
+        km_per_day = (int(r["kmax"]) - int(r["kmin"])) / days or None
+
+    never = last_d is None and last_km is None
+    km_left = None
+    candidates = []
+    if never:
+        candidates.append(today)
+    else:
+        if pm and last_d:
+            candidates.append(_add_months(last_d, pm))
+        if pk and last_km is not None:
+            km_left = pk - (current_km - last_km)
+            if km_per_day:
+                days_left = km_left / km_per_day
+                if days_left <= REMINDER_HORIZON_DAYS:  # sinon pas de date au km (et pas d'OverflowError)
+                    candidates.append(today + timedelta(days=max(math.floor(days_left), -REMINDER_HORIZON_DAYS)))
+            elif km_left <= 0:
+                candidates.append(today)
+    if not candidates and km_left is None:
+        return None
+
+    due = min(candidates) if candidates else None
+    is_ok, color, label = _reminder_status(current_km, last_d, last_km, pk, pm, today)
+    return {
+        "vehicle_id": int(r["vehicule_id"]),
+        "vehicule": r["nom"] or f"Véhicule #{r['vehicule_id']}",
+        "type_id": int(r["type_id"]),
+        "type_name": r["type_name"] or "",
+        "due_date": due,
+        "km_left": km_left,
+        "overdue": not is_ok,
+        "color": color,
+        "label": label,
+    }
+
+
+class ReminderIndex:
+    """Rappels de toute la flotte dans un tas trié par échéance projetée (puis km restants).
+
+    Construit en une requête ; une écriture (plein, entretien, type) ne recalcule que le
+    véhicule concerné. Les entrées remplacées restent dans le tas et sont ignorées à la
+    lecture (jeton par couple véhicule/type), le tas étant compacté quand elles dominent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap: list[tuple] = []
+        self._live: dict[tuple[int, int], tuple] = {}   # (véhicule, type) -> entrée courante
+        self._by_vehicle: dict[int, set] = {}
+        self._seq = itertools.count()
+        self.built_on: date | None = None
+
+    @staticmethod
+    def _fetch(vehicle_id=None) -> list:
+        conn = _connect_db(full_history=True)  # rythme et derniers entretiens : archive comprise
+        cur = conn.cursor()
+        if vehicle_id is None:
+            cur.execute(_REMINDER_ROWS_SQL.format(flt="1", flt_v="1"))
+        else:
+            cur.execute(_REMINDER_ROWS_SQL.format(flt="vehicule_id = :vid", flt_v="v.id = :vid"),
+                        {"vid": int(vehicle_id)})
+        rows = cur.fetchall()
+        conn.close()
+        return rows
+
+    def _push(self, item: dict) -> None:
+        due = item["due_date"]
+        km_left = item["km_left"]
+        entry = (due.toordinal() if due else math.inf, km_left if km_left is not None else math.inf,
+                 next(self._seq), item)
+        key = (item["vehicle_id"], item["type_id"])
+        self._live[key] = entry
+        self._by_vehicle.setdefault(item["vehicle_id"], set()).add(key)
+        heapq.heappush(self._heap, entry)
+
+    def rebuild(self) -> None:
+        today = date.today()
+        rows = self._fetch()
+        with self._lock:
+            self._heap, self._live, self._by_vehicle = [], {}, {}
+            for r in rows:
+                item = _reminder_item(r, today)
+                if item is not None:
+                    self._push(item)
+            self.built_on = today
+
+    def refresh_vehicle(self, vehicle_id: int) -> None:
+        """Recalcule les rappels d'un véhicule (après une écriture qui le concerne)."""
+        today = date.today()
+        rows = self._fetch(vehicle_id)
+        with self._lock:
+            for key in self._by_vehicle.pop(int(vehicle_id), ()):
+                self._live.pop(key, None)
+            for r in rows:
+                item = _reminder_item(r, today)
+                if item is not None:
+                    self._push(item)
+            if len(self._heap) > 2 * len(self._live) + 64:
+                self._heap = list(self._live.values())
+                heapq.heapify(self._heap)
+
+    def next_due(self, n: int = 20) -> list[dict]:
+        """Les n prochains rappels de la flotte, du plus urgent au plus lointain."""
+        if self.built_on != date.today():
+            self.rebuild()  # projections en jours relatives à aujourd'hui
+        with self._lock:
+            out = []
+            while self._heap and len(out) < n:
+                entry = heapq.heappop(self._heap)
+                item = entry[3]
+                if self._live.get((item["vehicle_id"], item["type_id"])) is entry:
+                    out.append(entry)
+            for entry in out:
+                heapq.heappush(self._heap, entry)
+            return [e[3] for e in out]
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+
+_reminder_index: ReminderIndex | None = None
+
+
+def reminder_index() -> ReminderIndex:
+    global _reminder_index
+    _perf.cache("index des échéances", _reminder_index is not None)
+    if _reminder_index is None:
+        idx = ReminderIndex()
+        idx.rebuild()
+        _reminder_index = idx
+    return _reminder_index
+
+
+def _reminder_index_touch(*vehicle_ids) -> None:
+    """Mise à jour incrémentale de l'index d'échéances s'il est chargé."""
+    if _reminder_index is None:
+        return
+    for vid in {int(v) for v in vehicle_ids if v is not None}:
+        _reminder_index.refresh_vehicle(vid)
+
+
+def _reminder_index_reset() -> None:
+    """Invalide tout l'index (changement de périodicité d'un type partagé)."""
+    global _reminder_index
+    _reminder_index = None
+
+
+def _db_caches_reset() -> None:
+    """Invalide les index et caches tirés de la base (échéances, lieux, mots-clés réparation) :
+    base remplacée par un import, ou modifiée par un autre poste / processus."""
+    global _lieu_index, _repair_keywords_cache
+    _reminder_index_reset()
+    _lieu_index = None
+    _repair_keywords_cache = None
+
+
+def _fmt_due(item: dict, today: date | None = None) -> str:
+    """Échéance lisible : date projetée et km restants."""
+    today = today or date.today()
+    parts = []
+    if item["due_date"] is not None:
+        days = (item["due_date"] - today).days
+        when = item["due_date"].strftime("%d/%m/%Y")
+        parts.append(f"{when} (dans {days} j)" if days > 0 else (f"{when} (il y a {-days} j)" if days < 0 else f"{when} (aujourd’hui)"))
+    if item["km_left"] is not None:
+        parts.append(f"{item['km_left']} km restants" if item["km_left"] > 0 else f"dépassé de {-item['km_left']} km")
+    return " / ".join(parts)
+
+
+# ----------------- DB API : Recherche plein texte -----------------
+
+def _fts_query(text: str) -> str | None:
+    """Transforme la saisie en requête FTS5 : mots entre guillemets (ET implicite), préfixe sur le dernier."""
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += "*"  # recherche au fil de la frappe
+    return " ".join(terms)
+
+
+def search_records(text: str, limit: int = 100):
+    """Recherche dans les entretiens (intervention, détails, effectué par) et les préconisations
+    de toute la flotte, historique archivé compris, classée par pertinence (bm25).
+
+    Lignes : source ('entretien'|'preco'), ref_id, vehicule_id, vehicule, date_iso, km, extrait.
+    """
+    conn = _connect_db(full_history=True)
+    cur = conn.cursor()
+    if _table_exists(cur, "recherche"):
+        match = _fts_query(text)
+        if not match:
+            conn.close()
+            return []
+        # Le classement + LIMIT se font dans la table FTS ; les jointures ne portent que sur les résultats.
+        cur.execute(
+            """
+            WITH hits AS (
+                SELECT rowid, source, vehicule_id, rank,
+                       snippet(recherche, -1, '«', '»', '…', 12) AS extrait
+                FROM recherche
+                WHERE recherche MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            )
+            SELECT h.source,
+                   CASE WHEN h.source = 'entretien' THEN h.rowid / 2 ELSE (h.rowid - 1) / 2 END AS ref_id,
+                   h.vehicule_id,
+                   COALESCE(v.nom, 'Véhicule #' || h.vehicule_id) AS vehicule,
+                   COALESCE(e.date_iso, SUBSTR(p.created_at, 1, 10)) AS date_iso,
+                   e.km,
+                   h.extrait
+            FROM hits h
+            LEFT JOIN vehicules v ON v.id = h.vehicule_id
+            LEFT JOIN entretiens_all e ON h.source = 'entretien' AND e.id = h.rowid / 2
+            LEFT JOIN preconisations p ON h.source = 'preco' AND p.id = (h.rowid - 1) / 2
+            ORDER BY h.rank
+            """,
+            (match, int(limit)),
+        )
+    else:
+        # SQLite sans FTS5 : recherche simple (plus lente, non classée)
+        like = f"%{(text or '').strip()}%"
+        if like == "%%":
+            conn.close()
+            return []
+        cur.execute(
+            """
+            SELECT 'entretien' AS source, e.id AS ref_id, e.vehicule_id,
+                   COALESCE(v.nom, 'Véhicule #' || e.vehicule_id) AS vehicule,
+                   e.date_iso, e.km,
+                   TRIM(COALESCE(e.intervention, '') || ' — ' || COALESCE(e.details, '')) AS extrait
+            FROM entretiens_all e LEFT JOIN vehicules v ON v.id = e.vehicule_id
+            WHERE e.intervention LIKE ?1 OR e.details LIKE ?1 OR e.performed_by LIKE ?1
+            UNION ALL
+            SELECT 'preco', p.id, p.vehicule_id,
+                   COALESCE(v.nom, 'Véhicule #' || p.vehicule_id),
+                   SUBSTR(p.created_at, 1, 10), NULL, p.texte
+            FROM preconisations p LEFT JOIN vehicules v ON v.id = p.vehicule_id
+            WHERE p.texte LIKE ?1
+            ORDER BY 5 DESC
+            LIMIT ?2
+            """,
+            (like, int(limit)),
+        )
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+# ----------------- Graphiques (Matplotlib, Tk ou Agg) -----------------
+
+def _graph_dark_style(ax):
+    """Applique un style sombre (idempotent) à un axe Matplotlib."""
+    ax.set_facecolor("#1e1e1e")
+    ax.tick_params(colors="#dddddd")
+    ax.xaxis.label.set_color("#dddddd")
+    ax.yaxis.label.set_color("#dddddd")
+    # Grille discrète
+    ax.grid(True, axis="y", linestyle=":", linewidth=0.6, alpha=0.30)
+    # Spines
+    for sp in ax.spines.values():
+        sp.set_color("#777777")
+    ax.title.set_color("#dddddd")
+
+
+def _graph_title(ax, text_label):
+    """Titre placé dans le graphe, en haut à gauche."""
+    ax.set_title("")
+    ax.text(
+        0.01, 0.99, text_label,
+        transform=ax.transAxes,
+        ha="left", va="top",
+        fontsize=10,
+        color="#dddddd",
+        bbox=dict(boxstyle="round,pad=0.25", facecolor="#000000", edgecolor="#666666", alpha=0.35),
+    )
+
+
+CONSO_WINDOW_KM = 200  # bloc de distance pour un point de conso représentatif
+
+
+def _conso_windows(jour, km, litres, max_l100=15.0, window_km=CONSO_WINDOW_KM):
+    """Conso par blocs d'au moins window_km, sur des colonnes NumPy de pleins.
+
+    Pleins triés par km (puis jour) ; un plein compte si son km dépasse celui du précédent.
+    Les sommes cumulées de distance et de litres sont découpées par searchsorted : une
+    recherche par bloc au lieu d'une itération par plein.
+    Retourne (nb pleins exploitables, jours, conso, nb blocs masqués > max_l100).
+    """
+    import numpy as np
+    ok = ~(np.isnan(km) | np.isnan(litres))
+    jour, km, litres = jour[ok], km[ok], litres[ok]
+    order = np.lexsort((jour, km))  # par km puis jour ; tri stable : l'ordre d'insertion départage
+    jour, km, litres = jour[order], km[order], litres[order]
+    n = len(km)
+    if n < 2:
+        return n, np.empty(0), np.empty(0), 0
+
+    dkm = np.diff(km)
+    step = dkm > 0
+    dist = np.cumsum(np.where(step, dkm, 0.0))
+    conso_l = np.cumsum(np.where(step, litres[1:], 0.0))
+    ends = []
+    base = 0.0
+    while True:
+        i = int(np.searchsorted(dist, base + window_km, side="left"))
+        if i >= len(dist):
+            break
+        ends.append(i)
+        base = dist[i]
+    if not ends:
+        return n, np.empty(0), np.empty(0), 0
+
+    ends = np.asarray(ends)
+    d_end, l_end = dist[ends], conso_l[ends]
+    d_start = np.concatenate(([0.0], d_end[:-1]))
+    l_start = np.concatenate(([0.0], l_end[:-1]))
+    conso = (l_end - l_start) / (d_end - d_start) * 100.0
+    x = jour[1:][ends]
+    too_high = conso > float(max_l100)
+    keep = ~too_high & ~np.isnan(x)
+    return n, x[keep], conso[keep], int(too_high.sum())
+
+
+def plot_conso_per_fill(ax, vehicle_id: int, max_l100=15.0, since=None, until=None):
+    """Conso (L/100) robuste (moyenne par blocs de km) + masquage des pics.
+
+    since / until : période affichée (bornes incluses, None = ouverte), filtrée dans la requête.
+    """
+    _graph_dark_style(ax)
+    _graph_title(ax, "Conso (L/100 km)")
+
+    snap = vehicle_snapshot(vehicle_id, since, until)
+    n, xs, ys, masked = _conso_windows(snap.column("p_jour"), snap.column("p_km"), snap.column("p_litres"), max_l100)
+
+    if n < 2:
+        ax.text(0.5, 0.5, "Pas assez de pleins (>= 2).", ha="center", va="center",
+                transform=ax.transAxes, color="#dddddd")
+        ax.set_ylabel("L/100 km")
+        ax.set_xlabel("")
+        return
+
+    if not len(xs):
+        ax.text(
+            0.5, 0.5,
+            f"Données insuffisantes (ou tout masqué).\nAstuce : baisse CONSO_WINDOW_KM ou augmente le seuil.",
+            ha="center", va="center", transform=ax.transAxes, color="#dddddd"
+        )
+        ax.set_ylabel("L/100 km")
+        ax.set_xlabel("")
+        return
+
+    # jours ordinaux -> dates Matplotlib en une opération vectorielle (pas de parsing de chaînes)
+    line = ax.plot(xs - _MPL_EPOCH_ORD, ys, marker="o", linewidth=2)[0]
+    ax.xaxis_date()
+
+    ax.set_ylabel("L/100 km")
+    ax.set_xlabel("")
+
+    # rotation si dates
+    try:
+        for tick in ax.get_xticklabels():
+            tick.set_rotation(20)
+            tick.set_ha("right")
+    except Exception:
+        pass
+
+    # Compteur points masqués (bas droite)
+    if masked:
+        ax.text(
+            0.99, 0.01,
+            f"{masked} point(s) masqué(s) (> {float(max_l100):.0f} L/100)",
+            transform=ax.transAxes,
+            ha="right", va="bottom",
+            fontsize=8,
+            color="#bbbbbb",
+        )
+
+def plot_price_per_litre(ax, vehicle_id: int, since=None, until=None):
+    _graph_dark_style(ax)
+
+    # Titre adapté à l'énergie du véhicule
+    energie = ""
+    try:
+        v = get_vehicle(int(vehicle_id))
+        energie = (v["energie"] or "").strip()
+    except Exception:
+        energie = ""
+
+    def _fuel_phrase(e: str) -> str:
+        e_low = e.lower()
+        if any(k in e_low for k in ("ess", "sp95", "sp98", "e10")):
+            return "d’essence"
+        if any(k in e_low for k in ("dies", "gazo", "gasoil", "gazole")):
+            return "de gasoil"
+        if "e85" in e_low:
+            return "d’E85"
+        if "gpl" in e_low:
+            return "de GPL"
+        # fallback générique
+        return "d’" + e if e[:1].lower() in "aeiouyàâäéèêëîïôöùûüœ" else "de " + e
+
+    if energie:
+        _graph_title(ax, f"Prix du litre {_fuel_phrase(energie)} dans le temps")
+    else:
+        _graph_title(ax, "Prix du litre dans le temps")
+
+    import numpy as np
+    snap = vehicle_snapshot(vehicle_id, since, until)  # pleins déjà dans l'ordre chronologique
+    jour, prix = snap.column("p_jour"), snap.column("p_prix")
+    ok = np.isfinite(jour) & np.isfinite(prix)
+    xs = jour[ok] - _MPL_EPOCH_ORD
+    ys = prix[ok]
+
+    if not len(xs):
+        ax.text(0.5, 0.5, "Aucun plein avec prix/L à tracer.", ha="center", va="center",
+                transform=ax.transAxes, color="#dddddd")
+        ax.set_ylabel("€/L")
+        ax.set_xlabel("")
+        return
+
+    ax.plot(xs, ys, marker="o", linewidth=2)
+    ax.xaxis_date()
+    ax.set_ylabel("€/L")
+    ax.set_xlabel("")
+    for tick in ax.get_xticklabels():
+        tick.set_rotation(20)
+        tick.set_ha("right")
+
+
+def plot_entretien_cost_per_year(ax, vehicle_id: int, since=None, until=None):
+    """Coût entretien par an, séparé Entretiens vs Réparations."""
+    _graph_dark_style(ax)
+    _graph_title(ax, "Coût entretien (€/an)")
+
+    import numpy as np
+    snap = vehicle_snapshot(vehicle_id, since, until)
+    jour, cout = snap.column("e_jour"), snap.column("e_cout")
+    ok = np.isfinite(jour) & np.isfinite(cout)
+
+    if not ok.any():
+        ax.text(
+            0.5, 0.5, "Aucun entretien avec coût à tracer.",
+            ha="center", va="center", transform=ax.transAxes, color="#dddddd"
+        )
+        ax.set_ylabel("€")
+        ax.set_xlabel("")
+        return
+
+    # Agrégation annuelle : jours ordinaux -> années via datetime64, puis sommes par année
+    annees = (jour[ok] - _MPL_EPOCH_ORD).astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+    years, idx = np.unique(annees, return_inverse=True)
+    cout = cout[ok]
+    rep = snap.column("e_repair")[ok] != 0
+    ent_vals = np.bincount(idx[~rep], weights=cout[~rep], minlength=len(years))
+    rep_vals = np.bincount(idx[rep], weights=cout[rep], minlength=len(years))
+    years = years.tolist()
+
+    x = np.arange(len(years), dtype=float)
+    width = 0.38
+
+    # Barres: couleurs fixées (bleu/orange) pour rester lisible
+    bars_ent = ax.bar(x - width/2, ent_vals, width=width, color="#1f77b4", label="Entretiens")
+    bars_rep = ax.bar(x + width/2, rep_vals, width=width, color="#ff7f0e", label="Réparations")
+
+    ax.set_ylabel("€")
+    ax.set_xlabel("")
+    ax.set_xticks(x)
+    ax.set_xticklabels([str(y) for y in years], color="#dddddd")
+
+    # suppression du trait qui donne l'impression d'un repere année precis   
+    ax.tick_params(axis="x", which="both", length=0)
+
+    # Légende en haut à droite, compacte
+    leg = ax.legend(loc="upper right", frameon=True, fontsize=9)
+    if leg and leg.get_frame():
+        leg.get_frame().set_facecolor("#1e1e1e")
+        leg.get_frame().set_edgecolor("#666666")
+        leg.get_frame().set_alpha(0.6)
+
+    def annotate(bars):
+        for b in bars:
+            h = float(b.get_height())
+            if h <= 0:
+                continue
+
+            ax.text(
+                b.get_x() + b.get_width()/2,
+                h / 2,              # <-- milieu vertical de la barre
+                f"{h:.0f}€",
+                ha="center",
+                va="center",        # <-- centré verticalement
+                fontsize=8,
+                color="#ffffff",    # plus lisible au milieu
+                fontweight="bold",
+            )
+
+
+    annotate(bars_ent)
+    annotate(bars_rep)
+
+    # Un peu d'air en bas pour les labels
+    ax.set_ylim(bottom=0)
+
+
+def plot_tco(ax, vehicle_id: int, since=None, until=None):
+    """Coût de possession par an (carburant + entretien empilés) et coût au km de chaque année.
+
+    Lit tco_overview() (en cache) ; la période est appliquée au mois près.
+    """
+    _graph_dark_style(ax)
+    _graph_title(ax, "Coût de possession (€/an)")
+    tco = vehicle_tco(vehicle_id)
+    lo, hi = _parse_iso_date(since), _parse_iso_date(until)
+    years: dict[int, list[float]] = {}
+    for m in (tco["mois"] if tco else []):
+        if (lo and m["mois"] < lo.strftime("%Y-%m")) or (hi and m["mois"] > hi.strftime("%Y-%m")):
+            continue
+        acc = years.setdefault(int(m["mois"][:4]), [0.0, 0.0, 0.0])
+        acc[0] += m["carburant"]
+        acc[1] += m["entretien"]
+        acc[2] += m["km"]
+
+    if not years:
+        ax.text(0.5, 0.5, "Aucun coût à tracer.", ha="center", va="center",
+                transform=ax.transAxes, color="#dddddd")
+        ax.set_ylabel("€")
+        ax.set_xlabel("")
+        return
+
+    import numpy as np
+    labels = sorted(years)
+    fuel, maint, km = (np.array([years[y][i] for y in labels]) for i in range(3))
+    x = np.arange(len(labels), dtype=float)
+    ax.bar(x, fuel, width=0.6, color="#1f77b4", label="Carburant")
+    ax.bar(x, maint, width=0.6, bottom=fuel, color="#ff7f0e", label="Entretien")
+    for xi, total, k in zip(x, fuel + maint, km):
+        if total > 0 and k > 0:
+            ax.text(xi, total, f"{total / k:.3f} €/km".replace(".", ","), ha="center", va="bottom",
+                    fontsize=8, color="#dddddd")
+
+    ax.set_ylabel("€")
+    ax.set_xlabel("")
+    ax.set_xticks(x)
+    ax.set_xticklabels([str(y) for y in labels], color="#dddddd")
+    ax.tick_params(axis="x", which="both", length=0)
+    ax.set_ylim(bottom=0, top=float((fuel + maint).max()) * 1.15 or 1.0)
+    leg = ax.legend(loc="upper right", frameon=True, fontsize=9)
+    if leg and leg.get_frame():
+        leg.get_frame().set_facecolor("#1e1e1e")
+        leg.get_frame().set_edgecolor("#666666")
+        leg.get_frame().set_alpha(0.6)
+
+
+# Comparaison flotte : pleins bruts + coûts d'entretien déjà sommés par (véhicule, année), en une requête
+_COMPARE_SQL = """
+    SELECT 0 AS src, vehicule_id, jour, km, litres, prix_litre AS valeur
+    FROM pleins_all
+    WHERE vehicule_id IN ({ids}){rng}
+    UNION ALL
+    SELECT 1, vehicule_id, CAST(strftime('%Y', date_iso) AS INTEGER) AS annee, NULL, NULL, SUM(cout)
+    FROM entretiens_all
+    WHERE vehicule_id IN ({ids}) AND cout IS NOT NULL AND date_iso IS NOT NULL{rng}
+    GROUP BY vehicule_id, annee
+    ORDER BY src, vehicule_id
+"""
+
+
+def fleet_comparison(vehicle_ids, since=None, until=None, max_l100=15.0) -> dict:
+    """Séries de comparaison de plusieurs véhicules, lues en une seule requête.
+
+    Retourne {vehicle_id: {"conso": (jours, L/100), "prix": (jours, €/L), "cout_annuel": (années, €)}}
+    (tableaux NumPy, éventuellement vides). Les lignes arrivent groupées par véhicule : chaque
+    groupe est découpé par np.diff puis traité en vectoriel.
+    """
+    import numpy as np
+    vids = sorted({int(v) for v in vehicle_ids})
+    empty = (np.empty(0), np.empty(0))
+    out = {vid: {"conso": empty, "prix": empty, "cout_annuel": empty} for vid in vids}
+    if not vids:
+        return out
+
+    since, until = _jour_bound(since), _jour_bound(until)
+    params = list(vids)
+    rng = ""
+    if since is not None or until is not None:
+        rng = _SNAPSHOT_RANGE_SQL
+        params += [since if since is not None else 0, until if until is not None else date.max.toordinal()]
+    conn = _connect_db(full_history=True)
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(_COMPARE_SQL.format(ids=", ".join("?" * len(vids)), rng=rng), params * 2)
+    data = np.array(cur.fetchall(), dtype=float).reshape(-1, 6)  # NULL -> NaN
+    conn.close()
+
+    for src in (0, 1):
+        block = data[data[:, 0] == src]
+        if not len(block):
+            continue
+        cuts = np.flatnonzero(np.diff(block[:, 1])) + 1
+        for part in np.split(block, cuts):
+            series = out[int(part[0, 1])]
+            jour, valeur = part[:, 2], part[:, 5]
+            if src == 0:
+                _n, x, y, _masked = _conso_windows(jour, part[:, 3], part[:, 4], max_l100)
+                series["conso"] = (x, y)
+                ok = np.isfinite(jour) & np.isfinite(valeur)
+                order = np.argsort(jour[ok], kind="stable")
+                series["prix"] = (jour[ok][order], valeur[ok][order])
+            else:
+                order = np.argsort(jour)  # jour contient ici l'année
+                series["cout_annuel"] = (jour[order].astype(int), valeur[order])
+    return out
+
+
+def plot_fleet_comparison(axes, vehicle_ids, names: dict | None = None, since=None, until=None, max_l100=15.0):
+    """Superpose conso, prix du litre et coût entretien annuel de plusieurs véhicules (3 axes)."""
+    import numpy as np
+    if names is None:
+        names = {v.id: v.nom or f"Véhicule #{v.id}" for v in list_vehicles()}
+    series = fleet_comparison(vehicle_ids, since, until, max_l100)
+    titles = ("Conso (L/100 km)", "Prix du litre (€/L)", "Coût entretien (€/an)")
+    for ax, title in zip(axes, titles):
+        _graph_dark_style(ax)
+        _graph_title(ax, title)
+    if not series:
+        axes[0].text(0.5, 0.5, "Sélectionne au moins un véhicule à comparer.", ha="center", va="center",
+                     transform=axes[0].transAxes, color="#dddddd")
+        return
+
+    ax_conso, ax_prix, ax_cout = axes[:3]
+    colors = {vid: f"C{k % 10}" for k, vid in enumerate(series)}  # même couleur sur les 3 graphes
+    for vid, s in series.items():
+        label = names.get(vid, f"Véhicule #{vid}")
+        for ax, key in ((ax_conso, "conso"), (ax_prix, "prix")):
+            x, y = s[key]
+            if len(x):
+                ax.plot(x - _MPL_EPOCH_ORD, y, marker="o", markersize=3, linewidth=1.5,
+                        color=colors[vid], label=label)
+    for ax, unit in ((ax_conso, "L/100 km"), (ax_prix, "€/L")):
+        ax.set_ylabel(unit)
+        if ax.lines:
+            ax.xaxis_date()
+            for tick in ax.get_xticklabels():
+                tick.set_rotation(20)
+                tick.set_ha("right")
+        else:
+            ax.text(0.5, 0.5, "Aucune donnée sur la période.", ha="center", va="center",
+                    transform=ax.transAxes, color="#dddddd")
+
+    # Coût annuel : barres groupées par année, une couleur par véhicule
+    years = sorted({int(y) for s in series.values() for y in s["cout_annuel"][0]})
+    ax_cout.set_ylabel("€")
+    if not years:
+        ax_cout.text(0.5, 0.5, "Aucun entretien avec coût sur la période.", ha="center", va="center",
+                     transform=ax_cout.transAxes, color="#dddddd")
+    else:
+        x = np.arange(len(years), dtype=float)
+        with_costs = [vid for vid, s in series.items() if len(s["cout_annuel"][0])]
+        width = 0.8 / len(with_costs)
+        for k, vid in enumerate(with_costs):
+            ys, costs = series[vid]["cout_annuel"]
+            vals = np.zeros(len(years))
+            vals[np.searchsorted(years, ys)] = costs
+            ax_cout.bar(x - 0.4 + width * (k + 0.5), vals, width=width, color=colors[vid],
+                        label=names.get(vid, f"Véhicule #{vid}"))
+        ax_cout.set_xticks(x)
+        ax_cout.set_xticklabels([str(y) for y in years], color="#dddddd")
+        ax_cout.tick_params(axis="x", which="both", length=0)
+        ax_cout.set_ylim(bottom=0)
+
+    for ax in (ax_conso, ax_prix, ax_cout):
+        handles, _labels = ax.get_legend_handles_labels()
+        if handles:
+            leg = ax.legend(loc="upper right", frameon=True, fontsize=8, ncol=min(4, len(handles)))
+            leg.get_frame().set_facecolor("#1e1e1e")
+            leg.get_frame().set_edgecolor("#666666")
+            leg.get_frame().set_alpha(0.6)
+            for text in leg.get_texts():
+                text.set_color("#dddddd")
+
+
+# Préréglages de période de l'onglet Graphiques : (libellé, nombre de mois ; None = tout)
+GRAPH_PERIODS = (
+    ("12 derniers mois", 12),
+    ("3 dernières années", 36),
+    ("Tout l'historique", None),
+)
+GRAPH_PERIOD_CUSTOM = "Personnalisée"
+GRAPH_VIEW_COMPARE = "4) Comparaison flotte"
+GRAPH_VIEW_TCO = "5) Coût de possession"
+
+# Graphes exportables : (suffixe du fichier, fonction de tracé)
+GRAPH_EXPORTS = (
+    ("conso", plot_conso_per_fill),
+    ("prix_litre", plot_price_per_litre),
+    ("cout_entretien", plot_entretien_cost_per_year),
+)
+
+
+def render_vehicle_graphs(vehicle_id: int, out_dir: str, fmt: str = "png", max_l100=15.0, dpi: int = 100):
+    """Rend les graphes d'un véhicule dans des fichiers image (backend Agg, sans écran).
+
+    Retourne la liste des fichiers écrits : <out_dir>/V<ID>_<graphe>.<fmt>
+    """
+    # Canvas Agg explicite : aucun besoin de Tk ni d'affichage (processus fils, serveur...)
+    from matplotlib.figure import Figure as AggFigure  # type: ignore
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # type: ignore
+
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for name, plot in GRAPH_EXPORTS:
+        fig = AggFigure(figsize=(9.0, 4.2), dpi=dpi)
+        FigureCanvasAgg(fig)
+        fig.patch.set_facecolor("#1e1e1e")
+        ax = fig.add_subplot(111)
+        if plot is plot_conso_per_fill:
+            plot(ax, vehicle_id, max_l100=max_l100)
+        else:
+            plot(ax, vehicle_id)
+        fig.subplots_adjust(left=0.08, right=0.98, top=0.96, bottom=0.14)
+
+        path = os.path.join(out_dir, f"V{int(vehicle_id)}_{name}.{fmt}")
+        fig.savefig(path, format=fmt, facecolor=fig.get_facecolor())
+        written.append(path)
+    return written
+
+
+def render_all_graphs(out_dir: str, fmt: str = "png", jobs: int | None = None, max_l100=15.0):
+    """Rend les graphes de tous les véhicules, répartis sur un pool de processus.
+
+    Chaque véhicule est traité par un processus (connexion SQLite et figure propres).
+    Retourne (fichiers écrits, erreurs) ; une erreur sur un véhicule n'arrête pas les autres.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    vehicle_ids = [int(r["id"]) for r in list_vehicles()]
+    written, errors = [], []
+    if not vehicle_ids:
+        return written, errors
+
+    if jobs == 1 or len(vehicle_ids) == 1:
+        for vid in vehicle_ids:
+            try:
+                written.extend(render_vehicle_graphs(vid, out_dir, fmt, max_l100))
+            except Exception as e:
+                errors.append((vid, str(e)))
+        return written, errors
+
+    workers = min(len(vehicle_ids), jobs or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_vehicle_graphs, vid, out_dir, fmt, max_l100): vid for vid in vehicle_ids}
+        for fut in as_completed(futures):
+            try:
+                written.extend(fut.result())
+            except Exception as e:
+                errors.append((futures[fut], str(e)))
+    written.sort()
+    return written, errors
+
+
+# ----------------- Écritures en arrière-plan -----------------
+class DbWorker:
+    """Thread unique d'écriture SQLite : les commits ne bloquent plus la boucle Tk.
+
+    Les tâches sont exécutées une par une, dans l'ordre de soumission (file FIFO), et
+    renvoient un Future. Côté interface, `run()` relève les résultats par `after()` et
+    appelle les callbacks dans ce même ordre ; une erreur est affichée dans une messagebox.
+    """
+
+    POLL_MS = 25
+
+    def __init__(self, name: str = "garage-db-writer"):
+        self._name = name
+        self._jobs: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._pending: collections.deque = collections.deque()  # (future, widget, on_done, on_error) — thread Tk
+        self._polling = False
+
+    def _loop(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            fut, fn, args, kwargs = job
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(call_with_busy_retry(fn, *args, **kwargs))
+            except BaseException as e:
+                fut.set_exception(e)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Met une tâche en file ; utilisable hors Tk (le Future se consulte directement)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name=self._name, daemon=True)
+            self._thread.start()
+        fut: Future = Future()
+        self._jobs.put((fut, fn, args, kwargs))
+        return fut
+
+    def run(self, widget, fn, *args, on_done=None, on_error=None, **kwargs) -> Future:
+        """Soumet une tâche et livre son résultat dans le thread Tk (on_done(résultat) / on_error(exc))."""
+        fut = self.submit(fn, *args, **kwargs)
+        self._pending.append((fut, widget, on_done, on_error))
+        if not self._polling:
+            # Relève sur la fenêtre racine : un éditeur (Toplevel) peut être détruit par son on_done
+            root = widget.nametowidget(".")
+            root.after(self.POLL_MS, self._pump, root)
+            self._polling = True
+        return fut
+
+    def _pump(self, root) -> None:
+        try:
+            # Tête de file d'abord : le thread étant FIFO, l'ordre de livraison est celui de soumission
+            while self._pending and self._pending[0][0].done():
+                fut, w, on_done, on_error = self._pending.popleft()
+                exc = fut.exception()
+                try:
+                    if exc is not None:
+                        if callable(on_error):
+                            on_error(exc)
+                        else:
+                            messagebox.showerror("Base de données", f"Enregistrement impossible :\n{exc}",
+                                                 parent=w if w.winfo_exists() else None)
+                    elif callable(on_done):
+                        on_done(fut.result())
+                except tk.TclError:
+                    pass  # fenêtre fermée entre-temps
+                except Exception as e:
+                    # Un callback en erreur ne doit pas bloquer la livraison des suivants
+                    traceback.print_exc()
+                    try:
+                        messagebox.showerror("Erreur", f"Erreur après l'enregistrement :\n{e}",
+                                             parent=w if w.winfo_exists() else None)
+                    except tk.TclError:
+                        pass
+        finally:
+            self._polling = False
+            if self._pending:
+                try:
+                    root.after(self.POLL_MS, self._pump, root)
+                    self._polling = True
+                except tk.TclError:
+                    pass  # application fermée
+
+    def busy(self) -> bool:
+        return bool(self._pending) or not self._jobs.empty()
+
+    def stop(self, timeout: float | None = 10.0) -> None:
+        """Termine les écritures en file puis arrête le thread (fermeture de l'application)."""
+        if self._thread is not None and self._thread.is_alive():
+            self._jobs.put(None)
+            self._thread.join(timeout)
+        self._thread = None
+
+
+_db_worker: DbWorker | None = None
+
+
+def db_worker() -> DbWorker:
+    global _db_worker
+    if _db_worker is None:
+        _db_worker = DbWorker()
+    return _db_worker
+
+
+# ----------------- Sauvegardes -----------------
+# Sauvegarde à chaud par l'API de sauvegarde SQLite, par étapes de BACKUP_PAGES_PER_STEP pages :
+# entre deux étapes l'application peut écrire (la copie reprend si la base a changé).
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_PREFIX = "garage-"
+BACKUP_CHECK_MS = 10 * 60 * 1000  # vérification de l'échéance de sauvegarde automatique
+BACKUP_DEFAULTS = {
+    "backup_dir": os.path.join(USER_DIR, "sauvegardes"),
+    "backup_keep": 10,             # nombre de sauvegardes conservées (0 = pas de limite)
+    "backup_max_days": 90,         # âge maximal en jours (0 = pas de limite)
+    "backup_interval_hours": 24,   # sauvegarde automatique (0 = désactivée)
+    "backup_on_exit": 1,           # à la fermeture, si des données ont changé
+}
+
+_last_backup_version = 0
+
+
+def backup_settings() -> dict:
+    """Réglages de sauvegarde (table parametres) complétés par BACKUP_DEFAULTS."""
+    out = {}
+    for key, default in BACKUP_DEFAULTS.items():
+        raw = get_setting(key)
+        if raw is None or raw == "":
+            out[key] = default
+        elif isinstance(default, int):
+            v = _safe_int(raw)
+            out[key] = default if v is None or v < 0 else v
+        else:
+            out[key] = raw
+    return out
+
+
+def list_backups(dest_dir: str) -> list[str]:
+    """Sauvegardes complètes du dossier, de la plus ancienne à la plus récente."""
+    if not os.path.isdir(dest_dir):
+        return []
+    names = sorted(n for n in os.listdir(dest_dir)
+                   if n.startswith(BACKUP_PREFIX) and not n.endswith(".partiel")
+                   and os.path.isdir(os.path.join(dest_dir, n)))
+    return [os.path.join(dest_dir, n) for n in names]
+
+
+def _backup_time(path: str) -> datetime | None:
+    stamp = os.path.basename(path)[len(BACKUP_PREFIX):len(BACKUP_PREFIX) + 15]
+    try:
+        return datetime.strptime(stamp, "%Y%m%d-%H%M%S")
+    except ValueError:
+        return None
+
+
+def rotate_backups(dest_dir: str, keep: int, max_days: int) -> list[str]:
+    """Supprime les sauvegardes en trop ou trop anciennes ; la plus récente est toujours gardée."""
+    backups = list_backups(dest_dir)
+    limit = datetime.now() - timedelta(days=max_days) if max_days > 0 else None
+    removed = []
+    for i, path in enumerate(backups[:-1]):
+        too_many = keep > 0 and len(backups) - i > keep
+        when = _backup_time(path)
+        too_old = limit is not None and when is not None and when < limit
+        if too_many or too_old:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+    return removed
+
+
+def _backup_db(src_path: str, dst_path: str, progress=None) -> None:
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _backup_photos(dest: str, previous: str | None) -> tuple[int, int]:
+    """Copie incrémentale des photos : un fichier inchangé (taille + mtime) depuis la sauvegarde
+    précédente y est lié en dur au lieu d'être recopié. Retourne (copiés, liés)."""
+    if not os.path.isdir(VEHICLE_PHOTOS_DIR):
+        return 0, 0
+    os.makedirs(dest, exist_ok=True)
+    copied = linked = 0
+    for entry in os.scandir(VEHICLE_PHOTOS_DIR):
+        if not entry.is_file():
+            continue
+        st = entry.stat()
+        target = os.path.join(dest, entry.name)
+        prev = os.path.join(previous, entry.name) if previous else None
+        if prev and os.path.isfile(prev):
+            pst = os.stat(prev)
+            if pst.st_size == st.st_size and int(pst.st_mtime) == int(st.st_mtime):
+                try:
+                    os.link(prev, target)
+                    linked += 1
+                    continue
+                except OSError:
+                    pass  # pas de liens durs sur ce système de fichiers : copie
+        shutil.copy2(entry.path, target)  # copy2 conserve le mtime, comparé à la prochaine sauvegarde
+        copied += 1
+    return copied, linked
+
+
+def backup_now(dest_dir: str | None = None, progress=None) -> dict:
+    """Sauvegarde à chaud de la base (et de l'archive) + photos, puis rotation.
+
+    Écrit dans garage-AAAAMMJJ-HHMMSS.partiel, renommé une fois complet : un dossier sans
+    suffixe est toujours une sauvegarde entière. Retourne {"path", "photos_copied",
+    "photos_linked", "removed"}.
+    """
+    global _last_backup_version
+    version = data_version()
+    settings = backup_settings()
+    dest_dir = dest_dir or settings["backup_dir"]
+    os.makedirs(dest_dir, exist_ok=True)
+    previous = (list_backups(dest_dir) or [None])[-1]
+
+    target = os.path.join(dest_dir, BACKUP_PREFIX + datetime.now().strftime("%Y%m%d-%H%M%S"))
+    base, n = target, 1
+    while os.path.exists(target):
+        target = f"{base}-{n}"
+        n += 1
+    work = target + ".partiel"
+    os.makedirs(work)
+    try:
+        _backup_db(DB_FILE, os.path.join(work, os.path.basename(DB_FILE)), progress)
+        if os.path.exists(ARCHIVE_DB_FILE):
+            _backup_db(ARCHIVE_DB_FILE, os.path.join(work, os.path.basename(ARCHIVE_DB_FILE)), progress)
+        copied, linked = _backup_photos(
+            os.path.join(work, os.path.basename(VEHICLE_PHOTOS_DIR)),
+            os.path.join(previous, os.path.basename(VEHICLE_PHOTOS_DIR)) if previous else None)
+        os.replace(work, target)
+    except Exception:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
 
-def estimate_maintenance_cost_next_months(vehicle_id: int, horizon_months: int = 6):
-    """Estimation des coûts à prévoir sur les prochains mois.
+    removed = rotate_backups(dest_dir, settings["backup_keep"], settings["backup_max_days"])
+    set_setting("backup_last", datetime.now().isoformat(timespec="seconds"))
+    _last_backup_version = version
+    return {"path": target, "photos_copied": copied, "photos_linked": linked, "removed": removed}
 
-    Pour chaque type cochée (enabled=1) :
-    - Si period_months > 0 :
-        on regarde la dernière date d'entretien de ce type.
-        On calcule dans combien de mois il est dû.
-        On compte les occurrences qui tombent dans la fenêtre [0, horizon_months].
-    - On utilise le coût le plus récent connu pour ce type.
+
+def backup_due(now: datetime | None = None) -> bool:
+    """Vrai si la sauvegarde automatique est activée et que l'intervalle est écoulé."""
+    hours = backup_settings()["backup_interval_hours"]
+    if hours <= 0:
+        return False
+    try:
+        last = datetime.fromisoformat(get_setting("backup_last", ""))
+    except ValueError:
+        return True
+    return (now or datetime.now()) - last >= timedelta(hours=hours)
+
+
+def backup_has_changes() -> bool:
+    """Des écritures ont eu lieu dans ce processus depuis la dernière sauvegarde."""
+    return data_version() != _last_backup_version
+
+
+_backup_worker: DbWorker | None = None
+
+
+def backup_worker() -> DbWorker:
+    """Thread dédié aux sauvegardes (distinct du thread d'écriture)."""
+    global _backup_worker
+    if _backup_worker is None:
+        _backup_worker = DbWorker(name="garage-backup")
+    return _backup_worker
+
+
+# ----------------- Export / import (archive unique) -----------------
+# Une archive tar compressée (xz ou gzip selon l'extension) : garage.db, garage_archive.db,
+# vehicle_photos/* puis manifest.json en dernier (empreintes SHA-256 calculées pendant l'écriture).
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_MANIFEST = "manifest.json"
+SNAPSHOT_PHOTOS = os.path.basename(VEHICLE_PHOTOS_DIR) + "/"
+SNAPSHOT_DB_NAMES = (os.path.basename(DB_FILE), os.path.basename(ARCHIVE_DB_FILE))
+_HASH_CHUNK = 1 << 20
+
+
+class _HashingReader:
+    """Fichier en lecture qui calcule le SHA-256 de ce qui le traverse (tarfile lit par blocs)."""
+
+    def __init__(self, fh):
+        self._fh = fh
+        self.sha = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._fh.read(size)
+        self.sha.update(data)
+        return data
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _snapshot_mode(path: str) -> str:
+    low = path.lower()
+    if low.endswith((".gz", ".tgz")):
+        return "w:gz"
+    if low.endswith(".tar"):
+        return "w"
+    return "w:xz"
+
+
+def export_snapshot(path: str) -> dict:
+    """Exporte base, archive et photos dans une seule archive compressée.
+
+    Les bases sont figées par l'API de sauvegarde dans un dossier temporaire ; tout est écrit
+    en flux (mémoire constante). Retourne {"path", "files", "bytes"}.
     """
-    total = 0.0
-    any_included = False
+    work = path + ".partiel"
+    with tempfile.TemporaryDirectory(prefix="garage-export-", dir=USER_DIR) as tmp:
+        members = []  # (nom dans l'archive, chemin local)
+        for src in (DB_FILE, ARCHIVE_DB_FILE):
+            if os.path.exists(src):
+                dst = os.path.join(tmp, os.path.basename(src))
+                _backup_db(src, dst)
+                members.append((os.path.basename(src), dst))
+        if os.path.isdir(VEHICLE_PHOTOS_DIR):
+            for entry in sorted(os.scandir(VEHICLE_PHOTOS_DIR), key=lambda e: e.name):
+                if entry.is_file():
+                    members.append((SNAPSHOT_PHOTOS + entry.name, entry.path))
+
+        files = {}
+        try:
+            with tarfile.open(work, _snapshot_mode(path)) as tar:
+                for arcname, local in members:
+                    info = tar.gettarinfo(local, arcname=arcname)
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ""
+                    with open(local, "rb") as fh:
+                        reader = _HashingReader(fh)
+                        tar.addfile(info, reader)
+                    files[arcname] = {"sha256": reader.sha.hexdigest(), "size": info.size}
+
+                manifest = {"format": SNAPSHOT_FORMAT, "app": APP_TITLE,
+                            "created": datetime.now().isoformat(timespec="seconds"), "files": files}
+                data = json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8")
+                info = tarfile.TarInfo(SNAPSHOT_MANIFEST)
+                info.size = len(data)
+                info.mtime = int(datetime.now().timestamp())
+                tar.addfile(info, io.BytesIO(data))
+            os.replace(work, path)
+        except BaseException:
+            if os.path.exists(work):
+                os.remove(work)
+            raise
+    return {"path": path, "files": len(files), "bytes": os.path.getsize(path)}
+
+
+def _snapshot_member_path(staging: str, info) -> str:
+    """Chemin de dépôt d'un membre ; refuse tout ce qu'un export ne contient pas (liens, '..', etc.)."""
+    name = info.name
+    if info.isfile():
+        if name in SNAPSHOT_DB_NAMES:
+            return os.path.join(staging, name)
+        if name.startswith(SNAPSHOT_PHOTOS):
+            base = name[len(SNAPSHOT_PHOTOS):]
+            if base and base == os.path.basename(base) and base not in (".", ".."):
+                os.makedirs(os.path.join(staging, SNAPSHOT_PHOTOS), exist_ok=True)
+                return os.path.join(staging, SNAPSHOT_PHOTOS, base)
+    raise ValueError(f"Archive invalide : membre inattendu « {name} ».")
+
+
+def _restore_db(staged: str, target: str) -> None:
+    """Recopie `staged` dans la base vivante `target` par l'API de sauvegarde SQLite.
+
+    Contrairement à un remplacement de fichier, les connexions encore ouvertes (API, surveillance,
+    autre instance) voient la base restaurée ; -wal et -shm restent cohérents, et rien n'échoue
+    sous Windows sur un fichier ouvert. La copie attend que les autres écritures soient finies.
+    """
+    src = sqlite3.connect(staged)
+    dst = sqlite3.connect(target, timeout=DB_BUSY_TIMEOUT_S)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
 
-    for t in list_vehicle_types(vehicle_id):
-        enabled = 1
+
+def import_snapshot(path: str) -> dict:
+    """Restaure une archive exportée par export_snapshot.
+
+    Tout est d'abord extrait (en flux) et vérifié contre le manifeste, taille et SHA-256, puis
+    l'intégrité SQLite est contrôlée ; rien n'est remplacé avant. La base actuelle est sauvegardée
+    (backup_now) juste avant l'installation ; les photos au contenu identique ne sont pas réécrites.
+    Retourne {"backup", "photos_written", "photos_unchanged"}.
+    """
+    staging = tempfile.mkdtemp(prefix="garage-import-", dir=USER_DIR)
+    try:
+        seen, manifest = {}, None
+        with tarfile.open(path, "r|*") as tar:
+            for info in tar:
+                if info.name == SNAPSHOT_MANIFEST and info.isfile():
+                    manifest = json.load(tar.extractfile(info))
+                    continue
+                local = _snapshot_member_path(staging, info)
+                h = hashlib.sha256()
+                src = tar.extractfile(info)
+                with open(local, "wb") as out:
+                    for chunk in iter(lambda: src.read(_HASH_CHUNK), b""):
+                        h.update(chunk)
+                        out.write(chunk)
+                seen[info.name] = {"sha256": h.hexdigest(), "size": info.size}
+
+        if not isinstance(manifest, dict) or manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError("Archive invalide : manifeste absent ou format inconnu.")
+        expected = manifest.get("files") or {}
+        bad = sorted(n for n in set(expected) | set(seen) if expected.get(n) != seen.get(n))
+        if bad:
+            raise ValueError("Archive corrompue ou incomplète : " + ", ".join(bad[:5]))
+        for name in SNAPSHOT_DB_NAMES:
+            staged = os.path.join(staging, name)
+            if not os.path.exists(staged):
+                if name == SNAPSHOT_DB_NAMES[0]:
+                    raise ValueError("Archive invalide : base absente.")
+                continue
+            conn = sqlite3.connect(staged)
+            try:
+                status = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            finally:
+                conn.close()
+            if status != "ok":
+                raise ValueError(f"{name} endommagée : {status}")
+
+        saved = backup_now()["path"] if os.path.exists(DB_FILE) else None
+
+        for target in (DB_FILE, ARCHIVE_DB_FILE):
+            staged = os.path.join(staging, os.path.basename(target))
+            if os.path.exists(staged):
+                call_with_busy_retry(_restore_db, staged, target)
+            elif os.path.exists(target):
+                # archive absente de l'export : elle ne correspond plus à la base, on la vide
+                call_with_busy_retry(_restore_db, ":memory:", target)
+
+        written = unchanged = 0
+        _ensure_vehicle_photos_dir()
+        for name, meta in seen.items():
+            if not name.startswith(SNAPSHOT_PHOTOS):
+                continue
+            base = name[len(SNAPSHOT_PHOTOS):]
+            dst = os.path.join(VEHICLE_PHOTOS_DIR, base)
+            if os.path.isfile(dst) and os.path.getsize(dst) == meta["size"] and _sha256_file(dst) == meta["sha256"]:
+                unchanged += 1
+                continue
+            os.replace(os.path.join(staging, SNAPSHOT_PHOTOS, base), dst)
+            written += 1
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    _ensure_schema()  # archive d'une version antérieure : migrations
+    _db_caches_reset()
+    _data_changed()
+    return {"backup": saved, "photos_written": written, "photos_unchanged": unchanged}
+
+
+# ----------------- Journal des modifications (synchronisation entre postes) -----------------
+# Chaque écriture sur les tables ci-dessous ajoute une ligne au journal (triggers), numérotée par seq.
+# Deux postes partis de la même base (export / import d'archive) échangent ensuite des deltas :
+# les modifications faites depuis le dernier export, quelques Ko au lieu du fichier entier.
+JOURNAL_FORMAT = 1
+MACHINE_ID_FILE = os.path.join(USER_DIR, "poste.id")  # hors base : une base copiée ne copie pas l'identité
+# Marque de ce processus dans journal.processus : distingue ses écritures de celles d'une autre instance
+_PROCESS_TAG = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# table -> (clé primaire, colonnes qui référencent une autre table synchronisée)
+_JOURNAL_TABLES = {
+    "vehicules": (("id",), {}),
+    "entretien_types": (("id",), {"owner_vehicle_id": "vehicules"}),
+    "vehicule_entretien_types": (("vehicule_id", "type_id"),
+                                 {"vehicule_id": "vehicules", "type_id": "entretien_types"}),
+    "pleins": (("id",), {"vehicule_id": "vehicules"}),
+    "entretiens": (("id",), {"vehicule_id": "vehicules", "type_id": "entretien_types"}),
+    "preconisations": (("id",), {"vehicule_id": "vehicules"}),
+}
+# Colonnes recalculées localement (jour par trigger, is_repair selon les mots-clés du poste)
+_JOURNAL_DERIVED = {"jour", "is_repair"}
+
+_machine_id: str | None = None
+
+
+def machine_id() -> str:
+    """Identifiant de ce poste (créé au premier appel)."""
+    global _machine_id
+    if _machine_id is None:
         try:
-            enabled = int(t["enabled"]) if t["enabled"] is not None else 1
-        except Exception:
-            enabled = 1
-        if enabled != 1:
-            continue
+            with open(MACHINE_ID_FILE, encoding="utf-8") as fh:
+                _machine_id = fh.read().strip() or None
+        except OSError:
+            pass
+        if _machine_id is None:
+            _machine_id = uuid.uuid4().hex
+            with open(MACHINE_ID_FILE, "w", encoding="utf-8") as fh:
+                fh.write(_machine_id + "\n")
+    return _machine_id
+
+
+def _journal_triggers(cur: sqlite3.Cursor, table: str) -> list[str]:
+    """Triggers d'une table synchronisée (recréés à chaque démarrage : suivent les migrations)."""
+    pk = _JOURNAL_TABLES[table][0]
+    cols = sorted(_columns(cur, table) - _JOURNAL_DERIVED)
+
+    def obj(row: str, names) -> str:
+        return "json_object(" + ", ".join(f"'{c}', {row}.{c}" for c in names) + ")"
+
+    def log(op: str, row: str, data: str) -> str:
+        return f"""INSERT INTO journal(tbl, op, cle, donnees, processus)
+                   VALUES ('{table}', '{op}', {obj(row, pk)}, {data}, processus());"""
+
+    return [
+        f"""CREATE TRIGGER trg_journal_{table}_ai AFTER INSERT ON {table}
+            BEGIN {log('I', 'NEW', obj('NEW', cols))} END""",
+        f"""CREATE TRIGGER trg_journal_{table}_au AFTER UPDATE OF {', '.join(cols)} ON {table}
+            BEGIN {log('U', 'NEW', obj('NEW', cols))} END""",
+        f"""CREATE TRIGGER trg_journal_{table}_ad AFTER DELETE ON {table}
+            BEGIN {log('D', 'OLD', 'NULL')} END""",
+    ]
+
+
+def _ensure_journal(cur: sqlite3.Cursor) -> None:
+    """Tables du journal et de suivi des postes, triggers (idempotent)."""
+    cur.execute("""CREATE TABLE IF NOT EXISTS journal(
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,  -- jamais réutilisé : numéro monotone
+            tbl TEXT NOT NULL,
+            op TEXT NOT NULL,                       -- I / U / D
+            cle TEXT NOT NULL,                      -- clé primaire (JSON)
+            donnees TEXT,                           -- ligne complète (JSON), NULL pour D
+            origine TEXT,                           -- poste d'origine ; NULL = ce poste
+            quand TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now'))
+        )""")
+    if "processus" not in _columns(cur, "journal"):
+        cur.execute("ALTER TABLE journal ADD COLUMN processus TEXT")  # processus auteur (_PROCESS_TAG)
+    # Dernier numéro de journal reçu de chaque poste (deltas idempotents)
+    cur.execute("""CREATE TABLE IF NOT EXISTS sync_postes(
+            poste TEXT PRIMARY KEY,
+            recu INTEGER NOT NULL DEFAULT 0
+        )""")
+    # Lignes créées des deux côtés avec le même id : numéro chez l'autre poste -> numéro local
+    cur.execute("""CREATE TABLE IF NOT EXISTS sync_ids(
+            poste TEXT NOT NULL,
+            tbl TEXT NOT NULL,
+            id_distant INTEGER NOT NULL,
+            id_local INTEGER NOT NULL,
+            PRIMARY KEY(poste, tbl, id_distant)
+        ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sync_ids_local ON sync_ids(tbl, id_local)")
+    for table in _JOURNAL_TABLES:
+        for op in ("ai", "au", "ad"):
+            cur.execute(f"DROP TRIGGER IF EXISTS trg_journal_{table}_{op}")
+        for sql in _journal_triggers(cur, table):
+            cur.execute(sql)
+
+    # Base créée sur un autre poste (copie, import d'archive) : son historique devient le point de départ
+    me = machine_id()
+    r = cur.execute("SELECT valeur FROM parametres WHERE cle = 'poste'").fetchone()
+    if r is not None and r["valeur"] != me:
+        top = cur.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0]
+        cur.execute("UPDATE journal SET origine = ? WHERE origine IS NULL", (r["valeur"],))
+        cur.execute("""INSERT INTO sync_postes(poste, recu) VALUES (?, ?)
+                       ON CONFLICT(poste) DO UPDATE SET recu = MAX(recu, excluded.recu)""", (r["valeur"], top))
+        cur.execute("INSERT OR REPLACE INTO parametres(cle, valeur) VALUES ('journal_exporte', ?)", (str(top),))
+    if r is None or r["valeur"] != me:
+        cur.execute("INSERT OR REPLACE INTO parametres(cle, valeur) VALUES ('poste', ?)", (me,))
+
+
+def journal_seq() -> int:
+    """Numéro de la dernière modification journalisée (version des données, tous processus confondus)."""
+    conn = _connect_db()
+    r = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()
+    conn.close()
+    return int(r[0])
 
-        pm = t["period_months"]
+
+def _delta_open(path: str, mode: str, compressed: bool | None = None):
+    if path.lower().endswith(".gz") if compressed is None else compressed:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _remap_ids(tbl: str, key: dict, data: dict | None, lookup) -> None:
+    """Traduit en place les ids d'une modification (clé et références) via lookup(table, id)."""
+    pk, refs = _JOURNAL_TABLES[tbl]
+    if pk == ("id",) and key.get("id") is not None:
+        key["id"] = lookup(tbl, key["id"])
+        if data is not None:
+            data["id"] = key["id"]
+    for col, target in refs.items():
+        for d in (key, data):
+            if d is not None and d.get(col) is not None:
+                d[col] = lookup(target, d[col])
+
+
+def export_changes(path: str, since: int | None = None) -> dict:
+    """Écrit les modifications journalisées après since (défaut : depuis le dernier export).
+
+    Fichier JSON Lines (gzip si path finit par .gz) : un en-tête puis une modification par ligne,
+    écrit en flux. Les ids créés en double et renumérotés ici repartent dans la numérotation de
+    l'autre poste. Retourne {"path", "changes", "since", "until"}.
+    """
+    me = machine_id()
+    if since is None:
+        since = _safe_int(get_setting("journal_exporte")) or 0
+    conn = _connect_db()
+    cur = conn.cursor()
+    cur.execute("BEGIN")  # en-tête et lignes lus sur le même état de la base
+    until = int(cur.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0])
+    back = {(r["tbl"], r["id_local"]): r["id_distant"] for r in cur.execute("SELECT * FROM sync_ids")}
+    lookup = lambda tbl, v: back.get((tbl, v), v)  # noqa: E731
+
+    work = path + ".partiel"
+    n = 0
+    try:
+        with _delta_open(work, "w", compressed=path.lower().endswith(".gz")) as out:
+            out.write(json.dumps({"format": JOURNAL_FORMAT, "poste": me, "depuis": since, "jusqu_a": until}) + "\n")
+            cur.execute("""SELECT seq, tbl, op, cle, donnees, COALESCE(origine, ?) AS origine
+                           FROM journal WHERE seq > ? AND seq <= ? ORDER BY seq""", (me, since, until))
+            for r in cur:
+                key = json.loads(r["cle"])
+                data = json.loads(r["donnees"]) if r["donnees"] else None
+                if back:
+                    _remap_ids(r["tbl"], key, data, lookup)
+                out.write(json.dumps([r["seq"], r["tbl"], r["op"], key, data, r["origine"]],
+                                     ensure_ascii=False) + "\n")
+                n += 1
+        os.replace(work, path)
+    except BaseException:
+        if os.path.exists(work):
+            os.remove(work)
+        raise
+    finally:
+        conn.close()
+    set_setting("journal_exporte", until)
+    return {"path": path, "changes": n, "since": since, "until": until}
+
+
+def _apply_change(cur: sqlite3.Cursor, sender: str, ids: dict, cols: dict,
+                  tbl: str, op: str, key: dict, data: dict | None) -> bool:
+    """Applique une modification reçue. Retourne True si la ligne a dû être renumérotée."""
+    pk = _JOURNAL_TABLES[tbl][0]
+    remote_id = key.get("id")
+    _remap_ids(tbl, key, data, lambda t, v: ids.get((t, v), v))
+
+    where = " AND ".join(f"{c} = ?" for c in pk)
+    args = [key[c] for c in pk]
+    home = tbl
+    if (tbl in _ARCHIVED_TABLES and _archive_attached(cur.connection)
+            and cur.execute(f"SELECT 1 FROM archive.{tbl} WHERE {where}", args).fetchone()):
+        home = f"archive.{tbl}"  # ligne archivée ici, encore vivante chez l'autre poste
+
+    indexed = home == "archive.entretiens" and _table_exists(cur, "recherche")  # pas de trigger FTS dans l'archive
+    if op == "D":
+        if indexed:
+            _search_unindex_archived(cur, where, args)
+        cur.execute(f"DELETE FROM {home} WHERE {where}", args)
+        return False
+
+    row = {c: v for c, v in (data or {}).items() if c in cols[tbl]}
+    row.update(key)
+    if op == "U":
+        sets = [c for c in row if c not in pk]
+        if sets:
+            if indexed:
+                _search_unindex_archived(cur, where, args)
+            cur.execute(f"UPDATE {home} SET {', '.join(f'{c} = ?' for c in sets)} WHERE {where}",
+                        [row[c] for c in sets] + args)
+            if indexed:
+                _search_index_archived(cur, where, args)
+        return False
+
+    if pk == ("id",) and (tbl, remote_id) not in ids and cur.execute(
+            f"SELECT 1 FROM {home} WHERE {where}", args).fetchone():
+        # Même id créé des deux côtés depuis la dernière synchro : nouvelle ligne ici
+        del row["id"]
+        cur.execute(f"INSERT INTO {tbl}({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                    list(row.values()))
+        ids[(tbl, remote_id)] = cur.lastrowid
+        cur.execute("INSERT INTO sync_ids(poste, tbl, id_distant, id_local) VALUES (?, ?, ?, ?)",
+                    (sender, tbl, remote_id, cur.lastrowid))
+        return True
+    updates = ", ".join(f"{c} = excluded.{c}" for c in row if c not in pk)
+    conflict = f"ON CONFLICT({', '.join(pk)}) DO UPDATE SET {updates}" if updates else "ON CONFLICT DO NOTHING"
+    cur.execute(f"INSERT INTO {tbl}({', '.join(row)}) VALUES ({', '.join('?' * len(row))}) {conflict}",
+                list(row.values()))
+    return False
+
+
+def apply_changes(path: str) -> dict:
+    """Applique un delta exporté par un autre poste, en une transaction.
+
+    Les modifications déjà reçues de ce poste et celles qui viennent d'ici sont ignorées : réappliquer
+    un delta ne change rien. Une modification refusée par une contrainte (véhicule supprimé ici
+    entre-temps…) est comptée dans "rejected" sans bloquer le reste.
+    Retourne {"poste", "applied", "skipped", "rejected", "remapped"}.
+    """
+    global _lieu_index
+    me = machine_id()
+    stats = {"applied": 0, "skipped": 0, "rejected": 0, "remapped": 0}
+    with _delta_open(path, "r") as fh:
+        header = json.loads(fh.readline() or "null")
+        if not isinstance(header, dict) or header.get("format") != JOURNAL_FORMAT:
+            raise ValueError("Fichier de modifications invalide ou de format inconnu.")
+        sender = str(header["poste"])
+        if sender == me:
+            raise ValueError("Ce fichier a été exporté par ce poste.")
+
+        conn = _connect_db(full_history=True)
+        cur = conn.cursor()
         try:
-            pm = int(pm) if pm is not None else 0
+            cur.execute("BEGIN IMMEDIATE")
+            r = cur.execute("SELECT recu FROM sync_postes WHERE poste = ?", (sender,)).fetchone()
+            recu = int(r["recu"]) if r else 0
+            if recu and int(header.get("depuis") or 0) > recu:  # un delta de ce poste a été sauté
+                raise ValueError(f"Modifications manquantes : ce fichier commence après le n°{header['depuis']}, "
+                                 f"dernier reçu de ce poste : n°{recu}.")
+            start = int(cur.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0])
+            ids = {(x["tbl"], x["id_distant"]): x["id_local"]
+                   for x in cur.execute("SELECT * FROM sync_ids WHERE poste = ?", (sender,))}
+            cols = {t: _columns(cur, t) - _JOURNAL_DERIVED for t in _JOURNAL_TABLES}
+            touched = set()
+            for line in fh:
+                if not line.strip():
+                    continue
+                seq, tbl, op, key, data, origine = json.loads(line)
+                if seq <= recu or origine == me or tbl not in _JOURNAL_TABLES or op not in ("I", "U", "D"):
+                    stats["skipped"] += 1
+                    continue
+                try:
+                    if _apply_change(cur, sender, ids, cols, tbl, op, key, data):
+                        stats["remapped"] += 1
+                    stats["applied"] += 1
+                    touched.add(tbl)
+                except sqlite3.IntegrityError:
+                    stats["rejected"] += 1
+
+            if "entretiens" in touched:
+                _reclassify_entretiens(cur)
+            if "pleins" in touched:
+                cur.execute("DELETE FROM stats_pleins")  # rejoué à la demande (_plein_stats)
+            # Lignes de journal produites par l'application : elles viennent de l'autre poste
+            cur.execute("UPDATE journal SET origine = ? WHERE seq > ? AND origine IS NULL", (sender, start))
+            cur.execute("""INSERT INTO sync_postes(poste, recu) VALUES (?, ?)
+                           ON CONFLICT(poste) DO UPDATE SET recu = MAX(recu, excluded.recu)""",
+                        (sender, int(header.get("jusqu_a") or 0)))
+            conn.commit()
         except Exception:
-            pm = 0
-        if pm <= 0:
-            continue
-
-        last_date_iso, _last_km = get_last_entretien_for_type(vehicle_id, int(t["type_id"]))
-        if not last_date_iso:
-            due_in_months = 0
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    _reminder_index_reset()
+    if "pleins" in touched:
+        _lieu_index = None  # lieux ajoutés / retirés par le delta : index relu au prochain usage
+    _data_changed()
+    return dict(stats, poste=sender)
+
+
+# ----------------- API HTTP locale (lecture seule) -----------------
+# garage --serve : véhicules, pleins, entretiens, échéances et prévisions en JSON pour les autres
+# outils de l'atelier. Un nombre fixe de workers, chacun avec sa connexion SQLite ; ETag dérivé
+# du journal (les écritures d'un autre processus, l'interface par exemple, changent la version).
+API_DEFAULT_HOST = "127.0.0.1"
+API_DEFAULT_PORT = 8765
+API_WORKERS = 4
+API_PAGE_SIZE = 500
+API_MAX_PAGE = 5000
+_API_CHUNK = 64 * 1024
+
+# Historiques paginés : colonnes exposées (lues sur *_all : archive comprise)
+_API_HISTORY_SQL = {
+    "pleins": """SELECT id, date_iso AS date, km, litres, prix_litre, total, lieu, COALESCE(jour, 0) AS _jour
+                 FROM pleins_all WHERE vehicule_id = :vid
+                   AND (COALESCE(jour, 0), id) < (:jour, :id)
+                 ORDER BY COALESCE(jour, 0) DESC, id DESC LIMIT :n""",
+    "entretiens": """SELECT e.id, e.date_iso AS date, e.km, e.kind, e.type_id,
+                            COALESCE(t.nom, e.intervention) AS type, e.intervention, e.details, e.cout,
+                            e.performed_by, e.battery_voltage, e.is_repair, COALESCE(e.jour, 0) AS _jour
+                     FROM entretiens_all e LEFT JOIN entretien_types t ON t.id = e.type_id
+                     WHERE e.vehicule_id = :vid AND (COALESCE(e.jour, 0), e.id) < (:jour, :id)
+                     ORDER BY COALESCE(e.jour, 0) DESC, e.id DESC LIMIT :n""",
+}
+
+
+def _json_default(o):
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    if isinstance(o, _Record):
+        return {f: getattr(o, f) for f in o._fields}
+    raise TypeError(f"{type(o).__name__} non sérialisable")
+
+
+def _json_bytes(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+
+class ApiServer(http.server.HTTPServer):
+    """Serveur HTTP à nombre fixe de workers ; chaque worker garde sa connexion SQLite, passée aux
+    lectures de chaque requête. Instantanés, TCO et échéances sont des caches du processus, chargés
+    une fois par version des données (connexion propre) puis servis sans requête."""
+
+    def __init__(self, address, workers: int = API_WORKERS):
+        super().__init__(address, _ApiHandler)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="garage-api")
+        self._local = threading.local()
+        self._version_lock = threading.Lock()
+        self._seen_seq = None
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect_db(full_history=True)
+            self._local.seq = None
+        return conn
+
+    def version_tag(self) -> str:
+        """ETag courant : dernier n° du journal, mots-clés de classement et jour (échéances relatives)."""
+        conn = self.connection()
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0]
+        words = conn.execute("SELECT group_concat(mot, '|') FROM mots_cles_reparation").fetchone()[0] or ""
+        if self._local.seq != seq:
+            _attach_archive(conn)  # archive créée entre-temps par un autre processus
+            self._local.seq = seq
+        with self._version_lock:
+            if self._seen_seq != seq:
+                if self._seen_seq is not None:
+                    # Écriture d'un autre processus : caches de ce processus périmés
+                    _reminder_index_reset()
+                    _data_changed()
+                self._seen_seq = seq
+        digest = hashlib.sha1(words.encode("utf-8")).hexdigest()[:8]
+        return f'W/"{seq}-{digest}-{date.today():%Y%m%d}"'
+
+
+class _ApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "Garage"
+    timeout = 30  # connexion inactive (keep-alive) : libère le worker
+
+    _ROUTES = [
+        (re.compile(r"/api/?"), "_get_index"),
+        (re.compile(r"/api/vehicules/?"), "_get_vehicules"),
+        (re.compile(r"/api/vehicules/(\d+)/?"), "_get_vehicule"),
+        (re.compile(r"/api/vehicules/(\d+)/(pleins|entretiens)/?"), "_get_history"),
+        (re.compile(r"/api/echeances/?"), "_get_echeances"),
+        (re.compile(r"/api/previsions/?"), "_get_previsions"),
+    ]
+
+    def log_message(self, fmt, *args):
+        if getattr(self.server, "verbose", False):
+            super().log_message(fmt, *args)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        for rx, name in self._ROUTES:
+            m = rx.fullmatch(url.path)
+            if m:
+                break
         else:
-            last_d = _parse_iso_date(last_date_iso)
-            if not last_d:
-                due_in_months = 0
-            else:
-                months_since = _month_diff(last_d, date.today())
-                due_in_months = pm - months_since
+            self._send_error(404, "Ressource inconnue.")
+            return
 
-        if due_in_months > horizon_months:
-            expected = 0
-        else:
-            first = max(0, due_in_months)
-            expected = 1 + max(0, (horizon_months - first) // pm)
+        tag = self.server.version_tag()
+        wanted = {t.strip() for t in self.headers.get("If-None-Match", "").split(",")}
+        if tag in wanted or "*" in wanted:
+            self.send_response(304)
+            self.send_header("ETag", tag)
+            self.end_headers()
+            return
+        try:
+            getattr(self, name)(tag, query, *m.groups())
+        except ValueError as e:
+            self._send_error(400, str(e))
+        except LookupError as e:
+            self._send_error(404, str(e))
+
+    # ---------- Réponses ----------
+    def _send_json(self, tag: str, payload, status: int = 200):
+        body = _json_bytes(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if tag:
+            self.send_header("ETag", tag)
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str):
+        self._send_json("", {"erreur": message}, status)
+
+    def _write_chunk(self, data: bytes):
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    # ---------- Ressources ----------
+    def _get_index(self, tag, query):
+        self._send_json(tag, {
+            "application": APP_TITLE,
+            "version_donnees": tag,
+            "ressources": ["/api/vehicules", "/api/vehicules/{id}", "/api/vehicules/{id}/pleins",
+                           "/api/vehicules/{id}/entretiens", "/api/echeances", "/api/previsions"],
+        })
+
+    def _get_vehicules(self, tag, query):
+        self._send_json(tag, list_vehicles(self.server.connection()))
+
+    def _get_vehicule(self, tag, query, vid):
+        v = get_vehicle(int(vid), self.server.connection())
+        if v is None:
+            raise LookupError(f"Véhicule #{vid} introuvable.")
+        out = _json_default(v)
+        out["dernier_km"] = last_km_any(v.id)
+        out["conso_moy_l100"] = conso_moy_l100(v.id)
+        out["depenses_12_mois"] = spent_last_months(v.id, 12)
+        tco = vehicle_tco(v.id) or {}
+        out["cout_possession"] = {k: tco.get(k) for k in ("carburant", "entretien", "total", "km", "cout_km", "cout_mois")}
+        self._send_json(tag, out)
+
+    def _get_history(self, tag, query, vid, kind):
+        """Historique paginé (curseur ?apres=), envoyé en flux par blocs (chunked)."""
+        limit = _safe_int(query.get("limit", API_PAGE_SIZE))
+        if limit is None or not 1 <= limit <= API_MAX_PAGE:
+            raise ValueError(f"limit : entier de 1 à {API_MAX_PAGE}.")
+        jour, rid = math.inf, math.inf
+        if query.get("apres"):
+            try:
+                jour, rid = (int(x) for x in query["apres"].split(".", 1))
+            except ValueError:
+                raise ValueError("apres : curseur invalide (valeur « suivant » d'une page précédente).") from None
+        conn = self.server.connection()
+        if conn.execute("SELECT 1 FROM vehicules WHERE id = ?", (int(vid),)).fetchone() is None:
+            raise LookupError(f"Véhicule #{vid} introuvable.")
 
-        if expected <= 0:
+        cur = conn.cursor()
+        cur.row_factory = None
+        cur.execute(_API_HISTORY_SQL[kind], {"vid": int(vid), "jour": jour, "id": rid, "n": limit + 1})
+        names = [d[0] for d in cur.description][:-1]  # _jour : curseur uniquement
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("ETag", tag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        buf = bytearray(b'{"items": [')
+        n, last, following = 0, None, None
+        for row in cur:
+            if n == limit:
+                following = f"{last[-1]}.{last[0]}"
+                break
+            if n:
+                buf += b", "
+            buf += _json_bytes(dict(zip(names, row)))
+            n, last = n + 1, row
+            if len(buf) >= _API_CHUNK:
+                self._write_chunk(bytes(buf))
+                buf.clear()
+        buf += b'], "suivant": ' + _json_bytes(following) + b"}"
+        self._write_chunk(bytes(buf))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _get_echeances(self, tag, query):
+        n = _safe_int(query.get("n", 20))
+        if n is None or n < 1:
+            raise ValueError("n : entier positif.")
+        idx = reminder_index()
+        vid = _safe_int(query.get("vehicule"))
+        if vid is None:
+            items = idx.next_due(n)
+        else:
+            items = [it for it in idx.next_due(len(idx)) if it["vehicle_id"] == vid][:n]
+        self._send_json(tag, items)
+
+    def _get_previsions(self, tag, query):
+        mois = _safe_int(query.get("mois", 6))
+        if mois is None or not 1 <= mois <= 60:
+            raise ValueError("mois : entier de 1 à 60.")
+        conn = self.server.connection()
+        self._send_json(tag, [{
+            "id": v.id,
+            "nom": v.nom,
+            "mois": mois,
+            "entretien_prevu": estimate_maintenance_cost_next_months(v.id, mois, conn),
+            "depenses_passees": spent_last_months(v.id, mois),
+        } for v in list_vehicles(conn)])
+
+
+def serve_api(host: str = API_DEFAULT_HOST, port: int = API_DEFAULT_PORT,
+              workers: int = API_WORKERS, verbose: bool = False) -> None:
+    """Lance l'API HTTP jusqu'à Ctrl+C."""
+    server = ApiServer((host, port), workers=workers)
+    server.verbose = verbose
+    print(f"API Garage : http://{host}:{server.server_port}/api (Ctrl+C pour arrêter)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# ----------------- Surveillance de la boucle Tk (blocages) -----------------
+# Un battement after() toutes les STALL_HEARTBEAT_MS mesure le retard de la boucle d'événements.
+# Quand il dépasse le seuil, un thread de surveillance échantillonne la pile du thread Tk : on sait
+# quel callback tournait (_refresh_all, _veh_save, _refresh_graph…). Blocages et histogramme des
+# retards sont ajoutés à blocages.log, à joindre aux rapports de bug.
+STALL_ENV = "GARAGE_STALL_MS"
+STALL_THRESHOLD_MS = 250  # défaut ; 0 désactive la surveillance
+STALL_HEARTBEAT_MS = 100
+STALL_SAMPLE_MAX = 8  # échantillons de pile gardés par blocage
+STALL_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2000, 5000)
+STALL_KEEP = 50  # blocages gardés en mémoire (les plus récents)
+STALL_LOG_FILE = os.path.join(USER_DIR, "blocages.log")
+STALL_LOG_MAX_BYTES = 512 * 1024  # au-delà, l'ancien journal devient blocages.log.1
+
+
+def stall_threshold_ms() -> int:
+    try:
+        return max(0, int(os.environ.get(STALL_ENV, STALL_THRESHOLD_MS)))
+    except ValueError:
+        return STALL_THRESHOLD_MS
+
+
+def _stall_callback(stack) -> str:
+    """Callback Tk en cours dans une pile échantillonnée : première fonction de ce module sous le
+    dernier appel Tcl -> Python (tkinter CallWrapper.__call__)."""
+    start = 0
+    for i, fs in enumerate(stack):
+        if fs.name == "__call__" and os.path.basename(os.path.dirname(fs.filename)) == "tkinter":
+            start = i + 1
+    for fs in stack[start:]:
+        if fs.filename == __file__:
+            return fs.name
+    return stack[start].name if start < len(stack) else "?"
+
+
+class StallWatchdog:
+    """Mesure le retard de la boucle Tk et consigne les blocages au-delà de `threshold_ms`."""
+
+    def __init__(self, root, threshold_ms: int = STALL_THRESHOLD_MS, heartbeat_ms: int = STALL_HEARTBEAT_MS,
+                 log_file: str = STALL_LOG_FILE):
+        self.root = root
+        self.threshold = threshold_ms / 1000
+        self.heartbeat_ms = heartbeat_ms
+        self.log_file = log_file
+        self.histogram = [0] * (len(STALL_BUCKETS_MS) + 1)  # dernier seau : >= STALL_BUCKETS_MS[-1]
+        self.max_lag = 0.0
+        self.stalls = collections.deque(maxlen=STALL_KEEP)
+        self._lock = threading.Lock()
+        self._samples: list = []  # (retard, pile) du blocage en cours
+        self._tk_ident = threading.get_ident()
+        self._expected = time.perf_counter()
+        self._after_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "StallWatchdog":
+        self._expected = time.perf_counter() + self.heartbeat_ms / 1000
+        self._after_id = self.root.after(self.heartbeat_ms, self._beat)
+        self._thread = threading.Thread(target=self._monitor, name="garage-stall-watchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        try:
+            self.root.after_cancel(self._after_id)
+        except (tk.TclError, ValueError):
+            pass  # fenêtre déjà détruite
+        if self.stalls:
+            self._write_summary()
+
+    def _beat(self) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            lag = max(0.0, now - self._expected)
+            samples, self._samples = self._samples, []
+            self.histogram[bisect.bisect_right(STALL_BUCKETS_MS, lag * 1000)] += 1
+            self.max_lag = max(self.max_lag, lag)
+            self._expected = now + self.heartbeat_ms / 1000
+        if lag >= self.threshold:
+            self._record(lag, samples)
+        self._after_id = self.root.after(self.heartbeat_ms, self._beat)
+
+    def _monitor(self) -> None:
+        """Thread : échantillonne la pile Tk pendant un blocage (au passage du seuil, puis à chaque
+        nouveau seuil écoulé)."""
+        while not self._stop.wait(self.heartbeat_ms / 2000):
+            with self._lock:
+                late = time.perf_counter() - self._expected
+                if late < self.threshold or len(self._samples) >= STALL_SAMPLE_MAX:
+                    continue
+                if self._samples and late - self._samples[-1][0] < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self._tk_ident)
+                if frame is not None:
+                    self._samples.append((late, traceback.extract_stack(frame)))
+                del frame
+
+    def _record(self, lag: float, samples: list) -> None:
+        stack = samples[-1][1] if samples else []
+        callback = _stall_callback(samples[0][1]) if samples else "?"
+        # Fonction la plus souvent en haut de pile (côté module) : où le temps passe vraiment
+        hot = collections.Counter(
+            next((f"{fs.name}:{fs.lineno}" for fs in reversed(st) if fs.filename == __file__), "?")
+            for _late, st in samples
+        )
+        stall = {
+            "quand": datetime.now().isoformat(sep=" ", timespec="seconds"),
+            "ms": int(lag * 1000),
+            "callback": callback,
+            "chaud": hot.most_common(1)[0][0] if hot else "?",
+            "echantillons": len(samples),
+            "pile": traceback.format_list(stack[-12:]),
+        }
+        self.stalls.append(stall)
+        lines = [f"{stall['quand']}  blocage de {stall['ms']} ms dans {callback} "
+                 f"(le plus souvent {stall['chaud']}, {len(samples)} échantillon(s))"]
+        if not samples:
+            lines.append("  (pile non échantillonnée : code natif sans relâche du GIL ou mise en veille)")
+        lines += [ln.rstrip("\n") for ln in stall["pile"]]
+        self._append_log(lines)
+
+    def histogram_rows(self) -> list[tuple[str, int]]:
+        with self._lock:
+            counts = list(self.histogram)
+        bounds = (0,) + STALL_BUCKETS_MS
+        rows = [(f"{lo}–{hi} ms", n) for lo, hi, n in zip(bounds, STALL_BUCKETS_MS, counts)]
+        rows.append((f">= {STALL_BUCKETS_MS[-1]} ms", counts[-1]))
+        return rows
+
+    def _write_summary(self) -> None:
+        total = sum(self.histogram)
+        lines = [f"{datetime.now().isoformat(sep=' ', timespec='seconds')}  fin de session : {total} battement(s), "
+                 f"{len(self.stalls)} blocage(s) >= {int(self.threshold * 1000)} ms, "
+                 f"retard max {int(self.max_lag * 1000)} ms"]
+        lines += [f"  {label:>14} : {n}" for label, n in self.histogram_rows()]
+        self._append_log(lines + [""])
+
+    def _append_log(self, lines: list[str]) -> None:
+        try:
+            if os.path.exists(self.log_file) and os.path.getsize(self.log_file) > STALL_LOG_MAX_BYTES:
+                os.replace(self.log_file, self.log_file + ".1")
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError:
+            pass  # le diagnostic ne doit jamais gêner l'application
+
+
+# ----------------- Aide : AIDE.md analysé (cache) -----------------
+# Analysée à la première ouverture de l'aide seulement, puis gardée tant que le fichier ne change
+# pas (chemin, mtime, taille). Le document est une liste de segments (texte, tags) insérée dans
+# le widget Text en un seul appel.
+_HELP_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_HELP_LIST = re.compile(r"^(\s*)(?:[-*+]|(\d+)[.)])\s+(.*)$")
+_HELP_RULE = re.compile(r"^\s*(?:-{3,}|\*{3,}|_{3,})\s*$")
+_HELP_INLINE = re.compile(r"\*\*(.+?)\*\*|__(.+?)__|(?<![*\w])\*(?!\s)(.+?)(?<!\s)\*(?![*\w])")
+HELP_RULE_TEXT = "─" * 24
+
+_help_cache: tuple[tuple, list[tuple[str, tuple[str, ...]]]] | None = None
+
+
+def _help_source() -> str | None:
+    """AIDE.md livré avec l'application (à jour à chaque version), sinon la copie du dossier utilisateur."""
+    candidates = [
+        resource_path("assets/AIDE.md"),
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), "AIDE.md"),
+        str(HELP_FILE),
+    ]
+    return next((p for p in candidates if os.path.isfile(p)), None)
+
+
+def _strip_html_header(text: str) -> str:
+    """Retire le bloc <p …><img …></p> de tête (bannière GitHub) s'il y en a un."""
+    m = re.match(r"\s*<p\b[^>]*>.*?</p>\s*", text, re.IGNORECASE | re.DOTALL)
+    if m and "<img" in m.group(0).lower():
+        return text[m.end():]
+    return text
+
+
+def _help_inline(text: str, tags: tuple[str, ...]) -> list[tuple[str, tuple[str, ...]]]:
+    """Découpe **gras** / __gras__ / *italique* d'une ligne en segments."""
+    out, pos = [], 0
+    for m in _HELP_INLINE.finditer(text):
+        if m.start() > pos:
+            out.append((text[pos:m.start()], tags))
+        bold = m.group(1) or m.group(2)
+        out.append((bold, tags + ("bold",)) if bold else (m.group(3), tags + ("italic",)))
+        pos = m.end()
+    if pos < len(text):
+        out.append((text[pos:], tags))
+    return out
+
+
+def parse_help_markdown(text: str) -> list[tuple[str, tuple[str, ...]]]:
+    """Markdown simple -> segments (texte, tags) : titres #, listes - / 1., citations >, règles ---,
+    gras et italique. Les lignes sans lettre ni chiffre (emojis) gardent leur tag "emoji"."""
+    segments: list[tuple[str, tuple[str, ...]]] = []
+    for line in _strip_html_header(text).splitlines():
+        stripped = line.strip()
+        if not stripped:
+            segments.append(("\n", ()))
             continue
-
-        cost = _recent_cost_for_type(vehicle_id, int(t["type_id"]))
-        if cost is None or cost <= 0:
+        if _HELP_RULE.match(line):
+            segments.append((HELP_RULE_TEXT + "\n", ("center", "rule")))
+            continue
+        if not any(ch.isalnum() for ch in stripped):
+            # Tabulations et espaces créent de grands écarts entre emojis dans Tk
+            segments.append((stripped.replace("\t", "").replace(" ", "") + "\n", ("emoji",)))
             continue
+        m = _HELP_HEADING.match(stripped)
+        if m:
+            tags = ("center", f"h{min(len(m.group(1)), 3)}")
+            body = m.group(2)
+        elif stripped.startswith(">"):
+            tags, body = ("center", "quote"), stripped.lstrip("> ")
+        else:
+            m = _HELP_LIST.match(line)
+            if m:
+                depth = len(m.group(1).expandtabs(4)) // 2
+                marker = f"{m.group(2)}." if m.group(2) else ("•", "◦", "▪")[min(depth, 2)]
+                tags, body = ("center", "list"), f"{marker} {m.group(3)}"
+            else:
+                tags, body = ("center",), stripped
+        segments += _help_inline(body, tags)
+        segments.append(("\n", tags))
+    # Fusionne les segments consécutifs de mêmes tags : moins d'arguments pour l'insertion
+    merged: list[tuple[str, tuple[str, ...]]] = []
+    for txt, tags in segments:
+        if merged and merged[-1][1] == tags:
+            merged[-1] = (merged[-1][0] + txt, tags)
+        else:
+            merged.append((txt, tags))
+    return merged
 
-        total += cost * expected
-        any_included = True
 
-    return total if any_included else None
+def help_document() -> tuple[tuple, list[tuple[str, tuple[str, ...]]]]:
+    """(clé, segments) de l'aide ; réanalysée seulement si le fichier a changé."""
+    global _help_cache
+    path = _help_source()
+    if path is None:
+        key = (None,)
+    else:
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+    cached = _help_cache
+    _perf.cache("aide analysée", cached is not None and cached[0] == key)
+    if cached is not None and cached[0] == key:
+        return cached
+    text = read_text_file_safely(path) if path else ""
+    if not text:
+        text = "# Aide indisponible\n\nLe fichier AIDE.md n'a pas été trouvé"
+    _help_cache = (key, parse_help_markdown(text))
+    return _help_cache
 
 
 # ----------------- Modales -----------------
@@ -1182,6 +4962,7 @@ class PleinEditor(tk.Toplevel):
         self.vehicle_id = int(vehicle_id)
         self.plein_id = int(plein_id)
         self.on_saved = on_saved
+        self._saving = False  # écriture en cours dans le thread de la base
 
         r = get_plein(self.plein_id)
         if not r:
@@ -1189,7 +4970,7 @@ class PleinEditor(tk.Toplevel):
             self.destroy()
             return
 
-        self.var_date = tk.StringVar(value=_jjmmaa_from_iso(r["date_iso"] or ""))
+        self.var_date = tk.StringVar(value=_jjmmaa_from_iso(r.date))
         self.var_km = tk.StringVar(value=str(r["km"] if r["km"] is not None else ""))
         self.var_litres = tk.StringVar(value="" if r["litres"] is None else str(r["litres"]).replace(".", ","))
         self.var_prix = tk.StringVar(value="" if r["prix_litre"] is None else str(r["prix_litre"]).replace(".", ","))
@@ -1213,10 +4994,9 @@ class PleinEditor(tk.Toplevel):
         ttk.Entry(frm, textvariable=self.var_total, width=12).grid(row=2, column=1, sticky="w", padx=(6, 16), pady=(10, 0))
         ttk.Label(frm, text="Lieu :").grid(row=2, column=2, sticky="w", pady=(10, 0))
 
-        self._all_lieux = list_pleins_lieux(self.vehicle_id)
-        self.lieu_cb = ttk.Combobox(frm, textvariable=self.var_lieu, values=self._all_lieux, state="normal", width=24)
+        self.lieu_cb = ttk.Combobox(frm, textvariable=self.var_lieu, state="normal", width=24)
         self.lieu_cb.grid(row=2, column=3, sticky="w", padx=(6, 0), pady=(10, 0))
-        self.lieu_cb.bind("<KeyRelease>", lambda e: _apply_autocomplete(self.lieu_cb, self._all_lieux, self.var_lieu.get()))
+        _bind_lieu_autocomplete(self.lieu_cb, self.var_lieu)
 
         ttk.Label(frm, text="Si Total est vide → calcul auto (Litres × Prix/L).").grid(row=3, column=0, columnspan=4, sticky="w", pady=(10, 0))
 
@@ -1259,11 +5039,21 @@ class PleinEditor(tk.Toplevel):
             total = litres * prix
 
         lieu = self.var_lieu.get().strip()
-        update_plein(self.plein_id, self.vehicle_id, date_iso, km, litres, prix, total, lieu)
+        if self._saving:
+            return
+        self._saving = True
 
-        if callable(self.on_saved):
-            self.on_saved()
-        self.destroy()
+        def done(_res):
+            if callable(self.on_saved):
+                self.on_saved()
+            self.destroy()
+
+        def failed(exc):
+            self._saving = False
+            messagebox.showerror("Enregistrement impossible", str(exc), parent=self)
+
+        db_worker().run(self, update_plein, self.plein_id, self.vehicle_id, date_iso, km, litres, prix, total, lieu,
+                        on_done=done, on_error=failed)
 
 
 class EntretienEditor(tk.Toplevel):
@@ -1279,6 +5069,7 @@ class EntretienEditor(tk.Toplevel):
         self.type_choices = list(type_choices)
         self.type_name_to_id = dict(type_name_to_id)
         self.on_saved = on_saved
+        self._saving = False  # écriture en cours dans le thread de la base
 
         r = get_entretien(self.entretien_id)
         if not r:
@@ -1286,7 +5077,7 @@ class EntretienEditor(tk.Toplevel):
             self.destroy()
             return
 
-        self.var_date = tk.StringVar(value=_jjmmaa_from_iso(r["date_iso"] or ""))
+        self.var_date = tk.StringVar(value=_jjmmaa_from_iso(r.date))
         self.var_km = tk.StringVar(value=str(r["km"] if r["km"] is not None else ""))
         self.var_kind = tk.StringVar(value=r["kind"] or "Entretien")
 
@@ -1330,63 +5121,344 @@ class EntretienEditor(tk.Toplevel):
         ttk.Entry(frm, textvariable=self.var_details, width=26).grid(row=3, column=3, sticky="w", padx=(6, 0), pady=(10, 0))
 
         btns = ttk.Frame(frm)
-        btns.grid(row=4, column=0, columnspan=4, sticky="e", pady=(14, 0))
-        ttk.Button(btns, text="Annuler", command=self.destroy).grid(row=0, column=0, padx=(0, 8))
-        ttk.Button(btns, text="Enregistrer", command=self._save).grid(row=0, column=1)
+        btns.grid(row=4, column=0, columnspan=4, sticky="e", pady=(14, 0))
+        ttk.Button(btns, text="Annuler", command=self.destroy).grid(row=0, column=0, padx=(0, 8))
+        ttk.Button(btns, text="Enregistrer", command=self._save).grid(row=0, column=1)
+
+        self.bind("<Return>", lambda _e: self._save())
+        self.bind("<Escape>", lambda _e: self.destroy())
+
+    def _save(self):
+        date_iso = _date_from_jjmmaa(self.var_date.get().strip())
+        if not date_iso:
+            messagebox.showwarning("Date", "Date invalide.")
+            return
+
+        km = _safe_int(self.var_km.get().strip().lower().replace("km", "").strip())
+        if km is None or km < 0:
+            messagebox.showwarning("Km", "Kilométrage invalide.")
+            return
+
+        kind = self.var_kind.get().strip()
+        if kind not in ("Réparation", "Entretien", "Entretien & Réparation"):
+            kind = "Entretien"
+
+        type_name = self.var_type.get().strip()
+        type_id = self.type_name_to_id.get(type_name)
+        if not type_id:
+            messagebox.showwarning("Type", "Choisis un type d'entretien.")
+            return
+
+        cost_in = self.var_cost.get().strip().replace(",", ".")
+        cout = None
+        if cost_in:
+            try:
+                cout = float(cost_in)
+            except Exception:
+                messagebox.showwarning("Coût", "Coût invalide.")
+                return
+
+        by = self.var_by.get().strip()
+
+        vbat_in = self.var_vbat.get().strip().replace(",", ".")
+        vbat = None
+        if vbat_in:
+            try:
+                vbat = float(vbat_in)
+            except Exception:
+                messagebox.showwarning("Vbat", "Valeur invalide.")
+                return
+            if not (5.00 <= vbat <= 25.99):
+                messagebox.showwarning("Vbat", "Vbat doit être entre 5.00 et 25.99.")
+                return
+
+        details = self.var_details.get().strip()
+
+        if self._saving:
+            return
+        self._saving = True
+
+        def done(_res):
+            if callable(self.on_saved):
+                self.on_saved()
+            self.destroy()
+
+        def failed(exc):
+            self._saving = False
+            messagebox.showerror("Enregistrement impossible", str(exc), parent=self)
+
+        db_worker().run(self, update_entretien, self.entretien_id, self.vehicle_id, date_iso, km, kind, type_id,
+                        cout, by, details, vbat, on_done=done, on_error=failed)
+
+
+class RepairKeywordsEditor(tk.Toplevel):
+    """Édition de la liste des mots-clés qui classent un entretien en réparation."""
+
+    def __init__(self, parent, on_saved):
+        super().__init__(parent)
+        self.title("Mots-clés réparation")
+        self.resizable(False, True)
+        self.transient(parent)
+        self.grab_set()
+
+        self.on_saved = on_saved
+        self._saving = False
+
+        frm = ttk.Frame(self, padding=12)
+        frm.grid(row=0, column=0, sticky="nsew")
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        frm.rowconfigure(1, weight=1)
+
+        ttk.Label(frm, text="Un mot-clé par ligne (recherché dans type, intervention et détails, accents ignorés) :"
+                  ).grid(row=0, column=0, columnspan=2, sticky="w")
+        self.txt = tk.Text(frm, width=40, height=16, wrap="none")
+        self.txt.grid(row=1, column=0, sticky="nsew", pady=(8, 0))
+        ysb = ttk.Scrollbar(frm, orient="vertical", command=self.txt.yview)
+        ysb.grid(row=1, column=1, sticky="ns", pady=(8, 0))
+        self.txt.configure(yscrollcommand=ysb.set)
+        self.txt.insert("1.0", "\n".join(list_repair_keywords()))
+
+        btns = ttk.Frame(frm)
+        btns.grid(row=2, column=0, columnspan=2, sticky="e", pady=(14, 0))
+        ttk.Button(btns, text="Par défaut", command=self._reset).grid(row=0, column=0, padx=(0, 8))
+        ttk.Button(btns, text="Annuler", command=self.destroy).grid(row=0, column=1, padx=(0, 8))
+        ttk.Button(btns, text="Enregistrer", command=self._save).grid(row=0, column=2)
+
+        self.bind("<Escape>", lambda _e: self.destroy())
+
+    def _reset(self):
+        self.txt.delete("1.0", "end")
+        self.txt.insert("1.0", "\n".join(DEFAULT_REPAIR_KEYWORDS))
+
+    def _save(self):
+        words = self.txt.get("1.0", "end").splitlines()
+        if self._saving:
+            return
+        self._saving = True
+
+        def done(n):
+            if callable(self.on_saved):
+                self.on_saved(n)
+            self.destroy()
+
+        def failed(exc):
+            self._saving = False
+            messagebox.showerror("Erreur", str(exc), parent=self)
+
+        # Reclassement de tout l'historique : sur le thread d'écriture, pas dans la boucle Tk
+        db_worker().run(self, set_repair_keywords, words, on_done=done, on_error=failed)
+
+
+class BackupSettingsEditor(tk.Toplevel):
+    """Réglages des sauvegardes : dossier, rétention, fréquence automatique."""
+
+    def __init__(self, parent, on_saved=None):
+        super().__init__(parent)
+        self.title("Sauvegardes")
+        self.resizable(False, False)
+        self.transient(parent)
+        self.grab_set()
+
+        self.on_saved = on_saved
+        s = backup_settings()
+
+        frm = ttk.Frame(self, padding=12)
+        frm.grid(row=0, column=0, sticky="nsew")
+        frm.columnconfigure(1, weight=1)
+
+        self.dir_var = tk.StringVar(value=s["backup_dir"])
+        self.keep_var = tk.StringVar(value=str(s["backup_keep"]))
+        self.days_var = tk.StringVar(value=str(s["backup_max_days"]))
+        self.hours_var = tk.StringVar(value=str(s["backup_interval_hours"]))
+        self.on_exit_var = tk.BooleanVar(value=bool(s["backup_on_exit"]))
+
+        ttk.Label(frm, text="Dossier :").grid(row=0, column=0, sticky="w")
+        ttk.Entry(frm, textvariable=self.dir_var, width=44).grid(row=0, column=1, sticky="ew", padx=(8, 0))
+        ttk.Button(frm, text="Parcourir…", command=self._browse).grid(row=0, column=2, padx=(8, 0))
+
+        rows = (("Sauvegardes conservées (0 = toutes) :", self.keep_var),
+                ("Conservation en jours (0 = illimitée) :", self.days_var),
+                ("Sauvegarde auto toutes les (heures, 0 = jamais) :", self.hours_var))
+        for i, (label, var) in enumerate(rows, start=1):
+            ttk.Label(frm, text=label).grid(row=i, column=0, columnspan=2, sticky="w", pady=(8, 0))
+            ttk.Entry(frm, textvariable=var, width=8).grid(row=i, column=2, sticky="e", pady=(8, 0))
+
+        ttk.Checkbutton(frm, text="Sauvegarder à la fermeture si des données ont changé",
+                        variable=self.on_exit_var).grid(row=4, column=0, columnspan=3, sticky="w", pady=(10, 0))
+
+        last = get_setting("backup_last")
+        try:
+            last_txt = datetime.fromisoformat(last).strftime("%d/%m/%Y %H:%M") if last else "jamais"
+        except ValueError:
+            last_txt = "?"
+        ttk.Label(frm, text=f"Dernière sauvegarde : {last_txt}").grid(row=5, column=0, columnspan=3,
+                                                                      sticky="w", pady=(10, 0))
+
+        btns = ttk.Frame(frm)
+        btns.grid(row=6, column=0, columnspan=3, sticky="e", pady=(14, 0))
+        ttk.Button(btns, text="Annuler", command=self.destroy).grid(row=0, column=0, padx=(0, 8))
+        ttk.Button(btns, text="Enregistrer", command=self._save).grid(row=0, column=1)
+
+        self.bind("<Escape>", lambda _e: self.destroy())
+
+    def _browse(self):
+        path = filedialog.askdirectory(parent=self, initialdir=self.dir_var.get() or USER_DIR)
+        if path:
+            self.dir_var.set(path)
+
+    def _save(self):
+        folder = self.dir_var.get().strip()
+        values = {}
+        for key, var in (("backup_keep", self.keep_var), ("backup_max_days", self.days_var),
+                         ("backup_interval_hours", self.hours_var)):
+            v = _safe_int(var.get().strip())
+            if v is None or v < 0:
+                messagebox.showwarning("Sauvegardes", "Les nombres doivent être des entiers positifs ou nuls.",
+                                       parent=self)
+                return
+            values[key] = v
+        if not folder:
+            messagebox.showwarning("Sauvegardes", "Choisis un dossier de sauvegarde.", parent=self)
+            return
+        values["backup_dir"] = folder
+        values["backup_on_exit"] = 1 if self.on_exit_var.get() else 0
+        try:
+            for key, v in values.items():
+                set_setting(key, v)
+        except Exception as e:
+            messagebox.showerror("Erreur", str(e), parent=self)
+            return
+        if callable(self.on_saved):
+            self.on_saved()
+        self.destroy()
+
+
+class SqlProfileWindow(tk.Toplevel):
+    """Rapport du profileur SQL (--profile-sql) : requêtes les plus coûteuses et leurs plans."""
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Profil SQL")
+        self.transient(parent)
+
+        frm = ttk.Frame(self, padding=12)
+        frm.grid(row=0, column=0, sticky="nsew")
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        frm.columnconfigure(0, weight=1)
+        frm.rowconfigure(0, weight=1)
+
+        self.txt = tk.Text(frm, width=110, height=32, wrap="none", font="TkFixedFont")
+        self.txt.grid(row=0, column=0, sticky="nsew")
+        ysb = ttk.Scrollbar(frm, orient="vertical", command=self.txt.yview)
+        ysb.grid(row=0, column=1, sticky="ns")
+        xsb = ttk.Scrollbar(frm, orient="horizontal", command=self.txt.xview)
+        xsb.grid(row=1, column=0, sticky="ew")
+        self.txt.configure(yscrollcommand=ysb.set, xscrollcommand=xsb.set)
+
+        btns = ttk.Frame(frm)
+        btns.grid(row=2, column=0, columnspan=2, sticky="e", pady=(10, 0))
+        ttk.Button(btns, text="Remettre à zéro", command=self._reset).grid(row=0, column=0, padx=(0, 8))
+        ttk.Button(btns, text="Actualiser", command=self._refresh).grid(row=0, column=1, padx=(0, 8))
+        ttk.Button(btns, text="Fermer", command=self.destroy).grid(row=0, column=2)
 
-        self.bind("<Return>", lambda _e: self._save())
         self.bind("<Escape>", lambda _e: self.destroy())
+        self._refresh()
 
-    def _save(self):
-        date_iso = _date_from_jjmmaa(self.var_date.get().strip())
-        if not date_iso:
-            messagebox.showwarning("Date", "Date invalide.")
-            return
+    def _refresh(self):
+        self.txt.configure(state="normal")
+        self.txt.delete("1.0", "end")
+        self.txt.insert("1.0", sql_profiler().report())
+        self.txt.configure(state="disabled")
 
-        km = _safe_int(self.var_km.get().strip().lower().replace("km", "").strip())
-        if km is None or km < 0:
-            messagebox.showwarning("Km", "Kilométrage invalide.")
-            return
+    def _reset(self):
+        sql_profiler().reset()
+        self._refresh()
 
-        kind = self.var_kind.get().strip()
-        if kind not in ("Réparation", "Entretien", "Entretien & Réparation"):
-            kind = "Entretien"
 
-        type_name = self.var_type.get().strip()
-        type_id = self.type_name_to_id.get(type_name)
-        if not type_id:
-            messagebox.showwarning("Type", "Choisis un type d'entretien.")
-            return
+class SearchWindow(tk.Toplevel):
+    """Recherche plein texte sur toute la flotte (entretiens + préconisations)."""
 
-        cost_in = self.var_cost.get().strip().replace(",", ".")
-        cout = None
-        if cost_in:
-            try:
-                cout = float(cost_in)
-            except Exception:
-                messagebox.showwarning("Coût", "Coût invalide.")
-                return
+    def __init__(self, parent, on_open, initial: str = ""):
+        super().__init__(parent)
+        self.title("Rechercher dans l'historique")
+        self.geometry("980x520")
+        self.transient(parent)
 
-        by = self.var_by.get().strip()
+        self.on_open = on_open
+        self._after_id = None
+        self._rows = []
 
-        vbat_in = self.var_vbat.get().strip().replace(",", ".")
-        vbat = None
-        if vbat_in:
-            try:
-                vbat = float(vbat_in)
-            except Exception:
-                messagebox.showwarning("Vbat", "Valeur invalide.")
-                return
-            if not (5.00 <= vbat <= 25.99):
-                messagebox.showwarning("Vbat", "Vbat doit être entre 5.00 et 25.99.")
-                return
+        frm = ttk.Frame(self, padding=12)
+        frm.grid(row=0, column=0, sticky="nsew")
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        frm.columnconfigure(1, weight=1)
+        frm.rowconfigure(1, weight=1)
+
+        ttk.Label(frm, text="Rechercher :").grid(row=0, column=0, sticky="w")
+        self.var_q = tk.StringVar(value=initial)
+        ent = ttk.Entry(frm, textvariable=self.var_q)
+        ent.grid(row=0, column=1, sticky="ew", padx=(8, 0))
+        ent.bind("<KeyRelease>", lambda _e: self._schedule())
+        ent.bind("<Return>", lambda _e: self._run())
+        ent.focus_set()
+
+        cols = ("vehicule", "date", "km", "source", "extrait")
+        self.tree = ttk.Treeview(frm, columns=cols, show="headings")
+        self.tree.grid(row=1, column=0, columnspan=2, sticky="nsew", pady=(10, 0))
+        heads = {"vehicule": "Véhicule", "date": "Date", "km": "Km", "source": "Source", "extrait": "Extrait"}
+        widths = {"vehicule": 160, "date": 90, "km": 80, "source": 110, "extrait": 520}
+        for c in cols:
+            self.tree.heading(c, text=heads[c])
+            self.tree.column(c, width=widths[c], anchor="w", stretch=(c == "extrait"))
+        ysb = ttk.Scrollbar(frm, orient="vertical", command=self.tree.yview)
+        ysb.grid(row=1, column=2, sticky="ns", pady=(10, 0))
+        self.tree.configure(yscroll=ysb.set)
+        self.tree.bind("<Double-1>", lambda _e: self._open_selected())
+        self.tree.bind("<Return>", lambda _e: self._open_selected())
 
-        details = self.var_details.get().strip()
+        self.lbl_info = ttk.Label(frm, text="Double-clic sur un résultat pour l'ouvrir.")
+        self.lbl_info.grid(row=2, column=0, columnspan=2, sticky="w", pady=(8, 0))
 
-        update_entretien(self.entretien_id, self.vehicle_id, date_iso, km, kind, type_id, cout, by, details, vbat)
-        if callable(self.on_saved):
-            self.on_saved()
-        self.destroy()
+        self.bind("<Escape>", lambda _e: self.destroy())
+        if initial:
+            self._run()
+
+    def _schedule(self):
+        # Regroupe les frappes rapides : une recherche 250 ms après la dernière touche
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+        self._after_id = self.after(250, self._run)
+
+    def _run(self):
+        self._after_id = None
+        for item in self.tree.get_children():
+            self.tree.delete(item)
+        try:
+            self._rows = search_records(self.var_q.get())
+        except Exception as e:
+            self._rows = []
+            self.lbl_info.config(text=f"Recherche invalide : {e}")
+            return
+        for i, r in enumerate(self._rows):
+            self.tree.insert("", "end", iid=str(i), values=(
+                r["vehicule"] or "",
+                _fmt_date(r["date_iso"]),
+                r["km"] or "",
+                "Entretien" if r["source"] == "entretien" else "Préconisation",
+                (r["extrait"] or "").replace("\n", " "),
+            ))
+        self.lbl_info.config(text=f"{len(self._rows)} résultat(s). Double-clic sur un résultat pour l'ouvrir.")
+
+    def _open_selected(self):
+        sel = self.tree.selection()
+        if not sel:
+            return
+        r = self._rows[int(sel[0])]
+        if callable(self.on_open):
+            self.on_open(r["source"], int(r["ref_id"]), int(r["vehicule_id"]))
 
 
 # ----------------- Application -----------------
@@ -1431,7 +5503,6 @@ class GarageApp(tk.Tk):
         self._veh_photo_img = None
         self._veh_mode = "view"  # view/add/edit
         self._veh_photo_src_path = None
-        self._pleins_lieux_all = []
         self._type_name_to_id = {}
         self.selected_type_id = None
 
@@ -1439,6 +5510,15 @@ class GarageApp(tk.Tk):
 
         self._build_ui()
         self._refresh_all()
+        self.after(BACKUP_CHECK_MS, self._backup_tick)
+
+        self._watch_conn = None
+        self._watch_ver = self._watch_seq = None
+        self._external_change = False
+        self.after(DB_WATCH_MS, self._watch_db)
+
+        threshold = stall_threshold_ms()
+        self._stall_watchdog = StallWatchdog(self, threshold).start() if threshold else None
 
     def _apply_platform_theme(self) -> None:
         import sys
@@ -1682,6 +5762,17 @@ class GarageApp(tk.Tk):
         )
         self.chk_show_help.grid(row=0, column=0)
 
+        # --- Diagnostic : compteurs de performance (même emplacement que l'aide) ---
+        self.show_diag_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.help_toggle_bar,
+            text="Diagnostic",
+            variable=self.show_diag_var,
+            command=self._on_diag_toggle,
+        ).grid(row=0, column=1, sticky="e")
+
+        self.bind_all("<Control-f>", lambda _e: self._open_search())
+
     def _set_status(self, txt: str):
         self.status.set(txt)
 
@@ -1690,6 +5781,7 @@ class GarageApp(tk.Tk):
 
         # Si l'aide est demandée, on bascule sur l'onglet Général.
         if self.show_help_var.get():
+            self.show_diag_var.set(False)
             try:
                 self.nb.select(self.tab_general)
             except Exception:
@@ -1697,11 +5789,30 @@ class GarageApp(tk.Tk):
 
         self._apply_help_visibility()
 
+    def _on_diag_toggle(self) -> None:
+        """Affiche/masque le panneau Diagnostic (à la place de l'aide, sur l'onglet Général)."""
+        if self.show_diag_var.get():
+            self.show_help_var.set(False)
+            try:
+                self.nb.select(self.tab_general)
+            except Exception:
+                pass
+        self._apply_help_visibility()
+
+    def _general_overlay_shown(self) -> bool:
+        """Aide ou Diagnostic affiché à la place de la vue de l'onglet Général."""
+        return bool(self.show_help_var.get() or self.show_diag_var.get())
+
     def _apply_help_visibility(self) -> None:
-        """Applique l'état d'affichage de l'aide dans l'onglet Général."""
+        """Applique l'état d'affichage de l'aide (ou du diagnostic) dans l'onglet Général."""
         show = bool(self.show_help_var.get())
+        diag = bool(self.show_diag_var.get()) and not show
         if not hasattr(self, "help_frame") or not hasattr(self, "general_cards"):
             return
+        if diag:
+            self.diag_frame.grid()
+        else:
+            self.diag_frame.grid_remove()
 
         if show:
             # Afficher l'aide
@@ -1710,10 +5821,14 @@ class GarageApp(tk.Tk):
             except Exception:
                 pass
             try:
-                self.general_cards.grid_remove()
+                self._general_body().grid_remove()
             except Exception:
                 pass
             self._load_help_into_widget()
+        elif diag:
+            self.help_frame.grid_remove()
+            self._general_body().grid_remove()
+            self._diag_tick()
         else:
             # Masquer l'aide
             try:
@@ -1721,7 +5836,7 @@ class GarageApp(tk.Tk):
             except Exception:
                 pass
             try:
-                self.general_cards.grid()
+                self._general_body().grid()
             except Exception:
                 pass
             # Rafraîchir l'aperçu général si des véhicules existent
@@ -1731,119 +5846,50 @@ class GarageApp(tk.Tk):
                 except Exception:
                     pass
 
-    def _read_help_md(self) -> str:
-        """Lit AIDE.md (à la racine de l'app) et nettoie le bloc <img> en tête si présent."""
-        # AIDE.md est attendu à la racine, au même niveau que garage.py (ou dans le bundle PyInstaller).
-        candidates = [
-            resource_path("assets/AIDE.md"),
-            os.path.join(os.path.abspath(os.path.dirname(__file__)), "AIDE.md"),
-            os.path.abspath("assets/AIDE.md"),
-        ]
-        txt = ""
-        for p in candidates:
-            if os.path.exists(p):
-                txt = read_text_file_safely(p)
-                break
-
-        if not txt:
-            return (
-                "Aide indisponible\n\n"
-                "Le fichier AIDE.md n'a pas été trouvé"
-            )
-
-        # Si le fichier commence par un bloc HTML (souvent <p align="center"><img ...></p>),
-        # on le retire. Certains éditeurs ajoutent ça en tête du Markdown.
-        lines = txt.splitlines()
-
-        # On ne traite que si un <img ...> apparaît très tôt dans le fichier
-        head = "\n".join(lines[:15]).lower()
-        if "<img" in head and "<p" in head:
-            i = 0
-            # saute les éventuelles lignes vides au début
-            while i < len(lines) and lines[i].strip() == "":
-                i += 1
-
-            # si on tombe sur un <p ...> on commence à skipper
-            if i < len(lines) and lines[i].strip().lower().startswith("<p"):
-                i += 1
-                # skip jusqu'au </p> inclus (en tolérant multi-lignes)
-                while i < len(lines):
-                    l = lines[i].strip().lower()
-                    if "</p>" in l:
-                        i += 1
-                        break
-                    i += 1
-
-                # retire aussi les lignes vides juste après le bloc
-                while i < len(lines) and lines[i].strip() == "":
-                    i += 1
-
-                txt = "\n".join(lines[i:]).lstrip()
-
-
-        return txt
-
     def _load_help_into_widget(self) -> None:
-        """Charge l'aide dans le widget et centre l'affichage."""
+        """Insère l'aide analysée (help_document) ; rien à faire si elle est déjà à jour."""
         if not hasattr(self, "help_text"):
             return
-
-        content = self._read_help_md()
+        key, segments = help_document()
+        if getattr(self, "_help_key", None) == key:
+            return
+        if getattr(self, "_help_key", None) is None:
+            self._configure_help_tags()
+            self._load_logo_image()
 
         self.help_text.config(state="normal")
         self.help_text.delete("1.0", "end")
-        
-        # bloc qui fait en sorte d'aficher les emojis meme seuls sur une ligne, et en cross OS
-        try:
-            self.help_text.tag_delete("center")
-        except Exception:
-            pass
-        self.help_text.tag_configure("center", justify="center", foreground=HELP_TEXT_COLOR)
-
-        # --- Tag spécifique pour les lignes emoji-only ---
-        try:
-            self.help_text.tag_delete("emoji")
-        except Exception:
-            pass
+        # Un seul appel Tk : insert index texte1 tags1 texte2 tags2 …
+        args = []
+        for txt, tags in segments:
+            args += (txt, tags)
+        if args:
+            self.help_text.insert("end", *args)
+        self.help_text.mark_set("insert", "1.0")
+        self.help_text.config(state="disabled")
+        self._help_key = key
 
+    def _configure_help_tags(self) -> None:
+        """Styles de l'aide : lignes centrées, emojis, titres, listes, gras / italique."""
+        fam, size = HELP_FONT_FAMILY, HELP_FONT_SIZE
+        t = self.help_text
+        t.tag_configure("center", justify="center", foreground=HELP_TEXT_COLOR)
+        # bloc qui fait en sorte d'aficher les emojis meme seuls sur une ligne, et en cross OS
         try:
-            self.help_text.tag_configure(
-                "emoji",
-                justify="center",
-                foreground=HELP_TEXT_COLOR,
-                font=(HELP_EMOJI_FONT_FAMILY, HELP_FONT_SIZE),
-            )
+            t.tag_configure("emoji", justify="center", foreground=HELP_TEXT_COLOR,
+                            font=(HELP_EMOJI_FONT_FAMILY, size))
         except Exception:
             # Si la police emoji n'est pas dispo, on garde au moins centrage + couleur
-            self.help_text.tag_configure(
-                "emoji",
-                justify="center",
-                foreground=HELP_TEXT_COLOR,
-            )
-
-
-
-        self.help_text.mark_set("insert", "1.0")
-        for line in content.splitlines():
-            stripped = line.strip()
-
-            if stripped == "":
-                self.help_text.insert("end", "\n")
-                continue
-
-            # Lignes avec lettres/chiffres : centrées via le tag "center"
-            if any(ch.isalnum() for ch in stripped):
-                self.help_text.insert("end", line + "\n", "center")
-            else:
-                # Lignes sans alphanum (---, emojis, symboles) : centrées aussi
-                # Supprime tabulations et espaces qui créent de grands écarts entre emojis dans Tk
-                clean = line.replace("\t", "").replace(" ", "")
-                self.help_text.insert("end", clean + "\n", "emoji")
-
-
-
-        self.help_text.config(state="disabled")
-
+            t.tag_configure("emoji", justify="center", foreground=HELP_TEXT_COLOR)
+        t.tag_configure("rule", foreground="#777777")
+        t.tag_configure("list", spacing1=2)
+        t.tag_configure("quote", font=(fam, size, "italic"), foreground="#CFCFCF")
+        t.tag_configure("bold", font=(fam, size, "bold"))
+        t.tag_configure("italic", font=(fam, size, "italic"))
+        # Configurés en dernier : priorité sur "bold" dans un titre
+        t.tag_configure("h3", font=(fam, size + 2, "bold"), spacing1=6)
+        t.tag_configure("h2", font=(fam, size + 4, "bold"), spacing1=10)
+        t.tag_configure("h1", font=(fam, size + 8, "bold"), spacing1=14, spacing3=6)
 
     def _load_logo_image(self) -> None:
         """Charge le logo PNG (assets/logo.png) et l'affiche en taille raisonnable."""
@@ -1966,6 +6012,35 @@ class GarageApp(tk.Tk):
 
         self.theme_cb.bind("<<ComboboxSelected>>", self._on_theme_change)
 
+        # --- Menu Outils (maintenance des données) ---
+        self.tools_btn = ttk.Menubutton(head, text="Outils")
+        self.tools_btn.grid(row=0, column=2, sticky="e", padx=(8, 0))
+        self.tools_menu = tk.Menu(self.tools_btn, tearoff=False)
+        self.tools_menu.add_command(label="Rechercher…", accelerator="Ctrl+F", command=self._open_search)
+        self.tools_menu.add_separator()
+        self.tools_menu.add_command(label="Mots-clés réparation…", command=self._open_repair_keywords)
+        self.tools_menu.add_command(label="Archiver l'historique…", command=self._archive_history)
+        self.tools_menu.add_separator()
+        self.tools_menu.add_command(label="Sauvegarder maintenant", command=self._backup_now)
+        self.tools_menu.add_command(label="Réglages des sauvegardes…", command=self._open_backup_settings)
+        self.tools_menu.add_command(label="Exporter une archive…", command=self._export_snapshot)
+        self.tools_menu.add_command(label="Importer une archive…", command=self._import_snapshot)
+        self.tools_menu.add_command(label="Exporter les modifications…", command=self._export_changes)
+        self.tools_menu.add_command(label="Appliquer des modifications…", command=self._apply_changes)
+        if sql_profiler().enabled:
+            self.tools_menu.add_separator()
+            self.tools_menu.add_command(label="Profil SQL…", command=lambda: SqlProfileWindow(self))
+        self.tools_btn["menu"] = self.tools_menu
+
+        # --- Vue : cartes détaillées (2 par page) ou grille flotte (tous les véhicules) ---
+        self.general_view_var = tk.StringVar(value="cartes")
+        view_bar = ttk.Frame(head)
+        view_bar.grid(row=0, column=3, sticky="e", padx=(8, 0))
+        views = (("Cartes", "cartes"), ("Flotte", "flotte"), ("Échéances", "echeances"), ("Coûts", "couts"))
+        for i, (label, value) in enumerate(views):
+            ttk.Radiobutton(view_bar, text=label, value=value, variable=self.general_view_var,
+                            style="Toolbutton", command=self._on_general_view_change).grid(row=0, column=i, padx=(0, 2))
+
         # --- Zone droite : navigation pages (ton code existant) ---
         nav = ttk.Frame(head)
         nav.grid(row=0, column=0, sticky="e")
@@ -1986,6 +6061,17 @@ class GarageApp(tk.Tk):
         self.general_cards.columnconfigure(1, weight=1)
         self.general_cards.rowconfigure(0, weight=1)
 
+        # Grille flotte et échéances (même emplacement, masquées par défaut)
+        self._build_fleet_grid()
+        self.general_fleet.grid_remove()
+        self._build_due_panel()
+        self.general_due.grid_remove()
+        self._build_tco_panel()
+        self.general_tco.grid_remove()
+
+        self._build_diag_panel()
+        self.diag_frame.grid_remove()
+
         # Zone aide (superposée, affichée/masquée via checkbox)
         self.help_frame = ttk.Frame(self.tab_general)
         self.help_frame.grid(row=1, column=0, sticky="nsew", pady=(0, 0))
@@ -2019,16 +6105,121 @@ class GarageApp(tk.Tk):
         self.help_text.grid(row=0, column=0, sticky="nsew")
         help_scroll.config(command=self.help_text.yview)
 
-        # Remplit logo + aide
-        self._load_logo_image()
-        self._load_help_into_widget()
-
+        # Logo + aide chargés à la première ouverture (_load_help_into_widget)
 
         # Par défaut, on masque l'aide (on affiche les cartes)
         try:
             self.help_frame.grid_remove()
         except Exception:
             pass
+    # ---------- Diagnostic (compteurs de performance) ----------
+    def _build_diag_panel(self):
+        self.diag_frame = ttk.Frame(self.tab_general, padding=(8, 4))
+        self.diag_frame.grid(row=1, column=0, sticky="nsew")
+        self.diag_frame.columnconfigure(0, weight=1)
+        self.diag_frame.rowconfigure(0, weight=1)
+
+        self.diag_text = tk.Text(self.diag_frame, wrap="none", font="TkFixedFont", bd=0, highlightthickness=0)
+        self.diag_text.grid(row=0, column=0, sticky="nsew")
+        ysb = ttk.Scrollbar(self.diag_frame, orient="vertical", command=self.diag_text.yview)
+        ysb.grid(row=0, column=1, sticky="ns")
+        self.diag_text.configure(yscrollcommand=ysb.set, state="disabled")
+
+        btns = ttk.Frame(self.diag_frame)
+        btns.grid(row=1, column=0, columnspan=2, sticky="e", pady=(8, 0))
+        ttk.Button(btns, text="Remettre à zéro", command=self._diag_reset).grid(row=0, column=0, padx=(0, 8))
+        ttk.Button(btns, text="Mémoire (tracemalloc)", command=self._diag_tracemalloc).grid(row=0, column=1, padx=(0, 8))
+        ttk.Button(btns, text="Arrêter tracemalloc", command=self._diag_tracemalloc_stop).grid(row=0, column=2, padx=(0, 8))
+        ttk.Button(btns, text="Copier", command=self._diag_copy).grid(row=0, column=3)
+
+        self._diag_after = None
+        self._diag_tracemalloc_lines: list[str] = []
+
+    def _diag_tick(self):
+        """Met à jour le panneau chaque seconde tant qu'il est affiché."""
+        if self._diag_after is not None:
+            self.after_cancel(self._diag_after)
+            self._diag_after = None
+        if not self.show_diag_var.get() or self.show_help_var.get():
+            return
+        self._diag_render()
+        self._diag_after = self.after(DIAG_REFRESH_MS, self._diag_tick)
+
+    def _diag_lines(self) -> list[str]:
+        lines = perf_counters().report()
+        n_img, img_bytes = self._image_memory()
+        lines += ["", f"Images Tk en mémoire : {n_img} ({img_bytes / 1024:.0f} Ko décompressés)",
+                  f"Instantanés véhicule en cache : {len(_snapshots)} / {SNAPSHOT_CACHE_SIZE}"]
+
+        watchdog = getattr(self, "_stall_watchdog", None)
+        if watchdog is None:
+            lines += ["", "Surveillance des blocages désactivée (--stall-ms)."]
+        else:
+            lines += ["", f"Boucle Tk : {len(watchdog.stalls)} blocage(s) >= {int(watchdog.threshold * 1000)} ms, "
+                          f"retard max {int(watchdog.max_lag * 1000)} ms (détail : {STALL_LOG_FILE})"]
+            lines += [f"  {label:>14} : {n}" for label, n in watchdog.histogram_rows()]
+            for st in list(watchdog.stalls)[-5:]:
+                lines.append(f"  {st['quand']}  {st['ms']} ms dans {st['callback']} ({st['chaud']})")
+        if sql_profiler().enabled:
+            lines += ["", "Profileur SQL actif : Outils → Profil SQL…"]
+        if self._diag_tracemalloc_lines:
+            lines += [""] + self._diag_tracemalloc_lines
+        return lines
+
+    def _diag_render(self):
+        top = self.diag_text.yview()[0]
+        self.diag_text.configure(state="normal")
+        self.diag_text.delete("1.0", "end")
+        self.diag_text.insert("1.0", "\n".join(self._diag_lines()))
+        self.diag_text.configure(state="disabled")
+        self.diag_text.yview_moveto(top)
+
+    def _image_memory(self) -> tuple[int, int]:
+        """Images Tk vivantes (photos, miniatures, graphes, thème) et leur taille décompressée (4 o/pixel)."""
+        n = size = 0
+        for name in self.tk.splitlist(self.tk.call("image", "names")):
+            try:
+                w = int(self.tk.call("image", "width", name))
+                h = int(self.tk.call("image", "height", name))
+            except tk.TclError:
+                continue
+            n += 1
+            size += w * h * 4
+        return n, size
+
+    def _diag_reset(self):
+        perf_counters().reset()
+        self._diag_render()
+
+    def _diag_tracemalloc(self):
+        """Premier clic : démarre le suivi des allocations ; clics suivants : plus gros allocateurs."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._diag_tracemalloc_lines = ["tracemalloc démarré : utilise l'application puis reclique pour "
+                                            "voir les plus gros allocateurs."]
+        else:
+            snap = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [f"tracemalloc ({datetime.now():%H:%M:%S}) : {current / 1048576:.1f} Mo suivis, "
+                     f"pic {peak / 1048576:.1f} Mo"]
+            for st in snap.statistics("lineno")[:DIAG_TRACEMALLOC_TOP]:
+                frame = st.traceback[0]
+                lines.append(f"  {st.size / 1024:>9.1f} Ko {st.count:>7}  {os.path.basename(frame.filename)}:{frame.lineno}")
+            self._diag_tracemalloc_lines = lines
+        self._diag_render()
+
+    def _diag_tracemalloc_stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._diag_tracemalloc_lines = []
+        self._diag_render()
+
+    def _diag_copy(self):
+        """Copie le panneau dans le presse-papiers (à coller dans un rapport de bug)."""
+        self.clipboard_clear()
+        self.clipboard_append("\n".join(self._diag_lines()))
+        self._set_status("Diagnostic copié dans le presse-papiers.")
+
     def _general_prev_page(self):
         if self.general_page > 0:
             self.general_page -= 1
@@ -2045,7 +6236,33 @@ class GarageApp(tk.Tk):
         self.active_vehicle_id = int(vehicle_id)
         self._refresh_all_tabs_after_vehicle_change(source="general_click")
 
+    def _general_body(self):
+        """Cadre affiché sous la barre de l'onglet Général selon la vue choisie."""
+        return {"flotte": self.general_fleet, "echeances": self.general_due, "couts": self.general_tco}.get(
+            self.general_view_var.get(), self.general_cards)
+
+    def _on_general_view_change(self):
+        for frame in (self.general_cards, self.general_fleet, self.general_due, self.general_tco):
+            frame.grid_remove()
+        if not self._general_overlay_shown():
+            self._general_body().grid()
+        self._refresh_general_overview()
+
+    @perf_timed("Général")
     def _refresh_general_overview(self):
+        view = self.general_view_var.get()
+        if view in ("flotte", "echeances", "couts"):
+            self.btn_prev.grid_remove()
+            self.btn_next.grid_remove()
+            self.lbl_page.grid_remove()
+            if view == "flotte":
+                self._refresh_fleet_grid()
+            elif view == "couts":
+                self._refresh_tco_panel()
+            else:
+                self._refresh_due_panel()
+            return
+
         for w in self.general_cards.winfo_children():
             w.destroy()
         self._general_card_imgs = {}
@@ -2075,6 +6292,326 @@ class GarageApp(tk.Tk):
             for col, r in enumerate(show_rows):
                 self._build_general_card(r, row=0, col=col, colspan=1)
 
+    # ---------- Grille flotte ----------
+    FLEET_COLUMNS = (
+        # (colonne, titre, largeur, clé de tri dans fleet_overview)
+        ("nom", "Véhicule", 220, "nom"),
+        ("immat", "Immat.", 110, "immatriculation"),
+        ("urgence", "Urgence", 110, "urgency"),
+        ("retard", "Rappels en retard", 130, "overdue"),
+        ("conso", "Conso L/100", 100, "conso"),
+        ("km", "Dernier km", 110, "km"),
+        ("batterie", "Batterie", 90, "vbat"),
+        ("cout", "Dépensé 6 mois", 120, "cost"),
+    )
+    FLEET_FILTERS = ("Tous", "En retard", "À surveiller ou en retard", "OK")
+
+    def _build_fleet_grid(self):
+        self.general_fleet = ttk.Frame(self.tab_general, padding=(8, 4))
+        self.general_fleet.grid(row=1, column=0, sticky="nsew")
+        self.general_fleet.columnconfigure(0, weight=1)
+        self.general_fleet.rowconfigure(1, weight=1)
+
+        bar = ttk.Frame(self.general_fleet)
+        bar.grid(row=0, column=0, sticky="ew", pady=(0, 6))
+        bar.columnconfigure(2, weight=1)
+        ttk.Label(bar, text="Urgence :").grid(row=0, column=0, sticky="w")
+        self.fleet_filter_var = tk.StringVar(value=self.FLEET_FILTERS[0])
+        flt = ttk.Combobox(bar, textvariable=self.fleet_filter_var, values=self.FLEET_FILTERS, state="readonly", width=26)
+        flt.grid(row=0, column=1, sticky="w", padx=(8, 0))
+        flt.bind("<<ComboboxSelected>>", lambda _e: self._fill_fleet_grid())
+        self.fleet_count_lbl = ttk.Label(bar, text="")
+        self.fleet_count_lbl.grid(row=0, column=2, sticky="e")
+
+        tv_frame = ttk.Frame(self.general_fleet)
+        tv_frame.grid(row=1, column=0, sticky="nsew")
+        tv_frame.columnconfigure(0, weight=1)
+        tv_frame.rowconfigure(0, weight=1)
+
+        cols = tuple(c for c, *_ in self.FLEET_COLUMNS)
+        self.fleet_tree = ttk.Treeview(tv_frame, columns=cols, show="headings", selectmode="browse")
+        self.fleet_tree.grid(row=0, column=0, sticky="nsew")
+        for c, title, width, _key in self.FLEET_COLUMNS:
+            self.fleet_tree.heading(c, text=title, command=lambda col=c: self._sort_fleet_grid(col))
+            self.fleet_tree.column(c, width=width, anchor="w" if c in ("nom", "immat", "urgence") else "e", stretch=True)
+        self.fleet_tree.tag_configure("overdue", foreground="red")
+        self.fleet_tree.tag_configure("watch", foreground="orange")
+
+        ysb = ttk.Scrollbar(tv_frame, orient="vertical", command=self.fleet_tree.yview)
+        ysb.grid(row=0, column=1, sticky="ns")
+        self.fleet_tree.configure(yscroll=ysb.set)
+
+        # Clic sur une ligne : ouvre la carte détaillée du véhicule
+        self.fleet_tree.bind("<ButtonRelease-1>", self._on_fleet_click)
+        self.fleet_tree.bind("<Return>", lambda _e: self._open_fleet_selection())
+
+        self._fleet_rows = []
+        self._fleet_sort = ("urgence", True)
+
+    @perf_timed("Général : flotte")
+    def _refresh_fleet_grid(self):
+        try:
+            self._fleet_rows = fleet_overview(months=6)
+        except Exception:
+            self._fleet_rows = []
+        self._fill_fleet_grid()
+
+    def _sort_fleet_grid(self, col: str):
+        current, desc = self._fleet_sort
+        self._fleet_sort = (col, (not desc) if col == current else col in ("urgence", "retard", "cout"))
+        self._fill_fleet_grid()
+
+    def _fill_fleet_grid(self):
+        """Filtre + tri en mémoire sur la dernière lecture (pas de requête)."""
+        flt = self.fleet_filter_var.get()
+        rows = self._fleet_rows
+        if flt == "En retard":
+            rows = [r for r in rows if r["urgency"] == URGENCY_OVERDUE]
+        elif flt == "À surveiller ou en retard":
+            rows = [r for r in rows if r["urgency"] >= URGENCY_WATCH]
+        elif flt == "OK":
+            rows = [r for r in rows if r["urgency"] == URGENCY_OK]
+
+        col, desc = self._fleet_sort
+        key = {c: k for c, _t, _w, k in self.FLEET_COLUMNS}[col]
+        known = [r for r in rows if r[key] is not None]
+        unknown = [r for r in rows if r[key] is None]  # valeurs absentes toujours en fin de liste
+
+        def sort_key(r):
+            v = r[key]
+            v = v.lower() if isinstance(v, str) else v
+            return (v, r["overdue"], r["soon"]) if key == "urgency" else (v,)
+
+        rows = sorted(known, key=sort_key, reverse=desc) + unknown
+
+        for c, title, _w, _k in self.FLEET_COLUMNS:
+            arrow = (" ▼" if desc else " ▲") if c == col else ""
+            self.fleet_tree.heading(c, text=title + arrow)
+
+        self.fleet_tree.delete(*self.fleet_tree.get_children())
+        for r in rows:
+            overdue_txt = str(r["overdue"]) + (f" (+{r['soon']} bientôt)" if r["soon"] else "")
+            tag = {URGENCY_OVERDUE: "overdue", URGENCY_WATCH: "watch"}.get(r["urgency"], "")
+            self.fleet_tree.insert("", "end", iid=str(r["id"]), tags=(tag,) if tag else (), values=(
+                r["nom"],
+                r["immatriculation"],
+                URGENCY_LABELS[r["urgency"]],
+                overdue_txt,
+                _fmt_num(r["conso"], 2) if r["conso"] is not None else "—",
+                str(r["km"]) if r["km"] is not None else "—",
+                f"{r['vbat']:.2f} V" if r["vbat"] is not None else "—",
+                f"{_fmt_num(r['cost'], 0)} €" if r["cost"] else "—",
+            ))
+        self.fleet_count_lbl.config(text=f"{len(rows)} / {len(self._fleet_rows)} véhicule(s)")
+
+    def _on_fleet_click(self, evt):
+        if self.fleet_tree.identify_region(evt.x, evt.y) != "cell":
+            return
+        item = self.fleet_tree.identify_row(evt.y)
+        if item:
+            self._open_fleet_vehicle(int(item))
+
+    def _open_fleet_selection(self):
+        sel = self.fleet_tree.selection()
+        if sel:
+            self._open_fleet_vehicle(int(sel[0]))
+
+    def _open_fleet_vehicle(self, vehicle_id: int):
+        """Bascule en vue cartes sur la page qui contient le véhicule."""
+        ids = [int(r["id"]) for r in self.vehicles_rows]
+        if vehicle_id in ids:
+            self.general_page = ids.index(vehicle_id) // 2
+        self.general_view_var.set("cartes")
+        self.general_fleet.grid_remove()
+        self.general_due.grid_remove()
+        self.general_tco.grid_remove()
+        if not self._general_overlay_shown():
+            self.general_cards.grid()
+        self._select_vehicle_from_general(vehicle_id)
+
+    # ---------- Échéances (toute la flotte) ----------
+    DUE_LIMITS = ("20", "50", "100", "500")
+
+    def _build_due_panel(self):
+        self.general_due = ttk.Frame(self.tab_general, padding=(8, 4))
+        self.general_due.grid(row=1, column=0, sticky="nsew")
+        self.general_due.columnconfigure(0, weight=1)
+        self.general_due.rowconfigure(1, weight=1)
+
+        bar = ttk.Frame(self.general_due)
+        bar.grid(row=0, column=0, sticky="ew", pady=(0, 6))
+        bar.columnconfigure(2, weight=1)
+        ttk.Label(bar, text="Prochaines échéances :").grid(row=0, column=0, sticky="w")
+        self.due_limit_var = tk.StringVar(value=self.DUE_LIMITS[0])
+        lim = ttk.Combobox(bar, textvariable=self.due_limit_var, values=self.DUE_LIMITS, state="readonly", width=6)
+        lim.grid(row=0, column=1, sticky="w", padx=(8, 0))
+        lim.bind("<<ComboboxSelected>>", lambda _e: self._refresh_due_panel())
+
+        tv_frame = ttk.Frame(self.general_due)
+        tv_frame.grid(row=1, column=0, sticky="nsew")
+        tv_frame.columnconfigure(0, weight=1)
+        tv_frame.rowconfigure(0, weight=1)
+
+        cols = ("echeance", "vehicule", "type", "etat")
+        self.due_tree = ttk.Treeview(tv_frame, columns=cols, show="headings", selectmode="browse")
+        self.due_tree.grid(row=0, column=0, sticky="nsew")
+        heads = {"echeance": "Échéance projetée", "vehicule": "Véhicule", "type": "Type d'entretien", "etat": "État"}
+        widths = {"echeance": 300, "vehicule": 200, "type": 220, "etat": 320}
+        for c in cols:
+            self.due_tree.heading(c, text=heads[c])
+            self.due_tree.column(c, width=widths[c], anchor="w", stretch=True)
+        self.due_tree.tag_configure("red", foreground="red")
+        self.due_tree.tag_configure("orange", foreground="orange")
+
+        ysb = ttk.Scrollbar(tv_frame, orient="vertical", command=self.due_tree.yview)
+        ysb.grid(row=0, column=1, sticky="ns")
+        self.due_tree.configure(yscroll=ysb.set)
+
+        self.due_tree.bind("<ButtonRelease-1>", self._on_due_click)
+
+    @perf_timed("Général : échéances")
+    def _refresh_due_panel(self):
+        self.due_tree.delete(*self.due_tree.get_children())
+        try:
+            items = reminder_index().next_due(int(self.due_limit_var.get()))
+        except Exception:
+            items = []
+        today = date.today()
+        for i, it in enumerate(items):
+            tag = it["color"] if it["color"] in ("red", "orange") else ""
+            self.due_tree.insert("", "end", iid=f"{it['vehicle_id']}:{i}", tags=(tag,) if tag else (), values=(
+                _fmt_due(it, today), it["vehicule"], it["type_name"], it["label"],
+            ))
+
+    def _on_due_click(self, evt):
+        if self.due_tree.identify_region(evt.x, evt.y) != "cell":
+            return
+        item = self.due_tree.identify_row(evt.y)
+        if item:
+            self._open_fleet_vehicle(int(item.split(":", 1)[0]))
+
+    # ---------- Coût de possession (classement flotte) ----------
+    TCO_COLUMNS = (
+        # (colonne, titre, largeur, clé de tri)
+        ("rang", "Rang €/km", 80, "rang"),
+        ("nom", "Véhicule", 220, "nom"),
+        ("km", "Km parcourus", 110, "km"),
+        ("carburant", "Carburant", 110, "carburant"),
+        ("entretien", "Entretien", 110, "entretien"),
+        ("total", "Total", 110, "total"),
+        ("cout_km", "€/km", 90, "cout_km"),
+        ("cout_mois", "€/mois", 90, "cout_mois"),
+    )
+    TCO_ALL = "Tout l'historique"
+
+    def _build_tco_panel(self):
+        self.general_tco = ttk.Frame(self.tab_general, padding=(8, 4))
+        self.general_tco.grid(row=1, column=0, sticky="nsew")
+        self.general_tco.columnconfigure(0, weight=1)
+        self.general_tco.rowconfigure(1, weight=1)
+
+        bar = ttk.Frame(self.general_tco)
+        bar.grid(row=0, column=0, sticky="ew", pady=(0, 6))
+        bar.columnconfigure(2, weight=1)
+        ttk.Label(bar, text="Période :").grid(row=0, column=0, sticky="w")
+        self.tco_period_var = tk.StringVar(value=self.TCO_ALL)
+        self.tco_period_cb = ttk.Combobox(bar, textvariable=self.tco_period_var, values=(self.TCO_ALL,),
+                                          state="readonly", width=18)
+        self.tco_period_cb.grid(row=0, column=1, sticky="w", padx=(8, 0))
+        self.tco_period_cb.bind("<<ComboboxSelected>>", lambda _e: self._fill_tco_table())
+        self.tco_total_lbl = ttk.Label(bar, text="")
+        self.tco_total_lbl.grid(row=0, column=2, sticky="e")
+
+        tv_frame = ttk.Frame(self.general_tco)
+        tv_frame.grid(row=1, column=0, sticky="nsew")
+        tv_frame.columnconfigure(0, weight=1)
+        tv_frame.rowconfigure(0, weight=1)
+
+        cols = tuple(c for c, *_ in self.TCO_COLUMNS)
+        self.tco_tree = ttk.Treeview(tv_frame, columns=cols, show="headings", selectmode="browse")
+        self.tco_tree.grid(row=0, column=0, sticky="nsew")
+        for c, title, width, _key in self.TCO_COLUMNS:
+            self.tco_tree.heading(c, text=title, command=lambda col=c: self._sort_tco_table(col))
+            self.tco_tree.column(c, width=width, anchor="w" if c == "nom" else "e", stretch=True)
+
+        ysb = ttk.Scrollbar(tv_frame, orient="vertical", command=self.tco_tree.yview)
+        ysb.grid(row=0, column=1, sticky="ns")
+        self.tco_tree.configure(yscroll=ysb.set)
+
+        self.tco_tree.bind("<ButtonRelease-1>", self._on_tco_click)
+
+        self._tco_rows = []
+        self._tco_sort = ("rang", False)
+
+    @perf_timed("Général : coûts")
+    def _refresh_tco_panel(self):
+        try:
+            self._tco_rows = tco_overview()
+        except Exception:
+            self._tco_rows = []
+        years = sorted({a["annee"] for t in self._tco_rows for a in t["annees"]}, reverse=True)
+        values = (self.TCO_ALL,) + tuple(str(y) for y in years)
+        self.tco_period_cb["values"] = values
+        if self.tco_period_var.get() not in values:
+            self.tco_period_var.set(self.TCO_ALL)
+        self._fill_tco_table()
+
+    def _sort_tco_table(self, col: str):
+        current, desc = self._tco_sort
+        self._tco_sort = (col, (not desc) if col == current else col not in ("rang", "nom"))
+        self._fill_tco_table()
+
+    def _fill_tco_table(self):
+        """Totaux de la période choisie (tout ou une année), classés par €/km, puis tri d'affichage."""
+        period = self.tco_period_var.get()
+        rows = []
+        for t in self._tco_rows:
+            if period == self.TCO_ALL:
+                totals = t
+            else:
+                totals = next((a for a in t["annees"] if str(a["annee"]) == period), None)
+                if totals is None:
+                    continue
+            rows.append(dict(totals, id=t["id"], nom=t["nom"]))
+        ranked = sorted((r for r in rows if r["cout_km"] is not None), key=lambda r: r["cout_km"])
+        for i, r in enumerate(ranked, 1):
+            r["rang"] = i
+        for r in rows:
+            r.setdefault("rang", None)
+
+        col, desc = self._tco_sort
+        key = {c: k for c, _t, _w, k in self.TCO_COLUMNS}[col]
+        known = [r for r in rows if r[key] is not None]
+        unknown = [r for r in rows if r[key] is None]  # valeurs absentes toujours en fin de liste
+        rows = sorted(known, key=lambda r: r[key].lower() if isinstance(r[key], str) else r[key],
+                      reverse=desc) + unknown
+
+        for c, title, _w, _k in self.TCO_COLUMNS:
+            arrow = (" ▼" if desc else " ▲") if c == col else ""
+            self.tco_tree.heading(c, text=title + arrow)
+
+        self.tco_tree.delete(*self.tco_tree.get_children())
+        for r in rows:
+            self.tco_tree.insert("", "end", iid=str(r["id"]), values=(
+                r["rang"] or "—",
+                r["nom"],
+                f"{r['km']:.0f}" if r["km"] else "—",
+                f"{_fmt_num(r['carburant'], 0)} €",
+                f"{_fmt_num(r['entretien'], 0)} €",
+                f"{_fmt_num(r['total'], 0)} €",
+                _fmt_num(r["cout_km"], 3) if r["cout_km"] is not None else "—",
+                f"{_fmt_num(r['cout_mois'], 0)} €" if r["cout_mois"] is not None else "—",
+            ))
+        fleet_total = math.fsum(r["total"] for r in rows)
+        self.tco_total_lbl.config(text=f"Flotte : {_fmt_num(fleet_total, 0)} € sur {len(rows)} véhicule(s)")
+
+    def _on_tco_click(self, evt):
+        if self.tco_tree.identify_region(evt.x, evt.y) != "cell":
+            return
+        item = self.tco_tree.identify_row(evt.y)
+        if item:
+            self._open_fleet_vehicle(int(item))
+
     def _build_general_card(self, r, row: int, col: int, colspan: int):
         vid = int(r["id"])
         title = r["nom"] or f"Véhicule #{vid}"
@@ -2097,21 +6634,8 @@ class GarageApp(tk.Tk):
         conso_lbl.bind("<Button-1>", lambda e, v=vid: self._select_vehicle_from_general(v))
 
         vbat = get_last_battery_voltage(vid)
-        if vbat is None:
-            bat_msg, bat_color = "—", ""
-        else:
-            if vbat <= 12.0:
-                bat_msg = "Tension en dessous de 12V : Attention décharge critique, prévoir remplacement"
-                bat_color = "red"
-            elif 12.1 <= vbat <= 12.3:
-                bat_msg = "Tension de batterie faible : À recharger"
-                bat_color = "red"
-            elif 12.4 <= vbat <= 12.5:
-                bat_msg = "Batterie limite mais ça passe"
-                bat_color = "orange"
-            else:
-                bat_msg = "Batterie en bonne santé"
-                bat_color = "green"
+        bat_msg, bat_color = _battery_status(vbat)
+        if vbat is not None:
             bat_msg = f"{bat_msg} ({vbat:.2f} V)"
         bat_line = ttk.Label(card, text=f"État de la Batterie : {bat_msg}", font=self.font_info2_bold,
                              foreground=bat_color, wraplength=1100, justify="left")
@@ -2132,18 +6656,21 @@ class GarageApp(tk.Tk):
         cost_lbl.grid(row=4, column=0, sticky="w", pady=(6, 0))
         cost_lbl.bind("<Button-1>", lambda e, v=vid: self._select_vehicle_from_general(v))
 
+        spent = spent_last_months(vid, months=12)
+        spent_total = spent["plein"] + spent["entretien"]
+        spent_txt = (f"{_fmt_num(spent_total, 0)} € (carburant {_fmt_num(spent['plein'], 0)} €, "
+                     f"entretien {_fmt_num(spent['entretien'], 0)} €)" if spent_total > 0 else "—")
+        spent_lbl = ttk.Label(card, text=f"Dépensé sur les 12 derniers mois : {spent_txt}", font=self.font_rem_item)
+        spent_lbl.grid(row=5, column=0, columnspan=2, sticky="w", pady=(2, 0))
+        spent_lbl.bind("<Button-1>", lambda e, v=vid: self._select_vehicle_from_general(v))
+
         details = ttk.Frame(card)
         details.grid(row=3, column=1, rowspan=2, sticky="nw", padx=(14, 0))
         details.columnconfigure(1, weight=1)
 
         def row_get(key, default=""):
-            try:
-                if key in r.keys():
-                    v = r[key]
-                    return default if v is None else v
-            except Exception:
-                pass
-            return default
+            v = getattr(r, key, None)
+            return default if v is None else v
 
         def add_row(label, value, rr):
             ttk.Label(details, text=label + " :", font=self.font_detail_label).grid(row=rr, column=0, sticky="e", padx=(0, 10), pady=3)
@@ -2158,7 +6685,7 @@ class GarageApp(tk.Tk):
         add_row("Dernier km", str(last_km_any(vid) or ""), 6)
 
         reminders = ttk.Frame(card)
-        reminders.grid(row=5, column=0, columnspan=2, sticky="ew", pady=(6, 0))
+        reminders.grid(row=6, column=0, columnspan=2, sticky="ew", pady=(6, 0))
         reminders.columnconfigure(0, weight=1)
         ttk.Label(reminders, text="Rappels:", font=self.font_rem_title).grid(row=0, column=0, sticky="w", pady=(0, 2))
 
@@ -2211,6 +6738,207 @@ class GarageApp(tk.Tk):
             pass
 
 
+    # ---------- Outils ----------
+    def _open_search(self, initial: str = ""):
+        SearchWindow(self, self._open_search_result, initial=initial)
+
+    def _open_search_result(self, source: str, ref_id: int, vehicle_id: int):
+        """Ouvre un résultat de recherche : bascule sur le véhicule puis sur la ligne concernée."""
+        self.active_vehicle_id = int(vehicle_id)
+        self._refresh_all_tabs_after_vehicle_change(source="search")
+        if source == "entretien":
+            self.nb.select(self.tab_ent)
+            for item in self.tree_ent.get_children():
+                if str(self.tree_ent.item(item, "values")[0]) == str(ref_id):
+                    self.tree_ent.selection_set(item)
+                    self.tree_ent.see(item)
+                    break
+        else:
+            self.nb.select(self.tab_vehicules)
+
+    def _open_repair_keywords(self):
+        def after_save(n_changed):
+            self._refresh_general_overview()
+            try:
+                self._refresh_graph()
+            except Exception:
+                pass
+            self._set_status(f"Mots-clés enregistrés : {n_changed} entretien(s) reclassé(s).")
+
+        RepairKeywordsEditor(self, after_save)
+
+    def _open_backup_settings(self):
+        BackupSettingsEditor(self, lambda: self._set_status("Réglages de sauvegarde enregistrés."))
+
+    def _backup_now(self, auto: bool = False):
+        if backup_worker().busy():
+            if not auto:
+                self._set_status("Une sauvegarde est déjà en cours…")
+            return
+
+        def done(res):
+            msg = f"Sauvegarde : {os.path.basename(res['path'])}"
+            if res["photos_copied"] or res["photos_linked"]:
+                msg += f" ({res['photos_copied']} photo(s) copiée(s), {res['photos_linked']} inchangée(s))"
+            self._set_status(msg + ".")
+
+        def failed(exc):
+            self._set_status("")
+            messagebox.showerror("Sauvegarde", f"Sauvegarde impossible :\n{exc}", parent=self)
+
+        self._set_status("Sauvegarde en cours…")
+        backup_worker().run(self, backup_now, on_done=done, on_error=failed)
+
+    def _watch_db(self):
+        """Écritures d'un autre processus (autre fenêtre, script, synchro) : rafraîchit l'affichage.
+
+        PRAGMA data_version ne bouge, sur une connexion gardée ouverte, que si une autre connexion
+        a validé ; les lignes de journal apparues depuis le dernier tour disent alors qui a écrit
+        (journal.processus) : une seule venant d'un autre processus suffit, même si ce processus
+        a lui aussi écrit entre-temps.
+        """
+        try:
+            if self._watch_conn is None:
+                self._watch_conn = _connect_db()
+            ver = self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+            if ver != self._watch_ver:
+                self._watch_ver = ver
+                if self._watch_seq is None:
+                    self._watch_seq = self._watch_conn.execute(
+                        "SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0]
+                else:
+                    r = self._watch_conn.execute(
+                        """SELECT MAX(seq) AS seq, MAX(COALESCE(processus, '') <> ?) AS ailleurs
+                           FROM journal WHERE seq > ?""", (_PROCESS_TAG, self._watch_seq)).fetchone()
+                    if r["seq"] is not None:
+                        self._watch_seq = r["seq"]
+                        if r["ailleurs"]:
+                            self._external_change = True
+
+            if self._external_change and self._veh_mode == "view":  # pas pendant une saisie véhicule
+                self._external_change = False
+                _db_caches_reset()
+                _data_changed()
+                self._refresh_all()
+                self._set_status("Données modifiées ailleurs : affichage mis à jour.")
+        except sqlite3.Error:
+            self._watch_conn = None  # connexion inutilisable : nouvelle connexion au prochain tour
+        self.after(DB_WATCH_MS, self._watch_db)
+
+    def _backup_tick(self):
+        """Sauvegarde automatique : vérifie périodiquement si l'intervalle réglé est écoulé."""
+        try:
+            if backup_due():
+                self._backup_now(auto=True)
+        except Exception:
+            pass  # réglage illisible : on retentera au prochain passage
+        self.after(BACKUP_CHECK_MS, self._backup_tick)
+
+    def _export_snapshot(self):
+        path = filedialog.asksaveasfilename(
+            parent=self, title="Exporter une archive",
+            initialfile=f"garage-{date.today():%Y%m%d}.tar.xz", defaultextension=".tar.xz",
+            filetypes=[("Archive xz", "*.tar.xz"), ("Archive gzip", "*.tar.gz")])
+        if not path:
+            return
+
+        def done(res):
+            self._set_status(f"Archive exportée : {os.path.basename(res['path'])} "
+                             f"({res['files']} fichier(s), {res['bytes'] / 1e6:.1f} Mo).")
+
+        def failed(exc):
+            self._set_status("")
+            messagebox.showerror("Export", f"Export impossible :\n{exc}", parent=self)
+
+        self._set_status("Export en cours…")
+        backup_worker().run(self, export_snapshot, path, on_done=done, on_error=failed)
+
+    def _import_snapshot(self):
+        path = filedialog.askopenfilename(
+            parent=self, title="Importer une archive",
+            filetypes=[("Archive Garage", "*.tar.xz *.tar.gz *.tgz *.tar"), ("Tous les fichiers", "*")])
+        if not path:
+            return
+        if not messagebox.askyesno(
+                "Importer une archive",
+                "Remplacer toutes les données actuelles par celles de l'archive ?\n\n"
+                "Une sauvegarde de la base actuelle est faite juste avant.", parent=self):
+            return
+
+        def done(res):
+            self._refresh_all()
+            msg = "Archive importée"
+            if res["backup"]:
+                msg += f" (ancienne base : {os.path.basename(res['backup'])})"
+            self._set_status(msg + ".")
+
+        def failed(exc):
+            self._set_status("")
+            messagebox.showerror("Import", f"Import impossible, rien n'a été modifié :\n{exc}", parent=self)
+
+        self._set_status("Import en cours…")
+        # Thread d'écriture : l'import ne se mêle pas à un enregistrement en cours
+        db_worker().run(self, import_snapshot, path, on_done=done, on_error=failed)
+
+    def _export_changes(self):
+        path = filedialog.asksaveasfilename(
+            parent=self, title="Exporter les modifications",
+            initialfile=f"garage-modifs-{datetime.now():%Y%m%d-%H%M}.jsonl.gz", defaultextension=".jsonl.gz",
+            filetypes=[("Modifications Garage", "*.jsonl.gz *.jsonl")])
+        if not path:
+            return
+
+        def done(res):
+            self._set_status(f"{res['changes']} modification(s) exportée(s) (n°{res['since'] + 1} à {res['until']}).")
+
+        backup_worker().run(self, export_changes, path, on_done=done)
+
+    def _apply_changes(self):
+        path = filedialog.askopenfilename(
+            parent=self, title="Appliquer des modifications",
+            filetypes=[("Modifications Garage", "*.jsonl.gz *.jsonl"), ("Tous les fichiers", "*")])
+        if not path:
+            return
+
+        def done(res):
+            self._refresh_all()
+            msg = f"Modifications appliquées : {res['applied']}, déjà connues : {res['skipped']}"
+            if res["remapped"]:
+                msg += f", renumérotées : {res['remapped']}"
+            self._set_status(msg + ".")
+            if res["rejected"]:
+                messagebox.showwarning("Synchronisation",
+                                       f"{res['rejected']} modification(s) refusée(s) (ligne liée supprimée ici).",
+                                       parent=self)
+
+        def failed(exc):
+            messagebox.showerror("Synchronisation", f"Application impossible, rien n'a été modifié :\n{exc}",
+                                 parent=self)
+
+        db_worker().run(self, apply_changes, path, on_done=done, on_error=failed)
+
+    def _archive_history(self):
+        default = _add_months(date.today(), -36).strftime("%d/%m/%y")
+        typed = simpledialog.askstring(
+            "Archiver l'historique",
+            "Déplacer dans l'archive les pleins et entretiens antérieurs au (JJ/MM/AA) :\n\n"
+            "Les graphes et la recherche continuent de couvrir tout l'historique ;\n"
+            "les lignes archivées ne sont plus modifiables.",
+            initialvalue=default, parent=self)
+        if typed is None:
+            return
+        cutoff = _date_from_jjmmaa(typed.strip())
+        if not cutoff:
+            messagebox.showwarning("Date", "Date invalide (JJMMAA ou JJ/MM/AA).")
+            return
+
+        def done(moved):
+            self._refresh_all()
+            self._set_status(f"Archivé : {moved.get('pleins', 0)} plein(s), {moved.get('entretiens', 0)} entretien(s).")
+
+        self._set_status("Archivage en cours…")
+        db_worker().run(self, archive_history, cutoff, on_done=done)
+
     # ---------- Véhicules ----------
     def _build_vehicules_tab(self):
         self.tab_vehicules.columnconfigure(0, weight=1)
@@ -2414,40 +7142,53 @@ class GarageApp(tk.Tk):
         annee = self.veh_vars["annee"].get()
         immat = self.veh_vars["immatriculation"].get()
 
-        existing = get_vehicle(self.active_vehicle_id) if self._veh_mode == "edit" else None
-        photo_file = existing["photo_file"] if existing else None
-
-        if self._veh_mode == "add":
-            # 1) Crée d'abord le véhicule pour obtenir un ID stable (sert aussi à nommer la photo)
-            vid = insert_vehicle(nom, marque, modele, motorisation, energie, annee, immat, photo_file=None)
-            self.active_vehicle_id = vid
-
-            # 2) Si une photo a été choisie : copie avec un nom stable V<ID>.png, puis update
-            if self._veh_photo_src_path:
-                try:
-                    photo_file = _copy_vehicle_photo(self._veh_photo_src_path, vid)
-                except Exception as e:
-                    messagebox.showerror("Photo", str(e))
-                    photo_file = None
+        mode = self._veh_mode
+        vehicle_id = self.active_vehicle_id
+        photo_src = self._veh_photo_src_path
+
+        # Toute la séquence (création, copie photo, mise à jour) est une seule tâche du thread d'écriture
+        def job():
+            existing = get_vehicle(vehicle_id) if mode == "edit" else None
+            photo_file = existing["photo_file"] if existing else None
+            photo_error = None
+
+            if mode == "add":
+                # 1) Crée d'abord le véhicule pour obtenir un ID stable (sert aussi à nommer la photo)
+                vid = insert_vehicle(nom, marque, modele, motorisation, energie, annee, immat, photo_file=None)
+
+                # 2) Si une photo a été choisie : copie avec un nom stable V<ID>.png, puis update
+                if photo_src:
+                    try:
+                        photo_file = _copy_vehicle_photo(photo_src, vid)
+                    except Exception as e:
+                        photo_error = str(e)
+                        photo_file = None
+            else:
+                vid = vehicle_id
+                # Edition : si nouvelle photo choisie, on écrase V<ID>.png (échec = rien n'est modifié)
+                if photo_src:
+                    try:
+                        photo_file = _copy_vehicle_photo(photo_src, vid)
+                    except Exception as e:
+                        return vid, str(e), False
 
             update_vehicle(vid, nom, marque, modele, motorisation, energie, annee, immat, photo_file=photo_file)
-            self._set_status("Véhicule ajouté.")
-
-        else:
-            # Edition : si nouvelle photo choisie, on écrase V<ID>.png
-            if self._veh_photo_src_path:
-                try:
-                    photo_file = _copy_vehicle_photo(self._veh_photo_src_path, self.active_vehicle_id)
-                except Exception as e:
-                    messagebox.showerror("Photo", str(e))
-                    return
+            return vid, photo_error, True
 
-            update_vehicle(self.active_vehicle_id, nom, marque, modele, motorisation, energie, annee, immat, photo_file=photo_file)
-            self._set_status("Véhicule modifié.")
+        def done(res):
+            vid, photo_error, saved = res
+            if photo_error:
+                messagebox.showerror("Photo", photo_error)
+            if not saved:
+                return
+            self.active_vehicle_id = vid
+            self._set_status("Véhicule ajouté." if mode == "add" else "Véhicule modifié.")
+            self._veh_set_mode("view")
+            self.vehicles_rows = list_vehicles()
+            self._refresh_all()
 
-        self._veh_set_mode("view")
-        self.vehicles_rows = list_vehicles()
-        self._refresh_all()
+        self._set_status("Enregistrement…")
+        db_worker().run(self, job, on_done=done)
 
     def _veh_delete(self):
         if not self.active_vehicle_id:
@@ -2457,12 +7198,10 @@ class GarageApp(tk.Tk):
             "Supprimer ce véhicule ?\n\nAttention : si des pleins/entretiens existent, la suppression peut échouer."
         ):
             return
-        try:
-            delete_vehicle(self.active_vehicle_id)
-        except Exception as e:
-            messagebox.showerror("Suppression impossible", str(e))
-            return
+        db_worker().run(self, delete_vehicle, self.active_vehicle_id, on_done=self._after_vehicle_deleted,
+                        on_error=lambda e: messagebox.showerror("Suppression impossible", str(e)))
 
+    def _after_vehicle_deleted(self, _res=None):
         self.vehicles_rows = list_vehicles()
         if not self.vehicles_rows:
             messagebox.showinfo("Info", "Plus aucun véhicule dans la flotte.")
@@ -2553,6 +7292,7 @@ class GarageApp(tk.Tk):
 
 
 
+    @perf_timed("Véhicules")
     def _refresh_vehicle_forms(self):
         r = get_vehicle(self.active_vehicle_id)
         if not r:
@@ -2654,7 +7394,7 @@ class GarageApp(tk.Tk):
         self.new_pl_lieu = tk.StringVar(value="")
         self.new_pl_lieu_cb = ttk.Combobox(form, textvariable=self.new_pl_lieu, values=[], state="normal")
         self.new_pl_lieu_cb.grid(row=1, column=5, sticky="ew", padx=(6, 0), pady=(8, 0))
-        self.new_pl_lieu_cb.bind("<KeyRelease>", lambda e: _apply_autocomplete(self.new_pl_lieu_cb, self._pleins_lieux_all, self.new_pl_lieu.get()))
+        _bind_lieu_autocomplete(self.new_pl_lieu_cb, self.new_pl_lieu)
 
         ttk.Label(form, text="Astuce : laissez le Total vide pour calcul auto (Litres × Prix/L).").grid(row=2, column=0, columnspan=5, sticky="w", pady=(8, 0))
 
@@ -2680,26 +7420,26 @@ class GarageApp(tk.Tk):
         except Exception:
             return None
 
+    @perf_timed("Pleins")
     def _refresh_pleins(self):
         for item in self.tree_pleins.get_children():
             self.tree_pleins.delete(item)
         for r in list_pleins(self.active_vehicle_id):
             self.tree_pleins.insert("", "end", values=(
-                int(r["id"]),
-                _fmt_date(r["date_iso"]),
-                r["km"] or "",
-                _fmt_num(r["litres"], 2),
-                _fmt_num(r["prix_litre"], 3),
-                _fmt_num(r["total"], 2),
-                r["lieu"] or "",
+                r.id,
+                _fmt_date(r.date),
+                r.km or "",
+                _fmt_num(r.litres, 2),
+                _fmt_num(r.prix_litre, 3),
+                _fmt_num(r.total, 2),
+                r.lieu or "",
             ))
 
     def _refresh_pleins_lieux(self):
         try:
-            self._pleins_lieux_all = list_pleins_lieux(self.active_vehicle_id)
+            self.new_pl_lieu_cb["values"] = lieu_index().suggest(self.new_pl_lieu.get())
         except Exception:
-            self._pleins_lieux_all = []
-        self.new_pl_lieu_cb["values"] = self._pleins_lieux_all
+            self.new_pl_lieu_cb["values"] = []
 
     def _on_add_plein(self):
         date_iso = _date_from_jjmmaa(self.new_pl_date.get().strip())
@@ -2732,13 +7472,22 @@ class GarageApp(tk.Tk):
             total = litres * prix
 
         lieu = self.new_pl_lieu.get().strip()
-        insert_plein(self.active_vehicle_id, date_iso, km, litres, prix, total, lieu)
 
-        self._refresh_pleins()
-        self._refresh_pleins_lieux()
-        self._refresh_vehicle_forms()
-        self._refresh_general_overview()
-        self._set_status("Plein enregistré.")
+        def done(warnings):
+            self._refresh_pleins()
+            self._refresh_pleins_lieux()
+            self._refresh_vehicle_forms()
+            self._refresh_general_overview()
+            self._set_status("Plein enregistré." + (" À vérifier : " + " ".join(warnings) if warnings else ""))
+            if warnings:
+                messagebox.showwarning("Plein à vérifier", "Plein enregistré, mais il semble inhabituel :\n\n"
+                                       + "\n".join(f"• {w}" for w in warnings)
+                                       + "\n\nCorrige-le depuis la liste si c'est une erreur de saisie.")
+
+        # Formulaire vidé tout de suite : la saisie suivante peut commencer pendant le commit
+        db_worker().run(self, insert_plein, self.active_vehicle_id, date_iso, km, litres, prix, total, lieu,
+                        on_done=done)
+        self._set_status("Enregistrement du plein…")
 
         self.new_pl_date.set("")
         self.new_pl_km.set("")
@@ -2769,12 +7518,15 @@ class GarageApp(tk.Tk):
             return
         if not messagebox.askyesno("Confirmer", "Supprimer ce plein ?"):
             return
-        delete_plein(pid)
-        self._refresh_pleins()
-        self._refresh_pleins_lieux()
-        self._refresh_vehicle_forms()
-        self._refresh_general_overview()
-        self._set_status("Plein supprimé.")
+
+        def done(_res):
+            self._refresh_pleins()
+            self._refresh_pleins_lieux()
+            self._refresh_vehicle_forms()
+            self._refresh_general_overview()
+            self._set_status("Plein supprimé.")
+
+        db_worker().run(self, delete_plein, pid, on_done=done)
 
     # ---------- Entretiens ----------
     def _build_entretiens_tab(self):
@@ -2800,6 +7552,16 @@ class GarageApp(tk.Tk):
         self.ent_header_label = ttk.Label(header, text="—", font=("TkDefaultFont", 11, "bold"))
         self.ent_header_label.grid(row=1, column=0, columnspan=2, sticky="w", pady=(6, 0))
 
+        # Recherche dans tout l'historique (tous véhicules)
+        search_bar = ttk.Frame(header)
+        search_bar.grid(row=1, column=1, sticky="e", pady=(6, 0))
+        self.ent_search_var = tk.StringVar(value="")
+        search_entry = ttk.Entry(search_bar, textvariable=self.ent_search_var, width=28)
+        search_entry.grid(row=0, column=0, sticky="e")
+        search_entry.bind("<Return>", lambda _e: self._open_search(self.ent_search_var.get()))
+        ttk.Button(search_bar, text="Rechercher", command=lambda: self._open_search(self.ent_search_var.get())
+                   ).grid(row=0, column=1, padx=(6, 0))
+
         box_type = ttk.Labelframe(self.tab_ent, text="Type d'entretien (pour ce véhicule)", padding=10)
         box_type.grid(row=1, column=0, sticky="nsew", pady=(10, 0))
         for c in range(6):
@@ -2954,11 +7716,13 @@ class GarageApp(tk.Tk):
                 "1) Conso (L/100 km)",
                 "2) Prix du litre",
                 "3) Coût entretien (€/an)",
+                GRAPH_VIEW_COMPARE,
+                GRAPH_VIEW_TCO,
             ],
             width=24,
         )
         self.graph_choice_cb.grid(row=0, column=1, sticky="w", padx=(10, 0))
-        self.graph_choice_cb.bind("<<ComboboxSelected>>", lambda _e: self._refresh_graph())
+        self.graph_choice_cb.bind("<<ComboboxSelected>>", self._on_graph_choice_change)
 
         # Seuil de masquage conso (appliqué au graphe 1)
         ttk.Label(controls, text="Conso :").grid(row=0, column=2, sticky="e", padx=(10, 0))
@@ -2978,6 +7742,41 @@ class GarageApp(tk.Tk):
         self.conso_mask_cb.grid(row=0, column=3, sticky="e", padx=(10, 0))
         self.conso_mask_cb.bind("<<ComboboxSelected>>", lambda _e: self._refresh_graph())
 
+        # Période affichée : préréglage ou bornes saisies (JJ/MM/AAAA), filtrées en SQL
+        period = ttk.Frame(controls)
+        period.grid(row=1, column=0, columnspan=4, sticky="w", pady=(8, 0))
+        ttk.Label(period, text="Période :").grid(row=0, column=0, sticky="w")
+        self.graph_period_var = tk.StringVar(value=GRAPH_PERIODS[-1][0])
+        self.graph_period_cb = ttk.Combobox(
+            period,
+            textvariable=self.graph_period_var,
+            state="readonly",
+            values=[label for label, _months in GRAPH_PERIODS] + [GRAPH_PERIOD_CUSTOM],
+            width=22,
+        )
+        self.graph_period_cb.grid(row=0, column=1, sticky="w", padx=(10, 0))
+        self.graph_period_cb.bind("<<ComboboxSelected>>", self._on_graph_period_preset)
+
+        self.graph_from_var = tk.StringVar(value="")
+        self.graph_to_var = tk.StringVar(value="")
+        for col, (label, var) in enumerate((("Du :", self.graph_from_var), ("Au :", self.graph_to_var))):
+            ttk.Label(period, text=label).grid(row=0, column=2 + 2 * col, sticky="e", padx=(12, 0))
+            ent = ttk.Entry(period, textvariable=var, width=11)
+            ent.grid(row=0, column=3 + 2 * col, sticky="w", padx=(6, 0))
+            ent.bind("<Return>", self._on_graph_period_edit)
+            ent.bind("<FocusOut>", self._on_graph_period_edit)
+
+        # Véhicules comparés (vue comparaison uniquement) : sélection multiple
+        self.graph_compare_frame = ttk.Frame(controls)
+        self.graph_compare_frame.grid(row=2, column=0, columnspan=4, sticky="ew", pady=(8, 0))
+        self.graph_compare_frame.columnconfigure(1, weight=1)
+        ttk.Label(self.graph_compare_frame, text="Comparer :").grid(row=0, column=0, sticky="nw")
+        self.graph_compare_list = tk.Listbox(self.graph_compare_frame, height=4, selectmode="extended",
+                                             exportselection=False)
+        self.graph_compare_list.grid(row=0, column=1, sticky="ew", padx=(10, 0))
+        self.graph_compare_list.bind("<<ListboxSelect>>", lambda _e: self._refresh_graph())
+        self.graph_compare_frame.grid_remove()
+
         # Zone de rendu
         self.graph_area = ttk.Frame(self.tab_graphs)
         self.graph_area.grid(row=2, column=0, sticky="nsew", pady=(12, 0))
@@ -3008,6 +7807,52 @@ class GarageApp(tk.Tk):
 
         self._refresh_graph()
 
+    def _on_graph_choice_change(self, _evt=None):
+        if self.graph_choice_var.get() == GRAPH_VIEW_COMPARE:
+            self.graph_compare_frame.grid()
+        else:
+            self.graph_compare_frame.grid_remove()
+        self._refresh_graph()
+
+    def _fill_graph_compare_list(self, labels):
+        """Liste des véhicules comparables ; conserve la sélection (tout sélectionné au départ)."""
+        lb = self.graph_compare_list
+        first = not getattr(self, "_graph_compare_filled", False)
+        keep = set(self._graph_compare_ids()) if not first else None
+        self._graph_compare_index_to_id = list(self._vehicle_index_to_id)
+        lb.delete(0, "end")
+        for i, (vid, label) in enumerate(zip(self._vehicle_index_to_id, labels)):
+            lb.insert("end", label)
+            if first or vid in keep:
+                lb.selection_set(i)
+        self._graph_compare_filled = True
+
+    def _graph_compare_ids(self) -> list[int]:
+        ids = getattr(self, "_graph_compare_index_to_id", [])
+        return [ids[i] for i in self.graph_compare_list.curselection() if i < len(ids)]
+
+    def _on_graph_period_preset(self, _evt=None):
+        if self.graph_period_var.get() == GRAPH_PERIOD_CUSTOM:
+            return  # bornes laissées à la saisie
+        months = dict(GRAPH_PERIODS).get(self.graph_period_var.get())
+        self.graph_from_var.set("" if months is None else _add_months(date.today(), -months).strftime("%d/%m/%Y"))
+        self.graph_to_var.set("")
+        self._refresh_graph()
+
+    def _on_graph_period_edit(self, _evt=None):
+        bounds = (self.graph_from_var.get().strip(), self.graph_to_var.get().strip())
+        if bounds == getattr(self, "_graph_period_shown", ("", "")):
+            return
+        self.graph_period_var.set(GRAPH_PERIOD_CUSTOM if any(bounds) else GRAPH_PERIODS[-1][0])
+        self._refresh_graph()
+
+    def _graph_period(self):
+        """(since, until) AAAA-MM-JJ saisis dans l'onglet Graphiques ; borne vide ou invalide = ouverte."""
+        if not hasattr(self, "graph_from_var"):
+            return None, None
+        self._graph_period_shown = (self.graph_from_var.get().strip(), self.graph_to_var.get().strip())
+        return tuple(_date_from_jjmmaa(v) for v in self._graph_period_shown)
+
     def _on_graph_vehicle_change(self, _evt=None):
         idx = self.graph_vehicle_cb.current()
         if idx is None or idx < 0:
@@ -3015,6 +7860,7 @@ class GarageApp(tk.Tk):
         self.active_vehicle_id = self._vehicle_index_to_id[idx]
         self._refresh_all_tabs_after_vehicle_change(source="graphs")
 
+    @perf_timed("Graphiques")
     def _refresh_graph(self):
         if not MATPLOTLIB_AVAILABLE or Figure is None or getattr(self, "_graph_canvas", None) is None:
             return
@@ -3042,6 +7888,7 @@ class GarageApp(tk.Tk):
                 max_l100 = float(m.group(1))
         except Exception:
             max_l100 = 15.0
+        since, until = self._graph_period()
 
         def hide(ax):
             ax.clear()
@@ -3052,16 +7899,16 @@ class GarageApp(tk.Tk):
             for ax in axes:
                 ax.set_axis_on()
 
-            self._plot_conso_per_fill(axes[0], max_l100=max_l100)
-            self._plot_price_per_litre(axes[1])
-            self._plot_entretien_cost_per_year(axes[2])
+            self._plot_conso_per_fill(axes[0], max_l100=max_l100, since=since, until=until)
+            self._plot_price_per_litre(axes[1], since=since, until=until)
+            self._plot_entretien_cost_per_year(axes[2], since=since, until=until)
 
             # layout stable
             fig.subplots_adjust(left=0.08, right=0.98, top=0.98, bottom=0.06, hspace=0.35)
 
         elif choice == "1) Conso (L/100 km)":
             axes[0].set_axis_on()
-            self._plot_conso_per_fill(axes[0], max_l100=max_l100)
+            self._plot_conso_per_fill(axes[0], max_l100=max_l100, since=since, until=until)
             # agrandir axe 0
             axes[0].set_position([0.08, 0.10, 0.90, 0.86])
             for ax in axes[1:]:
@@ -3069,14 +7916,28 @@ class GarageApp(tk.Tk):
 
         elif choice == "2) Prix du litre":
             axes[0].set_axis_on()
-            self._plot_price_per_litre(axes[0])
+            self._plot_price_per_litre(axes[0], since=since, until=until)
+            axes[0].set_position([0.08, 0.10, 0.90, 0.86])
+            for ax in axes[1:]:
+                hide(ax)
+
+        elif choice == GRAPH_VIEW_COMPARE:
+            for ax in axes:
+                ax.set_axis_on()
+            names = dict(zip(self._graph_compare_index_to_id, self.graph_compare_list.get(0, "end")))
+            plot_fleet_comparison(axes, self._graph_compare_ids(), names, since=since, until=until, max_l100=max_l100)
+            fig.subplots_adjust(left=0.08, right=0.98, top=0.98, bottom=0.06, hspace=0.35)
+
+        elif choice == GRAPH_VIEW_TCO:
+            axes[0].set_axis_on()
+            plot_tco(axes[0], self.active_vehicle_id, since=since, until=until)
             axes[0].set_position([0.08, 0.10, 0.90, 0.86])
             for ax in axes[1:]:
                 hide(ax)
 
         elif choice == "3) Coût entretien (€/an)":
             axes[0].set_axis_on()
-            self._plot_entretien_cost_per_year(axes[0])
+            self._plot_entretien_cost_per_year(axes[0], since=since, until=until)
             axes[0].set_position([0.08, 0.10, 0.90, 0.86])
             for ax in axes[1:]:
                 hide(ax)
@@ -3096,373 +7957,31 @@ class GarageApp(tk.Tk):
 
     def _apply_dark_style(self, ax):
         """Applique un style sombre (idempotent) à un axe Matplotlib."""
-        ax.set_facecolor("#1e1e1e")
-        ax.tick_params(colors="#dddddd")
-        ax.xaxis.label.set_color("#dddddd")
-        ax.yaxis.label.set_color("#dddddd")
-        # Grille discrète
-        ax.grid(True, axis="y", linestyle=":", linewidth=0.6, alpha=0.30)
-        # Spines
-        for sp in ax.spines.values():
-            sp.set_color("#777777")
-        ax.title.set_color("#dddddd")
-
-
+        _graph_dark_style(ax)
 
     def _title_in_ax(self, ax, text_label):
         """Titre placé dans le graphe, en haut à gauche."""
-        ax.set_title("")
-        ax.text(
-            0.01, 0.99, text_label,
-            transform=ax.transAxes,
-            ha="left", va="top",
-            fontsize=10,
-            color="#dddddd",
-            bbox=dict(boxstyle="round,pad=0.25", facecolor="#000000", edgecolor="#666666", alpha=0.35),
-        )
-
-    def _plot_conso_per_fill(self, ax, max_l100=15.0):
-        """Conso (L/100) robuste (moyenne par blocs de km) + masquage des pics."""
-        self._apply_dark_style(ax)
-        self._title_in_ax(ax, "Conso (L/100 km)")
-
-        WINDOW_KM = 200  # bloc de distance pour calcul représentatif
-
-        conn = _connect_db()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT date_iso, km, litres
-            FROM pleins
-            WHERE vehicule_id = ? AND km IS NOT NULL AND litres IS NOT NULL
-            ORDER BY km ASC, date_iso ASC, id ASC
-            """,
-            (int(self.active_vehicle_id),),
-        )
-        rows = cur.fetchall()
-        conn.close()
-
-        if not rows or len(rows) < 2:
-            ax.text(0.5, 0.5, "Pas assez de pleins (>= 2).", ha="center", va="center",
-                    transform=ax.transAxes, color="#dddddd")
-            ax.set_ylabel("L/100 km")
-            ax.set_xlabel("")
-            return
-
-        xs = []
-        ys = []
-        masked = 0
-
-        prev_km = None
-        km_cum = 0.0
-        litres_cum = 0.0
-
-        for r in rows:
-            km = _safe_int(r["km"])
-            litres = _safe_float(r["litres"])
-            if km is None or litres is None:
-                continue
-
-            if prev_km is None:
-                prev_km = km
-                continue
-
-            dkm = km - prev_km
-            prev_km = km
-            if dkm <= 0:
-                continue
-
-            km_cum += float(dkm)
-            litres_cum += float(litres)
-
-            if km_cum >= float(WINDOW_KM):
-                conso = (litres_cum / km_cum) * 100.0
-                if conso > float(max_l100):
-                    masked += 1
-                else:
-                    d = _parse_iso_date(r["date_iso"])
-                    xs.append(d if d else km)
-                    ys.append(conso)
-
-                km_cum = 0.0
-                litres_cum = 0.0
-
-        if not xs:
-            ax.text(
-                0.5, 0.5,
-                f"Données insuffisantes (ou tout masqué).\nAstuce : baisse WINDOW_KM ou augmente le seuil.",
-                ha="center", va="center", transform=ax.transAxes, color="#dddddd"
-            )
-            ax.set_ylabel("L/100 km")
-            ax.set_xlabel("")
-            return
-
-        line = ax.plot(xs, ys, marker="o", linewidth=2)[0]
-
-        ax.set_ylabel("L/100 km")
-        ax.set_xlabel("")
-
-        # rotation si dates
-        try:
-            for tick in ax.get_xticklabels():
-                tick.set_rotation(20)
-                tick.set_ha("right")
-        except Exception:
-            pass
-
-        # Compteur points masqués (bas droite)
-        if masked:
-            ax.text(
-                0.99, 0.01,
-                f"{masked} point(s) masqué(s) (> {float(max_l100):.0f} L/100)",
-                transform=ax.transAxes,
-                ha="right", va="bottom",
-                fontsize=8,
-                color="#bbbbbb",
-            )
-
-    def _plot_price_per_litre(self, ax):
-        self._apply_dark_style(ax)
-
-        # Titre adapté à l'énergie du véhicule
-        energie = ""
-        try:
-            v = get_vehicle(int(self.active_vehicle_id))
-            energie = (v["energie"] or "").strip()
-        except Exception:
-            energie = ""
-
-        def _fuel_phrase(e: str) -> str:
-            e_low = e.lower()
-            if any(k in e_low for k in ("ess", "sp95", "sp98", "e10")):
-                return "d’essence"
-            if any(k in e_low for k in ("dies", "gazo", "gasoil", "gazole")):
-                return "de gasoil"
-            if "e85" in e_low:
-                return "d’E85"
-            if "gpl" in e_low:
-                return "de GPL"
-            # fallback générique
-            return "d’" + e if e[:1].lower() in "aeiouyàâäéèêëîïôöùûüœ" else "de " + e
-
-        if energie:
-            self._title_in_ax(ax, f"Prix du litre {_fuel_phrase(energie)} dans le temps")
-        else:
-            self._title_in_ax(ax, "Prix du litre dans le temps")
-
-        conn = _connect_db()
-
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT date_iso, prix_litre
-            FROM pleins
-            WHERE vehicule_id = ? AND date_iso IS NOT NULL AND prix_litre IS NOT NULL
-            ORDER BY date_iso ASC, id ASC
-            """,
-            (int(self.active_vehicle_id),),
-        )
-        rows = cur.fetchall()
-        conn.close()
-
-        if not rows:
-            ax.text(0.5, 0.5, "Aucun plein avec prix/L à tracer.", ha="center", va="center",
-                    transform=ax.transAxes, color="#dddddd")
-            ax.set_ylabel("€/L")
-            ax.set_xlabel("")
-            return
-
-        xs, ys = [], []
-        for r in rows:
-            d = _parse_iso_date(r["date_iso"])
-            v = _safe_float(r["prix_litre"])
-            if d is None or v is None:
-                continue
-            xs.append(d)
-            ys.append(v)
-
-        if not xs:
-            ax.text(0.5, 0.5, "Données insuffisantes.", ha="center", va="center",
-                    transform=ax.transAxes, color="#dddddd")
-            ax.set_ylabel("€/L")
-            ax.set_xlabel("")
-            return
-
-        ax.plot(xs, ys, marker="o", linewidth=2)
-        ax.set_ylabel("€/L")
-        ax.set_xlabel("")
-        for tick in ax.get_xticklabels():
-            tick.set_rotation(20)
-            tick.set_ha("right")
-
-
-
-    def _plot_entretien_cost_per_year(self, ax):
-        """Coût entretien par an, séparé Entretiens vs Réparations."""
-        self._apply_dark_style(ax)
-        self._title_in_ax(ax, "Coût entretien (€/an)")
-
-        conn = _connect_db()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT date_iso, cout, kind, intervention, details
-            FROM entretiens
-            WHERE vehicule_id = ? AND date_iso IS NOT NULL AND cout IS NOT NULL
-            ORDER BY date_iso ASC, id ASC
-            """,
-            (int(self.active_vehicle_id),),
-        )
-        rows = cur.fetchall()
-        conn.close()
-
-        if not rows:
-            ax.text(
-                0.5, 0.5, "Aucun entretien avec coût à tracer.",
-                ha="center", va="center", transform=ax.transAxes, color="#dddddd"
-            )
-            ax.set_ylabel("€")
-            ax.set_xlabel("")
-            return
-
-        import unicodedata
-
-        def norm(s):
-            if s is None:
-                return ""
-            s = str(s)
-            s = unicodedata.normalize("NFKD", s)
-            s = "".join(ch for ch in s if not unicodedata.combining(ch))
-            return s.lower().strip()
-
-        repair_keys = (
-            "repar", "depann", "panne", "casse", "diagnost", "garagiste", "garage",
-            "embrayage", "turbo", "inject", "pompe", "alternat", "demarreur",
-            "joint", "culasse", "boite", "distribution", "radiateur", "amortisseur",
-            "triangle", "rotule", "roulement", "cardan", "fuite", "freinage"
-        )
-
-        def is_repair(r):
-            # sqlite3.Row -> accès par index/nom (pas .get)
-            kind = norm(r["kind"]) if "kind" in r.keys() else ""
-            inter = norm(r["intervention"]) if "intervention" in r.keys() else ""
-            det = norm(r["details"]) if "details" in r.keys() else ""
-            blob = f"{kind} {inter} {det}"
-            return any(k in blob for k in repair_keys)
-
-        # Agrégation annuelle
-        year_ent = {}
-        year_rep = {}
-
-        for r in rows:
-            d = _parse_iso_date(r["date_iso"])
-            if not d:
-                continue
-            y = int(d.year)
-            try:
-                cost = float(r["cout"])
-            except Exception:
-                continue
-
-            if is_repair(r):
-                year_rep[y] = year_rep.get(y, 0.0) + cost
-            else:
-                year_ent[y] = year_ent.get(y, 0.0) + cost
-
-        years = sorted(set(year_ent.keys()) | set(year_rep.keys()))
-        if not years:
-            ax.text(
-                0.5, 0.5, "Aucune donnée exploitable.",
-                ha="center", va="center", transform=ax.transAxes, color="#dddddd"
-            )
-            ax.set_ylabel("€")
-            ax.set_xlabel("")
-            return
-
-        ent_vals = [year_ent.get(y, 0.0) for y in years]
-        rep_vals = [year_rep.get(y, 0.0) for y in years]
-
-        import numpy as np
-        x = np.arange(len(years), dtype=float)
-        width = 0.38
-
-        # Barres: couleurs fixées (bleu/orange) pour rester lisible
-        bars_ent = ax.bar(x - width/2, ent_vals, width=width, color="#1f77b4", label="Entretiens")
-        bars_rep = ax.bar(x + width/2, rep_vals, width=width, color="#ff7f0e", label="Réparations")
-
-        ax.set_ylabel("€")
-        ax.set_xlabel("")
-        ax.set_xticks(x)
-        ax.set_xticklabels([str(y) for y in years], color="#dddddd")
-
-        # suppression du trait qui donne l'impression d'un repere année precis   
-        ax.tick_params(axis="x", which="both", length=0)
-
-        # Légende en haut à droite, compacte
-        leg = ax.legend(loc="upper right", frameon=True, fontsize=9)
-        if leg and leg.get_frame():
-            leg.get_frame().set_facecolor("#1e1e1e")
-            leg.get_frame().set_edgecolor("#666666")
-            leg.get_frame().set_alpha(0.6)
-
-        def annotate(bars):
-            for b in bars:
-                h = float(b.get_height())
-                if h <= 0:
-                    continue
-
-                ax.text(
-                    b.get_x() + b.get_width()/2,
-                    h / 2,              # <-- milieu vertical de la barre
-                    f"{h:.0f}€",
-                    ha="center",
-                    va="center",        # <-- centré verticalement
-                    fontsize=8,
-                    color="#ffffff",    # plus lisible au milieu
-                    fontweight="bold",
-                )
+        _graph_title(ax, text_label)
 
+    def _plot_conso_per_fill(self, ax, max_l100=15.0, since=None, until=None):
+        plot_conso_per_fill(ax, self.active_vehicle_id, max_l100=max_l100, since=since, until=until)
 
-        annotate(bars_ent)
-        annotate(bars_rep)
+    def _plot_price_per_litre(self, ax, since=None, until=None):
+        plot_price_per_litre(ax, self.active_vehicle_id, since=since, until=until)
 
-        # Un peu d'air en bas pour les labels
-        ax.set_ylim(bottom=0)
+    def _plot_entretien_cost_per_year(self, ax, since=None, until=None):
+        plot_entretien_cost_per_year(ax, self.active_vehicle_id, since=since, until=until)
 
-    def _plot_entretien_cost_per_month(self, ax):
-        conn = _connect_db()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT SUBSTR(date_iso, 1, 7) AS ym, SUM(cout) AS total
-            FROM entretiens
-            WHERE vehicule_id = ? AND date_iso IS NOT NULL AND cout IS NOT NULL
-            GROUP BY SUBSTR(date_iso, 1, 7)
-            ORDER BY ym ASC
-            """,
-            (int(self.active_vehicle_id),),
-        )
-        rows = cur.fetchall()
-        conn.close()
+    def _plot_entretien_cost_per_month(self, ax, since=None, until=None):
+        per_month = vehicle_snapshot(self.active_vehicle_id, since, until).monthly_costs("entretien")
 
-        if not rows:
+        if not per_month:
             ax.text(0.5, 0.5, "Aucun entretien avec coût à tracer.", ha="center", va="center")
             ax.set_title("Coût entretien par mois")
             return
 
-        labels = []
-        values = []
-        for r in rows:
-            ym = r["ym"]
-            total = _safe_float(r["total"])
-            if ym and total is not None:
-                labels.append(ym)
-                values.append(total)
-
-        if not labels:
-            ax.text(0.5, 0.5, "Données insuffisantes.", ha="center", va="center")
-            ax.set_title("Coût entretien par mois")
-            return
+        labels = sorted(per_month)
+        values = [per_month[ym] for ym in labels]
 
         ax.bar(labels, values)
         ax.set_title("Coût entretien par mois")
@@ -3491,14 +8010,10 @@ class GarageApp(tk.Tk):
             self.tree_types.delete(item)
 
         for r in list_vehicle_types(self.active_vehicle_id):
-            type_id = int(r["type_id"])
-            type_name = r["type_name"]
-            freq = _format_frequency(r["period_km"], r["period_months"])
-            enabled = 1
-            try:
-                enabled = int(r["enabled"]) if r["enabled"] is not None else 1
-            except Exception:
-                enabled = 1
+            type_id = r.type_id
+            type_name = r.type_name
+            freq = _format_frequency(r.period_km, r.period_months)
+            enabled = 1 if r.enabled is None else r.enabled
             self.tree_types.insert("", "end", values=("☑" if enabled else "☐", type_name, freq))
             self._type_name_to_id[type_name] = type_id
 
@@ -3622,20 +8137,21 @@ class GarageApp(tk.Tk):
         if not names:
             self.new_type.set("")
 
+    @perf_timed("Entretiens")
     def _refresh_entretiens(self):
         for item in self.tree_ent.get_children():
             self.tree_ent.delete(item)
         for r in list_entretiens_full(self.active_vehicle_id):
             self.tree_ent.insert("", "end", values=(
-                int(r["id"]),
-                _fmt_date(r["date_iso"]),
-                r["km"] or "",
-                r["type_name"] or "",
-                r["kind"] or "",
-                _fmt_num(r["cout"], 2),
-                r["performed_by"] or "",
-                _fmt_num(r["battery_voltage"], 2),
-                r["details"] or "",
+                r.id,
+                _fmt_date(r.date),
+                r.km or "",
+                r.type_name or "",
+                r.kind or "",
+                _fmt_num(r.cout, 2),
+                r.performed_by or "",
+                _fmt_num(r.battery_voltage, 2),
+                r.details or "",
             ))
 
     def _selected_entretien_id(self):
@@ -3698,11 +8214,16 @@ class GarageApp(tk.Tk):
 
         details = self.new_details.get().strip()
 
-        insert_entretien(self.active_vehicle_id, date_iso, km, kind, type_id, cout, by, details, vbat)
-        self._refresh_entretiens()
-        self._refresh_vehicle_forms()
-        self._refresh_general_overview()
-        self._set_status("Entretien enregistré.")
+
+        def done(_res):
+            self._refresh_entretiens()
+            self._refresh_vehicle_forms()
+            self._refresh_general_overview()
+            self._set_status("Entretien enregistré.")
+
+        db_worker().run(self, insert_entretien, self.active_vehicle_id, date_iso, km, kind, type_id, cout, by,
+                        details, vbat, on_done=done)
+        self._set_status("Enregistrement de l'entretien…")
 
         self.new_date.set("")
         self.new_km.set("")
@@ -3738,11 +8259,14 @@ class GarageApp(tk.Tk):
             return
         if not messagebox.askyesno("Confirmer", "Supprimer cet entretien ?"):
             return
-        delete_entretien(eid)
-        self._refresh_entretiens()
-        self._refresh_vehicle_forms()
-        self._refresh_general_overview()
-        self._set_status("Entretien supprimé.")
+
+        def done(_res):
+            self._refresh_entretiens()
+            self._refresh_vehicle_forms()
+            self._refresh_general_overview()
+            self._set_status("Entretien supprimé.")
+
+        db_worker().run(self, delete_entretien, eid, on_done=done)
 
     # ---------- Refresh / Sync ----------
 
@@ -3788,6 +8312,7 @@ class GarageApp(tk.Tk):
         except Exception:
             pass
 
+    @perf_timed("Tout (_refresh_all)")
     def _refresh_all(self):
         self.vehicles_rows = list_vehicles()
         if not self.vehicles_rows:
@@ -3813,9 +8338,12 @@ class GarageApp(tk.Tk):
         self.pl_vehicle_cb["values"] = labels
         self.ent_vehicle_cb["values"] = labels
         self.graph_vehicle_cb["values"] = labels
+        if hasattr(self, "graph_compare_list"):
+            self._fill_graph_compare_list(labels)
 
         self._refresh_all_tabs_after_vehicle_change(source="init")
 
+    @perf_timed("Changement de véhicule")
     def _refresh_all_tabs_after_vehicle_change(self, source=""):
 
         if not getattr(self, "_vehicle_index_to_id", None) or self.active_vehicle_id is None:
@@ -3862,9 +8390,160 @@ class GarageApp(tk.Tk):
         self._set_status("")
 
 
-def main():
+def _parse_args(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="garage", description=APP_TITLE)
+    parser.add_argument("--render-graphs", metavar="DOSSIER",
+                        help="rend les graphes de tous les véhicules dans DOSSIER (sans interface)")
+    parser.add_argument("--format", choices=("png", "svg"), default="png",
+                        help="format des images (--render-graphs)")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="nombre de processus pour le rendu (défaut : nombre de coeurs), de workers pour --serve")
+    parser.add_argument("--rebuild-aggregates", action="store_true",
+                        help="reconstruit les agrégats de coûts (couts_mensuels) depuis l'historique")
+    parser.add_argument("--archive-before", metavar="AAAA-MM-JJ",
+                        help="déplace les pleins / entretiens antérieurs à cette date dans garage_archive.db")
+    parser.add_argument("--due", type=int, metavar="N", default=None,
+                        help="affiche les N prochaines échéances d'entretien de toute la flotte")
+    parser.add_argument("--backup", nargs="?", const="", metavar="DOSSIER",
+                        help="sauvegarde la base et les photos (dans DOSSIER ou le dossier réglé)")
+    parser.add_argument("--export", metavar="ARCHIVE",
+                        help="exporte base + photos dans une archive .tar.xz / .tar.gz")
+    parser.add_argument("--import", dest="import_path", metavar="ARCHIVE",
+                        help="restaure une archive exportée (la base actuelle est sauvegardée avant)")
+    parser.add_argument("--export-changes", metavar="FICHIER",
+                        help="exporte les modifications depuis le dernier export (.jsonl ou .jsonl.gz)")
+    parser.add_argument("--since", type=int, metavar="N", default=None,
+                        help="avec --export-changes : exporte à partir du n° de journal N")
+    parser.add_argument("--apply-changes", metavar="FICHIER",
+                        help="applique un fichier de modifications exporté par un autre poste")
+    parser.add_argument("--serve", nargs="?", const=f"{API_DEFAULT_HOST}:{API_DEFAULT_PORT}", metavar="[HOTE:]PORT",
+                        help=f"lance l'API HTTP JSON en lecture seule (défaut {API_DEFAULT_HOST}:{API_DEFAULT_PORT})")
+    parser.add_argument("--stall-ms", type=int, metavar="MS", default=None,
+                        help=f"seuil de détection des blocages de l'interface (défaut {STALL_THRESHOLD_MS}, 0 : désactivé)")
+    parser.add_argument("--profile-sql", action="store_true",
+                        help=f"mesure les requêtes SQL et affiche le rapport en sortie (ou {SQL_PROFILE_ENV}=1)")
+    # parse_known_args : macOS peut ajouter ses propres arguments (-psn_...) au lancement
+    args, _unknown = parser.parse_known_args(argv)
+    return args
+
+
+def main(argv=None):
+    import multiprocessing
+    multiprocessing.freeze_support()  # pool de processus dans l'exécutable PyInstaller
+
+    args = _parse_args(argv)
+    if args.stall_ms is not None:
+        os.environ[STALL_ENV] = str(args.stall_ms)
+    if args.profile_sql or os.environ.get(SQL_PROFILE_ENV, "") not in ("", "0"):
+        sql_profiler().enabled = True
+        atexit.register(lambda: print(sql_profiler().report(), file=sys.stderr))
+
+    if args.archive_before:
+        if not _parse_iso_date(args.archive_before):
+            print("Date invalide (attendu AAAA-MM-JJ).", file=sys.stderr)
+            raise SystemExit(2)
+        _ensure_schema()
+        moved = call_with_busy_retry(archive_history, args.archive_before)
+        print(f"Archivé : {moved.get('pleins', 0)} plein(s), {moved.get('entretiens', 0)} entretien(s) "
+              f"-> {ARCHIVE_DB_FILE}")
+        raise SystemExit(0)
+
+    if args.backup is not None:
+        _ensure_schema()
+        res = backup_now(args.backup or None)
+        print(res["path"])
+        for path in res["removed"]:
+            print(f"Supprimée (rotation) : {path}")
+        raise SystemExit(0)
+
+    if args.export:
+        _ensure_schema()
+        res = export_snapshot(args.export)
+        print(f"{res['path']} : {res['files']} fichier(s), {res['bytes']} octets")
+        raise SystemExit(0)
+
+    if args.import_path:
+        _ensure_schema()
+        try:
+            res = import_snapshot(args.import_path)
+        except (ValueError, OSError, tarfile.TarError) as e:
+            print(f"Import impossible : {e}", file=sys.stderr)
+            raise SystemExit(1)
+        if res["backup"]:
+            print(f"Ancienne base sauvegardée : {res['backup']}")
+        print(f"Photos : {res['photos_written']} écrite(s), {res['photos_unchanged']} inchangée(s)")
+        raise SystemExit(0)
+
+    if args.serve:
+        host, _sep, port = args.serve.rpartition(":")
+        if not port.isdigit():
+            print("Adresse invalide (attendu [HOTE:]PORT).", file=sys.stderr)
+            raise SystemExit(2)
+        _ensure_schema()
+        serve_api(host or API_DEFAULT_HOST, int(port), workers=args.jobs or API_WORKERS)
+        raise SystemExit(0)
+
+    if args.export_changes:
+        _ensure_schema()
+        res = export_changes(args.export_changes, since=args.since)
+        print(f"{res['path']} : {res['changes']} modification(s), n°{res['since'] + 1} à {res['until']}")
+        raise SystemExit(0)
+
+    if args.apply_changes:
+        _ensure_schema()
+        try:
+            res = call_with_busy_retry(apply_changes, args.apply_changes)
+        except (ValueError, OSError, sqlite3.Error) as e:
+            print(f"Application impossible : {e}", file=sys.stderr)
+            raise SystemExit(1)
+        print(f"Appliquées : {res['applied']}, déjà connues : {res['skipped']}, "
+              f"renumérotées : {res['remapped']}, refusées : {res['rejected']}")
+        raise SystemExit(1 if res["rejected"] else 0)
+
+    if args.due is not None:
+        _ensure_schema()
+        today = date.today()
+        for it in reminder_index().next_due(max(1, args.due)):
+            print(f"{_fmt_due(it, today)}\t{it['vehicule']}\t{it['type_name']}\t{it['label']}")
+        raise SystemExit(0)
+
+    if args.rebuild_aggregates:
+        _ensure_schema()
+        n = rebuild_cost_aggregates()
+        print(f"Agrégats reconstruits : {n} ligne(s).")
+        raise SystemExit(0)
+
+    if args.render_graphs:
+        if not MATPLOTLIB_AVAILABLE:
+            print("Matplotlib indisponible : installe matplotlib pour rendre les graphes.", file=sys.stderr)
+            raise SystemExit(1)
+        _ensure_schema()
+        written, errors = render_all_graphs(args.render_graphs, fmt=args.format, jobs=args.jobs)
+        for path in written:
+            print(path)
+        for vid, err in errors:
+            print(f"Véhicule #{vid} : {err}", file=sys.stderr)
+        raise SystemExit(1 if errors else 0)
+
     app = GarageApp()
     app.mainloop()
+    if app._stall_watchdog is not None:
+        app._stall_watchdog.stop()  # histogramme de la session dans blocages.log
+    db_worker().stop()  # termine les écritures encore en file avant de quitter
+    backup_worker().stop(timeout=None)  # laisse finir une sauvegarde commencée
+    try:
+        conn = _connect_db()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # remet le fichier -wal à zéro
+        conn.close()
+    except sqlite3.Error:
+        pass  # autre instance encore ouverte : elle s'en chargera
+    try:
+        if backup_settings()["backup_on_exit"] and backup_has_changes():
+            backup_now()
+    except Exception as e:
+        print(f"Sauvegarde à la fermeture impossible : {e}", file=sys.stderr)
 
 
 if __name__ == "__main__":